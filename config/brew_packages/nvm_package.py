@@ -22,6 +22,9 @@ class NvmPackage(Package):
     """
 
     name: str = "nvm"
+    # the install script and `nvm install node` download over the network, and can stall
+    timeout: float = 1800
+    command_timeout: float = 900
 
     @property
     def is_installed(self) -> bool:
@@ -51,8 +54,9 @@ class NvmPackage(Package):
 
         self.logger.info("Installing nvm")
         try:
+            # `PROFILE=/dev/null` keeps the script from adding nvm to `.zshrc`, the shell init loads it lazily instead
             _ = self.run_cmd(
-                "curl -o- https://raw.githubusercontent.com/nvm-sh/nvm/v0.39.5/install.sh | bash",
+                "curl -o- https://raw.githubusercontent.com/nvm-sh/nvm/v0.39.5/install.sh | PROFILE=/dev/null bash",
                 shell=True,
                 capture_output=False,
             )
@@ -97,13 +101,14 @@ class NvmPackage(Package):
         self.run_cmd(["chmod", "+x", temp_script.name])
 
         # Run the script
+        # a timeout is raised rather than handled here, so that the package is reported as failed
         self.logger.info("Installing node, npm, react, and Next.js")
         try:
             _ = self.run_cmd(["zsh", temp_script.name])
         except subprocess.CalledProcessError as err:
             self.logger.error(f"Error installing node, npm, react, and Next.js: {err}")
-            os.remove(temp_script.name)
             return False
+        finally:
+            os.remove(temp_script.name)
 
-        os.remove(temp_script.name)
         return True
@@ -3,3 +3,7 @@ DOTFILES_TO_OVERWRITE = [".gitconfig", ".gitignore", ".gitmessage", "pip.conf"]
 
 # append to these dotfiles
 DOTFILES_TO_APPEND = [".zshrc"]
+
+# copy these skills instead of symlinking them, for tools that can't follow symlinks into this repo. Patterns are
+# relative to the home directory, e.g. ".codex/skills/*" or ".claude/skills/deslop"
+SKILLS_TO_COPY = []
@@ -2,29 +2,27 @@
 from __future__ import annotations
 
 import argparse
-import re
-from dataclasses import dataclass
-from datetime import datetime
+import json
+import sqlite3
+import sys
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
+
+# modules next to this script, which python finds through its resolved path, also when it's run through a symlink
+from memory_index import CACHE_DIR_NAME, MemoryIndex, cache_dir, search_index
+from memory_search import (
+    MemoryDoc,
+    Query,
+    doc_json,
+    format_doc,
+    scan_batch,
+    scan_docs,
+    split_args,
+    top_docs,
+)
+from memory_server import SOCKET_FILE, request_server, serve
 
 MEMORY_DIR = Path.home() / ".codex" / "memories"
-EXCLUDE_DIRS = {".git"}
-DEFAULT_EXCLUDE_DIRS = {"rollout_summaries"}
-
-
-@dataclass(frozen=True)
-class MemoryDoc:
-    path: Path
-    title: str
-    usefulness: int
-    last_read_raw: str | None
-    last_read: datetime | None
-    tags: list[str]
-    scope: str
-    keywords: list[str]
-    tag_match: int
-    query_match: int
 
 
 def parse_args() -> argparse.Namespace:
@@ -51,6 +49,12 @@ def parse_args() -> argparse.Namespace:
         default="",
         help="Case-insensitive text query. Any term may match; title and metadata matches rank first.",
     )
+    parser.add_argument(
+        "--fuzzy",
+        action="store_true",
+        help="Also match words that contain a query term (e.g. siteEnroll) or are a typo away from it, ranked after "
+        "whole-word matches. Needs the index.",
+    )
     parser.add_argument(
         "--include-rollouts",
         action="store_true",
@@ -67,213 +71,190 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Show usefulness, last_read, tags, and scope.",
     )
-    return parser.parse_args()
-
-
-def iter_markdown(root: Path, include_rollouts: bool) -> Iterable[Path]:
-    excluded = set(EXCLUDE_DIRS)
-    if not include_rollouts:
-        excluded.update(DEFAULT_EXCLUDE_DIRS)
-
-    for path in sorted(root.rglob("*.md")):
-        parts = set(path.relative_to(root).parts)
-        if parts & excluded:
-            continue
-        yield path
-
-
-def parse_doc(
-    path: Path,
-    root: Path,
-    wanted_tags: list[str],
-    query_terms: list[str],
-    require_all_tags: bool,
-) -> MemoryDoc | None:
-    text = path.read_text(encoding="utf-8", errors="replace")
-    meta = parse_metadata(text)
-    tags = normalize_list(meta.get("memory_tags") or meta.get("read_win_tags"))
-    keywords = normalize_list(meta.get("keywords"))
-    scope = meta.get("scope") or meta.get("applies_to") or ""
-    title = extract_title(text) or path.relative_to(root).name
-    tag_match = count_tag_matches(tags=tags, wanted_tags=wanted_tags)
-    query_metadata = " ".join(
-        [title, scope, str(path.relative_to(root)), *tags, *keywords]
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help=f"Parse every file instead of using the index in ~/.cache/{CACHE_DIR_NAME}.",
     )
-    query_match = count_query_matches(text, query_terms, metadata=query_metadata)
-
-    if wanted_tags:
-        if tag_match == 0:
-            return None
-        if require_all_tags and len({tag.lower() for tag in wanted_tags}) > tag_match:
-            return None
-
-    if query_terms and query_match == 0:
-        return None
-
-    rel_path = path.relative_to(root)
-    return MemoryDoc(
-        path=rel_path,
-        title=title,
-        usefulness=parse_int(meta.get("usefulness")),
-        last_read_raw=meta.get("last_read"),
-        last_read=parse_datetime(meta.get("last_read")),
-        tags=tags,
-        scope=scope,
-        keywords=keywords,
-        tag_match=tag_match,
-        query_match=query_match,
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Read searches from stdin, one JSON object per line with tags, query, limit, require_all, "
+        "include_rollouts, and fuzzy, defaulting to the other options. Write one JSON line of results per search.",
     )
-
-
-def parse_metadata(text: str) -> dict[str, str]:
-    meta: dict[str, str] = {}
-    lines = text.splitlines()
-    scan_lines = lines[:80]
-
-    if scan_lines and scan_lines[0].strip() == "---":
-        for index, line in enumerate(scan_lines[1:], start=1):
-            if line.strip() == "---":
-                scan_lines = scan_lines[1:index]
-                break
-
-    current_key: str | None = None
-    list_values: dict[str, list[str]] = {}
-    in_fence = False
-    for raw in scan_lines:
-        line = raw.rstrip()
-        if line.strip().startswith("```"):
-            in_fence = not in_fence
-            continue
-        if in_fence:
-            continue
-        if not line.strip():
-            continue
-        if current_key and line.startswith("  - "):
-            list_values.setdefault(current_key, []).append(line[4:].strip())
-            continue
-        match = re.match(r"^([A-Za-z][A-Za-z0-9_-]*):\s*(.*)$", line)
-        if not match:
-            continue
-        key, value = match.group(1), match.group(2).strip()
-        current_key = key if value == "" else None
-        meta.setdefault(key, value)
-
-    for key, values in list_values.items():
-        meta.setdefault(key, ", ".join(values))
-    return meta
-
-
-def normalize_list(value: str | None) -> list[str]:
-    if not value:
-        return []
-    return [item.strip() for item in re.split(r"[,;]", value) if item.strip()]
-
-
-def parse_int(value: str | None) -> int:
-    try:
-        return int(value or "0")
-    except ValueError:
-        return 0
-
-
-def parse_datetime(value: str | None) -> datetime | None:
-    if not value:
-        return None
-    cleaned = value.strip()
-    if cleaned.endswith("Z"):
-        cleaned = f"{cleaned[:-1]}+00:00"
-    try:
-        return datetime.fromisoformat(cleaned)
-    except ValueError:
-        return None
-
-
-def extract_title(text: str) -> str | None:
-    for line in text.splitlines():
-        if line.startswith("# "):
-            return line[2:].strip()
-    return None
-
-
-def count_tag_matches(
-    tags: list[str],
-    wanted_tags: list[str],
-) -> int:
-    if not wanted_tags:
-        return 0
-    exact = {tag.casefold() for tag in tags}
-    return sum(1 for tag in wanted_tags if tag.casefold() in exact)
-
-
-def count_query_matches(
-    text: str,
-    query_terms: list[str],
-    metadata: str = "",
-) -> int:
-    if not query_terms:
-        return 0
-    unique_terms = list(dict.fromkeys(term.casefold() for term in query_terms))
-    body_matches = sum(1 for term in unique_terms if query_term_matches(text, term))
-    metadata_matches = sum(
-        1 for term in unique_terms if query_term_matches(metadata, term)
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=f"Answer queries from a warm index over a socket in ~/.cache/{CACHE_DIR_NAME}, until idle for an hour. "
+        "Queries use the server when it's running.",
     )
-    return body_matches + (metadata_matches * 4)
-
-
-def query_term_matches(text: str, term: str) -> bool:
-    escaped = re.escape(term)
-    prefix = r"(?<!\w)" if term[:1].isalnum() else ""
-    suffix = r"(?!\w)" if term[-1:].isalnum() else ""
-    return re.search(f"{prefix}{escaped}{suffix}", text, re.IGNORECASE) is not None
+    parser.add_argument(
+        "--kb-script",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="With --serve, a list_kb.py script whose queries the server also answers. Repeat for several. Queries "
+        "for other scripts are answered in-process.",
+    )
+    return parser.parse_args()
 
 
-def sort_key(doc: MemoryDoc) -> tuple[object, ...]:
-    last_read_ts = doc.last_read.timestamp() if doc.last_read else 0.0
-    return (
-        -doc.tag_match,
-        -doc.query_match,
-        -doc.usefulness,
-        -last_read_ts,
-        str(doc.path).lower(),
+def parse_query(request: object, args: argparse.Namespace) -> Query:
+    """
+    Parse a line of `--batch` input
+
+    :param request: Decoded JSON object, whose `tags` are a list or a comma-separated string, and whose `query` is a
+                    string of terms. Missing keys default to the command line options
+    :raises ValueError: If the request isn't an object, or a value has the wrong type
+    """
+    if not isinstance(request, dict):
+        raise ValueError("a search must be a JSON object")
+    tags = request.get("tags", args.tags)
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    query = request.get("query", args.query)
+    limit = request.get("limit", args.limit)
+    require_all = request.get("require_all", args.require_all)
+    include_rollouts = request.get("include_rollouts", args.include_rollouts)
+    fuzzy = request.get("fuzzy", args.fuzzy)
+    if (
+        not isinstance(tags, list)
+        or not all(isinstance(tag, str) for tag in tags)
+        or not isinstance(query, str)
+        or not isinstance(limit, int)
+        or not isinstance(require_all, bool)
+        or not isinstance(include_rollouts, bool)
+        or not isinstance(fuzzy, bool)
+    ):
+        raise ValueError(
+            "tags must be a string or a list of strings, query a string, limit an integer, and require_all, "
+            "include_rollouts, and fuzzy booleans"
+        )
+    return Query(
+        wanted_tags=[tag.strip() for tag in tags if tag.strip()],
+        query_terms=query.split(),
+        require_all_tags=require_all,
+        include_rollouts=include_rollouts,
+        limit=limit,
+        fuzzy=fuzzy,
     )
 
 
-def format_doc(doc: MemoryDoc, show_meta: bool) -> str:
-    if not show_meta:
-        return str(doc.path)
-    tags = ", ".join(doc.tags) if doc.tags else "none"
-    keywords = ", ".join(doc.keywords) if doc.keywords else "none"
-    last_read = doc.last_read_raw or "unknown"
-    pieces = [
-        str(doc.path),
-        f"usefulness={doc.usefulness}",
-        f"last_read={last_read}",
-        f"tags={tags}",
-        f"keywords={keywords}",
-    ]
-    if doc.scope:
-        pieces.append(f"scope={doc.scope}")
-    return " | ".join(pieces)
+def run_batch(
+    root: Path, args: argparse.Namespace, lines: Iterable[str]
+) -> Iterator[str]:
+    """
+    Run the searches of `--batch` input against a single refresh of the index, or a single scan
+
+    :return: A JSON line per input line: `{"request": ..., "results": [...]}` with the best `limit` results in order,
+             or `{"request": ..., "error": ...}` if the line isn't a valid search
+    """
+    requests: list[object] = []
+    queries: dict[int, Query] = {}
+    errors: dict[int, str] = {}
+    for position, line in enumerate(line for line in lines if line.strip()):
+        try:
+            requests.append(json.loads(line))
+            queries[position] = parse_query(requests[-1], args)
+        except ValueError as err:
+            if len(requests) == position:
+                requests.append(line.rstrip("\n"))
+            errors[position] = str(err)
+
+    def answer(position: int, docs: Iterable[MemoryDoc]) -> str:
+        return json.dumps(
+            {
+                "request": requests[position],
+                "results": [
+                    doc_json(doc) for doc in top_docs(docs, queries[position].limit)
+                ],
+            }
+        )
+
+    def error(position: int) -> str:
+        return json.dumps({"request": requests[position], "error": errors[position]})
+
+    printed = 0
+    if not args.no_index:
+        try:
+            index = MemoryIndex(root)
+            try:
+                index.refresh(any(query.include_rollouts for query in queries.values()))
+                for position in range(len(requests)):
+                    if position in errors:
+                        yield error(position)
+                    else:
+                        query = queries[position]
+                        docs = index.iter_search(
+                            query.wanted_tags,
+                            query.query_terms,
+                            query.require_all_tags,
+                            query.include_rollouts,
+                            query.fuzzy,
+                        )
+                        yield answer(position, docs)
+                    printed += 1
+                return
+            finally:
+                index.close()
+        except sqlite3.Error:
+            if printed:
+                raise
+            # e.g. a read-only memory root, parse every file instead
+
+    scanned = dict(zip(queries, scan_batch(root, list(queries.values()))))
+    for position in range(len(requests)):
+        yield (
+            error(position)
+            if position in errors
+            else answer(position, scanned[position])
+        )
 
 
 def main() -> int:
     args = parse_args()
 
     root = Path(args.root).expanduser().resolve()
-    wanted_tags = [tag.strip() for tag in args.tags.split(",") if tag.strip()]
-    query_terms = [term.strip() for term in args.query.split() if term.strip()]
-
-    docs: list[MemoryDoc] = []
-    for path in iter_markdown(root, args.include_rollouts):
-        doc = parse_doc(path, root, wanted_tags, query_terms, args.require_all)
-        if doc:
-            docs.append(doc)
-
-    docs.sort(key=sort_key)
-    if args.limit > 0:
-        docs = docs[: args.limit]
+    if args.serve:
+        return serve(root, args.kb_script, args.include_rollouts)
+    if args.batch:
+        for line in run_batch(root, args, sys.stdin):
+            print(line, flush=True)
+        return 0
 
-    for doc in docs:
+    printed = 0
+    if not args.no_index:
+        served = request_server(
+            cache_dir(root) / SOCKET_FILE,
+            {"tool": "memories", "args": {**vars(args), "root": str(root)}},
+        )
+        if served is not None:
+            for line in served:
+                print(line, flush=True)
+            return 0
+
+        try:
+            index = MemoryIndex(root)
+            try:
+                index.refresh(args.include_rollouts)
+                for line in search_index(index, args):
+                    print(line, flush=True)
+                    printed += 1
+                return 0
+            finally:
+                index.close()
+        except sqlite3.Error:
+            if printed:
+                raise
+            # e.g. a read-only memory root, parse every file instead
+
+    if args.fuzzy:
+        print("--fuzzy needs the index, matching whole words only", file=sys.stderr)
+    wanted_tags, query_terms = split_args(args)
+    docs = scan_docs(
+        root, wanted_tags, query_terms, args.require_all, args.include_rollouts
+    )
+    for doc in top_docs(docs, args.limit):
         print(format_doc(doc, args.show_meta))
     return 0
 
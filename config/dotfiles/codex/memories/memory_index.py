@@ -0,0 +1,572 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from memory_search import (
+    FIELDS,
+    FUZZY_MAX_WORDS,
+    WORD_RE,
+    MemoryDoc,
+    MemoryRecord,
+    bm25_score,
+    corpus_stats,
+    count_tag_matches,
+    edit_distance,
+    excluded_dirs,
+    format_doc,
+    in_rollouts,
+    is_match,
+    is_word,
+    iter_body,
+    make_doc,
+    max_edits,
+    parallel_map,
+    query_match_weight,
+    read_body,
+    read_record,
+    split_args,
+    split_words,
+    term_pattern,
+    top_docs,
+    trigrams,
+    unique_terms,
+    walk_markdown,
+)
+
+# the index and the server socket of a memory root are kept in a directory of their own under the user's cache
+# directory, see `cache_dir`, rather than in the root, which may be a synced git repository
+CACHE_DIR_NAME = "list_memories"
+
+# sqlite index of parsed metadata and terms. Bump the version when the schema or the parsing changes, and the index is
+# rebuilt
+INDEX_FILE = "index.sqlite3"
+INDEX_VERSION = 5
+
+
+def cache_dir(root: Path) -> Path:
+    """
+    Directory of the index and server socket of a resolved memory root, in `$XDG_CACHE_HOME`, or `~/.cache`
+
+    It's named after the root and a hash of its path, so that roots with the same name are kept apart.
+    """
+    cache_home = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    digest = hashlib.sha256(str(root).encode()).hexdigest()[:12]
+    return cache_home / CACHE_DIR_NAME / f"{root.name}_{digest}"
+
+
+class MemoryIndex:
+    """
+    Persistent index of parsed memory records and their terms, so that only changed files are parsed again
+
+    Files are keyed by path, mtime, and size. A refresh only reads their headers, bodies are indexed when a query
+    first needs them. The term dictionary is a contentless sqlite FTS5 table of each file's metadata and body, whose
+    postings give the occurrences of a word in each field without reading the files, and which doesn't keep a copy of
+    the text. Terms that aren't a single word (e.g. `PR-1830`) are looked up as a phrase, and counted in the files of
+    the phrase hits.
+
+    :raises sqlite3.Error: If the index can't be opened, e.g. in a read-only cache directory, or without FTS5 support
+    """
+
+    def __init__(self, root: Path, path: Path | None = None):
+        self.root = root
+        if path is None:
+            path = cache_dir(root) / INDEX_FILE
+            try:
+                path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            except OSError:
+                # sqlite reports that it can't open the index
+                pass
+        # the server shares the connection between threads, under a lock
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            self.db.executescript(
+                f"""
+                DROP TABLE IF EXISTS docs;
+                DROP TABLE IF EXISTS terms;
+                DROP TABLE IF EXISTS words;
+                DROP TABLE IF EXISTS word_trigrams;
+                DROP TABLE IF EXISTS stale_terms;
+                -- ids aren't reused, since stale rows of terms may still have them
+                CREATE TABLE docs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT UNIQUE NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    usefulness INTEGER NOT NULL,
+                    last_read TEXT,
+                    tags TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    keywords TEXT NOT NULL,
+                    -- in a directory that's only searched with --include-rollouts
+                    rollout INTEGER NOT NULL,
+                    -- lengths in words, for BM25. NULL until the body is indexed, the first time a query needs it
+                    body_length INTEGER,
+                    metadata_length INTEGER NOT NULL,
+                    -- the text that's indexed as the metadata field
+                    metadata TEXT NOT NULL
+                );
+                -- words are runs of letters, digits, and underscores, like `\\w+`. A contentless table can only take
+                -- out a row given the text it was indexed from, so the row of a doc whose body was indexed stays when
+                -- the doc is changed or removed, matching no doc, until `compact`
+                CREATE VIRTUAL TABLE terms USING fts5(
+                    metadata, body, content='', tokenize="unicode61 remove_diacritics 0 tokenchars '_'"
+                );
+                CREATE TABLE stale_terms (id INTEGER PRIMARY KEY);
+                -- the words of at least 3 characters, and their trigrams, for `--fuzzy`. Empty until a query first
+                -- needs them, then words are added as files are indexed. The words of removed files stay until a
+                -- rebuild, and just don't match any file
+                CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT UNIQUE NOT NULL);
+                CREATE TABLE word_trigrams (
+                    trigram TEXT NOT NULL,
+                    word INTEGER NOT NULL,
+                    PRIMARY KEY (trigram, word)
+                ) WITHOUT ROWID;
+                PRAGMA user_version = {INDEX_VERSION};
+                """
+            )
+        # occurrences of each word, by doc and field, and the distinct words
+        self.db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS temp.term_instances USING fts5vocab(main, terms, instance)"
+        )
+        self.db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS temp.term_rows USING fts5vocab(main, terms, row)"
+        )
+
+    def close(self) -> None:
+        self.db.close()
+
+    def refresh(self, include_rollouts: bool) -> int:
+        """
+        Parse the files that were added or changed since the last refresh, and forget the ones that were removed
+
+        Files in excluded directories are left in the index, so that `--include-rollouts` doesn't throw them out. The
+        terms are compacted once more of their rows are stale than not.
+
+        :return: Number of files parsed
+        """
+        stored = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.db.execute(
+                "SELECT path, mtime_ns, size FROM docs"
+            )
+        }
+        excluded = excluded_dirs(include_rollouts)
+        seen: set[str] = set()
+        changed: list[tuple[str, int, int]] = []
+        for rel_path, stat in walk_markdown(self.root, include_rollouts):
+            seen.add(rel_path)
+            if stored.get(rel_path) != (stat.st_mtime_ns, stat.st_size):
+                changed.append((rel_path, stat.st_mtime_ns, stat.st_size))
+
+        removed = [
+            path
+            for path in stored
+            if path not in seen and not set(path.split("/")) & excluded
+        ]
+        if not changed and not removed:
+            return 0
+
+        with self.db:
+            for rel_path in removed + [rel_path for rel_path, _, _ in changed]:
+                self._forget(rel_path)
+            known = self._known_words()
+            for parsed in parallel_map(self._read, changed):
+                if parsed is not None:
+                    self._add(*parsed, known)
+            stale, docs = self.db.execute(
+                "SELECT (SELECT count(*) FROM stale_terms), (SELECT count(*) FROM docs)"
+            ).fetchone()
+            if stale > docs:
+                self.compact()
+        return len(changed)
+
+    def compact(self) -> None:
+        """
+        Rebuild the terms without their stale rows, from the metadata of each doc
+
+        Bodies are indexed again the next time a query needs them, and the trigram index is dropped along with the
+        words of removed files, to be built again by the next `--fuzzy` query.
+        """
+        self.db.execute("INSERT INTO terms (terms) VALUES ('delete-all')")
+        self.db.execute(
+            "INSERT INTO terms (rowid, metadata, body) SELECT id, metadata, '' FROM docs"
+        )
+        self.db.execute("UPDATE docs SET body_length = NULL")
+        self.db.execute("DELETE FROM stale_terms")
+        self.db.execute("DELETE FROM word_trigrams")
+        self.db.execute("DELETE FROM words")
+
+    def _read(
+        self, changed: tuple[str, int, int]
+    ) -> tuple[str, int, int, MemoryRecord] | None:
+        """Parse the metadata of a changed file, in a worker thread, None if it can't be read anymore"""
+        rel_path, mtime_ns, size = changed
+        try:
+            record = read_record(self.root / rel_path, self.root)
+        except OSError:
+            return None
+        return rel_path, mtime_ns, size, record
+
+    def index_bodies(self, include_rollouts: bool) -> int:
+        """
+        Add the bodies of the searched files that were only parsed for metadata, so that queries can match them
+
+        Listing and filtering by tags only need metadata, so bodies are read the first time a query needs them.
+
+        :return: Number of bodies read
+        """
+        rows = self.db.execute(
+            "SELECT id, path, metadata FROM docs WHERE body_length IS NULL"
+            + ("" if include_rollouts else " AND NOT rollout")
+        ).fetchall()
+        if not rows:
+            return 0
+        with self.db:
+            known = self._known_words()
+            for doc_id, metadata, body, words in parallel_map(self._read_body, rows):
+                # replace the row of the metadata alone, which can be taken out, with the row of both fields
+                self.db.execute(
+                    "INSERT INTO terms (terms, rowid, metadata, body) VALUES ('delete', ?, ?, '')",
+                    (doc_id, metadata),
+                )
+                self.db.execute(
+                    "INSERT INTO terms (rowid, metadata, body) VALUES (?, ?, ?)",
+                    (doc_id, metadata, body),
+                )
+                self.db.execute(
+                    "UPDATE docs SET body_length = ? WHERE id = ?",
+                    (len(words), doc_id),
+                )
+                if known:
+                    self._add_words(words, known)
+        return len(rows)
+
+    def _read_body(self, row: tuple[int, str, str]) -> tuple[int, str, str, list[str]]:
+        """
+        Read a body, in a worker thread. A file that can't be read anymore has an empty body until it's refreshed
+
+        :return: Doc id, metadata, body, and its words
+        """
+        doc_id, rel_path, metadata = row
+        try:
+            body = read_body(self.root / rel_path)
+        except OSError:
+            body = ""
+        return doc_id, metadata, body, split_words(body)
+
+    def index_words(self) -> int:
+        """
+        Build the trigram index of words from the term dictionary, the first time a `--fuzzy` query needs it
+
+        Once it's built, files add their new words to it as they're indexed.
+
+        :return: Number of words added
+        """
+        if self.db.execute("SELECT EXISTS (SELECT 1 FROM words)").fetchone()[0]:
+            return 0
+        known: set[str] = set()
+        terms = [term for (term,) in self.db.execute("SELECT term FROM temp.term_rows")]
+        with self.db:
+            self._add_words(terms, known)
+        return len(known)
+
+    def _known_words(self) -> set[str]:
+        """Words in the trigram index, none if it isn't built"""
+        return {word for (word,) in self.db.execute("SELECT word FROM words")}
+
+    def _add_words(self, words: Iterable[str], known: set[str]) -> None:
+        """Add the words that aren't `known` yet to the trigram index, and to `known`"""
+        for word in set(words) - known:
+            word_trigrams = trigrams(word)
+            if not word_trigrams:
+                continue
+            known.add(word)
+            word_id = self.db.execute(
+                "INSERT INTO words (word) VALUES (?)", (word,)
+            ).lastrowid
+            self.db.executemany(
+                "INSERT INTO word_trigrams VALUES (?, ?)",
+                ((trigram, word_id) for trigram in word_trigrams),
+            )
+
+    def _forget(self, rel_path: str) -> None:
+        row = self.db.execute(
+            "SELECT id, metadata, body_length FROM docs WHERE path = ?", (rel_path,)
+        ).fetchone()
+        if row is None:
+            return
+        doc_id, metadata, body_length = row
+        if body_length is None:
+            self.db.execute(
+                "INSERT INTO terms (terms, rowid, metadata, body) VALUES ('delete', ?, ?, '')",
+                (doc_id, metadata),
+            )
+        else:
+            # the body it was indexed from isn't kept
+            self.db.execute("INSERT INTO stale_terms VALUES (?)", (doc_id,))
+        self.db.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+
+    def _add(
+        self,
+        rel_path: str,
+        mtime_ns: int,
+        size: int,
+        record: MemoryRecord,
+        known: set[str],
+    ) -> None:
+        """:param known: Words in the trigram index, whose new words are added to it if it's built"""
+        metadata_words = split_words(record.metadata)
+        doc_id = self.db.execute(
+            "INSERT INTO docs (path, mtime_ns, size, title, usefulness, last_read, tags, scope, keywords, rollout, "
+            "body_length, metadata_length, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                rel_path,
+                mtime_ns,
+                size,
+                record.title,
+                record.usefulness,
+                record.last_read_raw,
+                json.dumps(record.tags),
+                record.scope,
+                json.dumps(record.keywords),
+                in_rollouts(rel_path),
+                None,
+                len(metadata_words),
+                record.metadata,
+            ),
+        ).lastrowid
+        self.db.execute(
+            "INSERT INTO terms (rowid, metadata, body) VALUES (?, ?, '')",
+            (doc_id, record.metadata),
+        )
+        if known:
+            self._add_words(metadata_words, known)
+
+    def fuzzy_words(self, term: str) -> list[str]:
+        """
+        Indexed words, other than a casefolded query term itself, that contain it or are `max_edits` away from it
+
+        Only the words that share enough trigrams with the term are compared to it: all of its trigrams for a
+        substring, and all but the 3 that each edit can change for a typo.
+
+        :return: At most `FUZZY_MAX_WORDS` words, substrings first, then by edits and length
+        """
+        term_trigrams = trigrams(term)
+        if not term_trigrams:
+            return []
+        edits = max_edits(term)
+        rows = self.db.execute(
+            "SELECT word, shared FROM words JOIN (SELECT word AS id, count(*) AS shared FROM word_trigrams "
+            f"WHERE trigram IN ({', '.join('?' * len(term_trigrams))}) GROUP BY word HAVING shared >= ?) USING (id)",
+            (*term_trigrams, max(1, len(term_trigrams) - 3 * edits)),
+        )
+        matches = []
+        for word, shared in rows:
+            if word == term:
+                continue
+            if shared == len(term_trigrams) and term in word:
+                distance = 0
+            else:
+                distance = edit_distance(term, word, edits)
+                if not 0 < distance <= edits:
+                    continue
+            matches.append((distance, len(word), word))
+        return [word for _, _, word in sorted(matches)[:FUZZY_MAX_WORDS]]
+
+    def _term_frequencies(self, term: str) -> dict[int, tuple[int, int]]:
+        """Occurrences of a casefolded query term in the (body, metadata) of each doc it occurs in, by doc id"""
+        if is_word(term):
+            # a single word, which the postings answer exactly
+            counts: dict[int, list[int]] = {}
+            for doc_id, field, count in self.db.execute(
+                "SELECT doc, col, count(*) FROM temp.term_instances WHERE term = ? GROUP BY doc, col",
+                (term,),
+            ):
+                counts.setdefault(doc_id, [0, 0])[FIELDS.index(field)] = count
+            return {
+                doc_id: (body, metadata) for doc_id, (body, metadata) in counts.items()
+            }
+
+        # the words of the term must be next to each other, then the term itself is counted in the text
+        columns = "id, path, metadata, body_length IS NOT NULL"
+        if WORD_RE.search(term):
+            rows = self.db.execute(
+                f"SELECT {columns} FROM docs WHERE id IN (SELECT rowid FROM terms WHERE terms MATCH ?)",
+                ('"' + term.replace('"', '""') + '"',),
+            ).fetchall()
+        else:
+            rows = self.db.execute(f"SELECT {columns} FROM docs").fetchall()
+        pattern = term_pattern(term)
+
+        def count(row: tuple[int, str, str, bool]) -> tuple[int, tuple[int, int]]:
+            """Count the term in a doc, in a worker thread. Only an indexed body is read"""
+            doc_id, rel_path, metadata, has_body = row
+            body = 0
+            if has_body:
+                try:
+                    body = sum(
+                        len(pattern.findall(chunk))
+                        for chunk in iter_body(self.root / rel_path)
+                    )
+                except OSError:
+                    pass
+            return doc_id, (body, len(pattern.findall(metadata)))
+
+        return {
+            doc_id: counts
+            for doc_id, counts in parallel_map(count, rows)
+            if any(counts)
+        }
+
+    def search(
+        self,
+        wanted_tags: list[str],
+        query_terms: list[str],
+        require_all_tags: bool,
+        include_rollouts: bool,
+        fuzzy: bool = False,
+    ) -> list[MemoryDoc]:
+        """Find and score the matching memories, unsorted, like `scan_docs`. A query indexes missing bodies first"""
+        return list(
+            self.iter_search(
+                wanted_tags, query_terms, require_all_tags, include_rollouts, fuzzy
+            )
+        )
+
+    def iter_search(
+        self,
+        wanted_tags: list[str],
+        query_terms: list[str],
+        require_all_tags: bool,
+        include_rollouts: bool,
+        fuzzy: bool = False,
+    ) -> Iterator[MemoryDoc]:
+        """
+        Find and score the matching memories, like `search`
+
+        Without query terms, memories come in order of decreasing usefulness, and are only read from the index as
+        they're consumed, so that `top_docs` can stop early.
+
+        :param fuzzy: Also match the single-word terms to the `fuzzy_words` of each, which are scored as a separate
+                      `fuzzy_score`, with the occurrences of all of a term's words added up
+        """
+        terms = unique_terms(query_terms)
+        if terms:
+            self.index_bodies(include_rollouts)
+        if terms and fuzzy:
+            self.index_words()
+        frequencies: dict[int, dict[str, tuple[int, int]]] = {}
+        for term in terms:
+            for doc_id, counts in self._term_frequencies(term).items():
+                frequencies.setdefault(doc_id, {})[term] = counts
+        # occurrences of the words that only match a term with `--fuzzy`, added up per term
+        fuzzy_frequencies: dict[int, dict[str, tuple[int, int]]] = {}
+        fuzzy_terms = [term for term in terms if fuzzy and is_word(term)]
+        for term in fuzzy_terms:
+            for word in self.fuzzy_words(term):
+                for doc_id, (body, metadata) in self._term_frequencies(word).items():
+                    term_counts = fuzzy_frequencies.setdefault(doc_id, {})
+                    total_body, total_metadata = term_counts.get(term, (0, 0))
+                    term_counts[term] = (total_body + body, total_metadata + metadata)
+
+        visible = "" if include_rollouts else "NOT rollout"
+        columns = "id, path, title, usefulness, last_read, tags, scope, keywords, body_length, metadata_length"
+        if query_terms:
+            # only the docs that matched a term can be a result
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS matched (id INTEGER)")
+            self.db.execute("DELETE FROM matched")
+            self.db.executemany(
+                "INSERT INTO matched VALUES (?)",
+                ((doc_id,) for doc_id in frequencies.keys() | fuzzy_frequencies),
+            )
+            condition = " AND ".join(
+                filter(None, ["id IN (SELECT id FROM matched)", visible])
+            )
+        else:
+            condition = visible
+        rows = self.db.execute(
+            f"SELECT {columns} FROM docs"
+            + (f" WHERE {condition}" if condition else "")
+            + ("" if terms else " ORDER BY usefulness DESC")
+        )
+
+        stats = fuzzy_stats = None
+        if terms:
+            rows = rows.fetchall()
+            total_docs, body_length, metadata_length = self.db.execute(
+                "SELECT count(*), total(body_length), total(metadata_length) FROM docs"
+                + (f" WHERE {visible}" if visible else "")
+            ).fetchone()
+            doc_frequencies: Counter[str] = Counter()
+            fuzzy_doc_frequencies: Counter[str] = Counter()
+            for row in rows:
+                doc_frequencies.update(frequencies.get(row[0], {}).keys())
+                fuzzy_doc_frequencies.update(fuzzy_frequencies.get(row[0], {}).keys())
+            stats = corpus_stats(
+                total_docs, body_length, metadata_length, doc_frequencies
+            )
+            fuzzy_stats = corpus_stats(
+                total_docs, body_length, metadata_length, fuzzy_doc_frequencies
+            )
+
+        for row in rows:
+            doc_id, path, title, usefulness, last_read, tags, scope, keywords = row[:8]
+            tags = json.loads(tags)
+            tag_match = count_tag_matches(tags=tags, wanted_tags=wanted_tags)
+            term_counts = frequencies.get(doc_id, {})
+            fuzzy_counts = fuzzy_frequencies.get(doc_id, {})
+            query_match = query_match_weight(term_counts)
+            if not is_match(
+                tag_match,
+                query_match + query_match_weight(fuzzy_counts),
+                wanted_tags,
+                query_terms,
+                require_all_tags,
+            ):
+                continue
+            record = MemoryRecord(
+                path=Path(path),
+                title=title,
+                usefulness=usefulness,
+                last_read_raw=last_read,
+                tags=tags,
+                scope=scope,
+                keywords=json.loads(keywords),
+                metadata="",
+            )
+            lengths = (row[8], row[9])
+            score = bm25_score(term_counts, lengths, stats) if stats else 0.0
+            fuzzy_score = (
+                bm25_score(fuzzy_counts, lengths, fuzzy_stats) if fuzzy_stats else 0.0
+            )
+            yield make_doc(
+                record,
+                tag_match,
+                query_match,
+                score,
+                term_counts,
+                fuzzy_score,
+                fuzzy_counts,
+            )
+
+
+def search_index(index: MemoryIndex, args: argparse.Namespace) -> Iterator[str]:
+    """Formatted results of a search in an up to date index"""
+    wanted_tags, query_terms = split_args(args)
+    matches = index.iter_search(
+        wanted_tags, query_terms, args.require_all, args.include_rollouts, args.fuzzy
+    )
+    # without a query, matches come by usefulness, and the first ones are final before the search is done
+    best_tag_match = None if query_terms else len(wanted_tags)
+    for doc in top_docs(matches, args.limit, best_tag_match):
+        yield format_doc(doc, args.show_meta)
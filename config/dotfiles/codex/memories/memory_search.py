@@ -0,0 +1,782 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import itertools
+import math
+import mmap
+import os
+import re
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, TypeVar
+
+EXCLUDE_DIRS = {".git"}
+DEFAULT_EXCLUDE_DIRS = {"rollout_summaries"}
+
+# metadata is parsed from the first lines of a file, up to the end of its frontmatter
+HEADER_LINES = 80
+# bodies are matched in chunks of about this many bytes, split at line ends
+BODY_CHUNK = 1 << 20
+
+# a metadata match counts this many body matches
+METADATA_WEIGHT = 4
+
+# ranking is field-weighted BM25 (BM25F): k1 saturates repeated occurrences of a term, and b normalizes for how long
+# each field is compared to the average. Fields are (body, metadata), in that order
+BM25_K1 = 1.2
+BM25_B = 0.75
+FIELDS = ("body", "metadata")
+FIELD_WEIGHTS = (1.0, float(METADATA_WEIGHT))
+# what a result can match: its memory_tags, or query terms in one of FIELDS
+MATCH_FIELDS = ("tags", *FIELDS)
+
+WORD_RE = re.compile(r"\w+")
+
+# `--fuzzy` also matches the indexed words that contain a query term, or that are a typo or two away from it: one
+# edit (insertion, deletion, substitution, or transposition) for terms of at least FUZZY_MIN_LENGTH characters, two
+# from FUZZY_LONG_TERM. At most FUZZY_MAX_WORDS words, the closest, are matched per term
+FUZZY_MIN_LENGTH = 4
+FUZZY_LONG_TERM = 8
+FUZZY_MAX_WORDS = 32
+
+# threads that parse files, how many files each task parses, and how many tasks can wait to be consumed per thread
+PARSE_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+PARSE_CHUNK = 32
+PARSE_BACKLOG = 2
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass(frozen=True)
+class MemoryRecord:
+    """Everything parsed from a memory file that doesn't depend on the query"""
+
+    path: Path
+    title: str
+    usefulness: int
+    last_read_raw: str | None
+    tags: list[str]
+    scope: str
+    keywords: list[str]
+    # text that query terms are matched against as metadata
+    metadata: str
+
+
+@dataclass(frozen=True)
+class MemoryDoc:
+    path: Path
+    title: str
+    usefulness: int
+    last_read_raw: str | None
+    last_read: datetime | None
+    tags: list[str]
+    scope: str
+    keywords: list[str]
+    tag_match: int
+    query_match: int
+    # BM25 relevance to the query terms, 0 without a query
+    score: float = 0.0
+    # BM25 relevance of the words that only match the query terms with `--fuzzy`, which orders memories with the same
+    # score, so that whole-word matches come first
+    fuzzy_score: float = 0.0
+    # the MATCH_FIELDS that matched a wanted tag or a query term
+    matched_fields: tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class Query:
+    """A search, from the command line or a line of `--batch` input"""
+
+    wanted_tags: list[str]
+    query_terms: list[str]
+    require_all_tags: bool
+    include_rollouts: bool
+    limit: int
+    fuzzy: bool = False
+
+
+@dataclass(frozen=True)
+class CorpusStats:
+    """Statistics of the searched memories that BM25 scores depend on"""
+
+    docs: int
+    # average (body, metadata) lengths, in words
+    average_lengths: tuple[float, float]
+    # number of memories each query term occurs in
+    doc_frequencies: dict[str, int]
+
+
+def excluded_dirs(include_rollouts: bool) -> set[str]:
+    excluded = set(EXCLUDE_DIRS)
+    if not include_rollouts:
+        excluded.update(DEFAULT_EXCLUDE_DIRS)
+    return excluded
+
+
+def walk_markdown(
+    root: Path, include_rollouts: bool
+) -> Iterator[tuple[str, os.stat_result]]:
+    """
+    Walk the memory root with `os.scandir`, without descending into excluded directories
+
+    :return: Path relative to `root`, with `/` separators, and stat of each Markdown file, in directory order
+    """
+    excluded = excluded_dirs(include_rollouts)
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            with os.scandir(root / rel_dir) as entries:
+                for entry in entries:
+                    if entry.name in excluded:
+                        continue
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(rel_path)
+                        elif entry.name.endswith(".md") and entry.is_file():
+                            # the stat is cached on the entry, and follows symlinks like reading the file does
+                            yield rel_path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def in_rollouts(rel_path: str) -> bool:
+    """Check if a file is in a directory that's only searched with `--include-rollouts`"""
+    return bool(set(rel_path.split("/")) & DEFAULT_EXCLUDE_DIRS)
+
+
+def iter_markdown(root: Path, include_rollouts: bool) -> Iterable[Path]:
+    for rel_path, _ in walk_markdown(root, include_rollouts):
+        yield root / rel_path
+
+
+def parallel_map(function: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+    """
+    Call `function` on each item in a thread pool, yielding the results as they complete, in no particular order
+
+    Reading files releases the GIL, so this overlaps the I/O of a cold scan. Items are submitted in chunks, so that the
+    overhead of a task is shared by many files, and only as results are consumed, so that a bounded number of parsed
+    files are held at once.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as executor:
+        running: set[Future[list[R]]] = set()
+        exhausted = False
+        while running or not exhausted:
+            while not exhausted and len(running) < PARSE_WORKERS * PARSE_BACKLOG:
+                chunk = list(itertools.islice(items, PARSE_CHUNK))
+                if len(chunk) < PARSE_CHUNK:
+                    exhausted = True
+                if chunk:
+                    running.add(executor.submit(list, map(function, chunk)))
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+def read_header(path: Path) -> tuple[list[str], str | None]:
+    """
+    Read a file incrementally, only as far as its metadata and title
+
+    :return: The lines metadata is parsed from, which end at the closing `---` of frontmatter or after `HEADER_LINES`
+             lines, and the title, the first `# ` heading, which is read up to past the header if needed
+    """
+    header: list[str] = []
+    title: str | None = None
+    in_header = True
+    with open(path, encoding="utf-8", errors="replace") as file:
+        for raw in file:
+            # the same lines as `str.splitlines`, which also splits at e.g. form feeds
+            for line in raw.splitlines():
+                if title is None and line.startswith("# "):
+                    title = line[2:].strip()
+                if in_header:
+                    header.append(line)
+                    in_header = len(header) < HEADER_LINES and not (
+                        len(header) > 1
+                        and header[0].strip() == "---"
+                        and line.strip() == "---"
+                    )
+                if not in_header and title is not None:
+                    return header, title
+    return header, title
+
+
+def iter_body(path: Path) -> Iterator[str]:
+    """
+    Read the whole text of a file in chunks of about `BODY_CHUNK` bytes, which end at line ends
+
+    A file larger than a chunk is mapped rather than read, so it's never copied into memory at once. Query terms don't
+    contain whitespace, so no term is split between chunks.
+    """
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= BODY_CHUNK:
+            # mapping costs more than reading a small file
+            yield decode_text(file.read())
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = 0
+            while start < len(mapped):
+                end = mapped.find(b"\n", start + BODY_CHUNK) + 1 or len(mapped)
+                yield decode_text(mapped[start:end])
+                start = end
+
+
+def decode_text(data: bytes) -> str:
+    """Decode like reading the file in text mode, with universal newlines"""
+    text = data.decode("utf-8", errors="replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def read_body(path: Path) -> str:
+    return "".join(iter_body(path))
+
+
+def read_record(path: Path, root: Path) -> MemoryRecord:
+    """Parse the metadata of a memory file, without reading its body"""
+    header, title = read_header(path)
+    meta = parse_header(header)
+    tags = normalize_list(meta.get("memory_tags") or meta.get("read_win_tags"))
+    keywords = normalize_list(meta.get("keywords"))
+    scope = meta.get("scope") or meta.get("applies_to") or ""
+    title = title or path.relative_to(root).name
+    rel_path = path.relative_to(root)
+    record = MemoryRecord(
+        path=rel_path,
+        title=title,
+        usefulness=parse_int(meta.get("usefulness")),
+        last_read_raw=meta.get("last_read"),
+        tags=tags,
+        scope=scope,
+        keywords=keywords,
+        metadata=" ".join([title, scope, str(rel_path), *tags, *keywords]),
+    )
+    return record
+
+
+def is_match(
+    tag_match: int,
+    query_match: int,
+    wanted_tags: list[str],
+    query_terms: list[str],
+    require_all_tags: bool,
+) -> bool:
+    if wanted_tags:
+        if tag_match == 0:
+            return False
+        if require_all_tags and len({tag.lower() for tag in wanted_tags}) > tag_match:
+            return False
+
+    if query_terms and query_match == 0:
+        return False
+    return True
+
+
+def make_doc(
+    record: MemoryRecord,
+    tag_match: int,
+    query_match: int,
+    score: float = 0.0,
+    frequencies: dict[str, tuple[int, int]] | None = None,
+    fuzzy_score: float = 0.0,
+    fuzzy_frequencies: dict[str, tuple[int, int]] | None = None,
+) -> MemoryDoc:
+    """
+    :param frequencies: Occurrences of the query terms in the (body, metadata) of the memory
+    :param fuzzy_frequencies: Occurrences of the words that only match them with `--fuzzy`, by query term
+    """
+    return MemoryDoc(
+        path=record.path,
+        title=record.title,
+        usefulness=record.usefulness,
+        last_read_raw=record.last_read_raw,
+        last_read=parse_datetime(record.last_read_raw),
+        tags=record.tags,
+        scope=record.scope,
+        keywords=record.keywords,
+        tag_match=tag_match,
+        query_match=query_match,
+        score=score,
+        fuzzy_score=fuzzy_score,
+        matched_fields=matched_fields(
+            tag_match, frequencies or {}, fuzzy_frequencies or {}
+        ),
+    )
+
+
+def matched_fields(
+    tag_match: int, *frequencies: dict[str, tuple[int, int]]
+) -> tuple[str, ...]:
+    matched = {"tags"} if tag_match else set()
+    for term_frequencies in frequencies:
+        for counts in term_frequencies.values():
+            matched.update(field for field, count in zip(FIELDS, counts) if count)
+    return tuple(field for field in MATCH_FIELDS if field in matched)
+
+
+def scan_docs(
+    root: Path,
+    wanted_tags: list[str],
+    query_terms: list[str],
+    require_all_tags: bool,
+    include_rollouts: bool,
+) -> list[MemoryDoc]:
+    """
+    Parse every memory file and score the matches, without the index
+
+    :return: Matching memories, unsorted
+    """
+    query = Query(wanted_tags, query_terms, require_all_tags, include_rollouts, 0)
+    return scan_batch(root, [query])[0]
+
+
+def scan_batch(root: Path, queries: list[Query]) -> list[list[MemoryDoc]]:
+    """
+    Parse every memory file once, and score the matches of each query, like `scan_docs`
+
+    The terms of all the queries are counted in a single pass over each file, and each query is scored with the
+    statistics of the memories it searches.
+
+    :return: Matching memories of each query, unsorted
+    """
+    terms = unique_terms([term for query in queries for term in query.query_terms])
+    matcher = QueryMatcher(terms)
+
+    def match_file(
+        path: Path,
+    ) -> tuple[MemoryRecord, dict[str, tuple[int, int]], tuple[int, int]]:
+        record = read_record(path, root)
+        frequencies: dict[str, tuple[int, int]] = {}
+        lengths = (0, 0)
+        if terms:
+            # only a query needs the body
+            body_counts, body_length = matcher.count_chunks(iter_body(path))
+            metadata_counts, metadata_length = matcher.count(record.metadata)
+            lengths = (body_length, metadata_length)
+            for term, counts in zip(terms, zip(body_counts, metadata_counts)):
+                if any(counts):
+                    frequencies[term] = counts
+        return record, frequencies, lengths
+
+    include_rollouts = any(query.include_rollouts for query in queries)
+    parsed = list(parallel_map(match_file, iter_markdown(root, include_rollouts)))
+    return [match_query(parsed, query) for query in queries]
+
+
+def match_query(
+    parsed: list[tuple[MemoryRecord, dict[str, tuple[int, int]], tuple[int, int]]],
+    query: Query,
+) -> list[MemoryDoc]:
+    """
+    Score the matches of a query among parsed memories
+
+    :param parsed: Record, occurrences of terms in its (body, metadata), and their lengths, of each memory
+    """
+    terms = unique_terms(query.query_terms)
+    matches = []
+    docs = 0
+    total_lengths = [0, 0]
+    doc_frequencies: Counter[str] = Counter()
+    for record, all_frequencies, lengths in parsed:
+        if not query.include_rollouts and in_rollouts(record.path.as_posix()):
+            continue
+        # in query order, which BM25 sums in
+        frequencies = {
+            term: all_frequencies[term] for term in terms if term in all_frequencies
+        }
+        docs += 1
+        total_lengths[0] += lengths[0]
+        total_lengths[1] += lengths[1]
+        doc_frequencies.update(frequencies.keys())
+
+        tag_match = count_tag_matches(tags=record.tags, wanted_tags=query.wanted_tags)
+        query_match = query_match_weight(frequencies)
+        if is_match(
+            tag_match,
+            query_match,
+            query.wanted_tags,
+            query.query_terms,
+            query.require_all_tags,
+        ):
+            matches.append((record, tag_match, query_match, frequencies, lengths))
+
+    stats = corpus_stats(docs, total_lengths[0], total_lengths[1], doc_frequencies)
+    return [
+        make_doc(
+            record,
+            tag_match,
+            query_match,
+            bm25_score(frequencies, lengths, stats),
+            frequencies,
+        )
+        for record, tag_match, query_match, frequencies, lengths in matches
+    ]
+
+
+def parse_header(scan_lines: list[str]) -> dict[str, str]:
+    """Parse metadata from the first `HEADER_LINES` lines of a file, or fewer, if they include its frontmatter"""
+    meta: dict[str, str] = {}
+    if scan_lines and scan_lines[0].strip() == "---":
+        for index, line in enumerate(scan_lines[1:], start=1):
+            if line.strip() == "---":
+                scan_lines = scan_lines[1:index]
+                break
+
+    current_key: str | None = None
+    list_values: dict[str, list[str]] = {}
+    in_fence = False
+    for raw in scan_lines:
+        line = raw.rstrip()
+        if line.strip().startswith("```"):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        if not line.strip():
+            continue
+        if current_key and line.startswith("  - "):
+            list_values.setdefault(current_key, []).append(line[4:].strip())
+            continue
+        match = re.match(r"^([A-Za-z][A-Za-z0-9_-]*):\s*(.*)$", line)
+        if not match:
+            continue
+        key, value = match.group(1), match.group(2).strip()
+        current_key = key if value == "" else None
+        meta.setdefault(key, value)
+
+    for key, values in list_values.items():
+        meta.setdefault(key, ", ".join(values))
+    return meta
+
+
+def normalize_list(value: str | None) -> list[str]:
+    if not value:
+        return []
+    return [item.strip() for item in re.split(r"[,;]", value) if item.strip()]
+
+
+def parse_int(value: str | None) -> int:
+    try:
+        return int(value or "0")
+    except ValueError:
+        return 0
+
+
+def parse_datetime(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    cleaned = value.strip()
+    if cleaned.endswith("Z"):
+        cleaned = f"{cleaned[:-1]}+00:00"
+    try:
+        return datetime.fromisoformat(cleaned)
+    except ValueError:
+        return None
+
+
+def count_tag_matches(
+    tags: list[str],
+    wanted_tags: list[str],
+) -> int:
+    if not wanted_tags:
+        return 0
+    exact = {tag.casefold() for tag in tags}
+    return sum(1 for tag in wanted_tags if tag.casefold() in exact)
+
+
+def count_query_matches(
+    text: str,
+    query_terms: list[str],
+    metadata: str = "",
+) -> int:
+    if not query_terms:
+        return 0
+    matcher = QueryMatcher(unique_terms(query_terms))
+    body_matches = sum(1 for count in matcher.count(text)[0] if count)
+    metadata_matches = sum(1 for count in matcher.count(metadata)[0] if count)
+    return body_matches + (metadata_matches * METADATA_WEIGHT)
+
+
+def query_term_matches(text: str, term: str) -> bool:
+    return term_pattern(term).search(text) is not None
+
+
+def term_pattern(term: str) -> re.Pattern[str]:
+    """Regex of a whole term: a term that starts or ends with a letter or digit can't be part of a longer word"""
+    escaped = re.escape(term)
+    prefix = r"(?<!\w)" if term[:1].isalnum() else ""
+    suffix = r"(?!\w)" if term[-1:].isalnum() else ""
+    return re.compile(f"{prefix}{escaped}{suffix}", re.IGNORECASE)
+
+
+class QueryMatcher:
+    """
+    Counts the occurrences of all the query terms in a text, built once per query
+
+    The text is split into words once, which counts every single-word term, and the length of the text. A term that
+    isn't a single word (e.g. `PR-1830`) is searched for with its own regex, compiled here, and only in texts that have
+    all of its whole words.
+    """
+
+    def __init__(self, terms: list[str]):
+        """:param terms: Casefolded query terms, without duplicates"""
+        self.terms = terms
+        self.patterns = {
+            term: (term_pattern(term), whole_words(term))
+            for term in terms
+            if not is_word(term)
+        }
+
+    def count_chunks(self, chunks: Iterable[str]) -> tuple[list[int], int]:
+        """Count the terms in a text read in chunks, none of which splits a word or a term"""
+        counts = [0] * len(self.terms)
+        length = 0
+        for chunk in chunks:
+            chunk_counts, chunk_length = self.count(chunk)
+            counts = [total + count for total, count in zip(counts, chunk_counts)]
+            length += chunk_length
+        return counts, length
+
+    def count(self, text: str) -> tuple[list[int], int]:
+        """:return: Occurrences of each term, in the order of the terms, and the length of `text` in words"""
+        words = Counter(WORD_RE.findall(text.casefold()))
+        counts = []
+        for term in self.terms:
+            if term not in self.patterns:
+                counts.append(words[term])
+                continue
+            pattern, required = self.patterns[term]
+            if all(words[word] for word in required):
+                counts.append(len(pattern.findall(text)))
+            else:
+                counts.append(0)
+        return counts, sum(words.values())
+
+
+def whole_words(term: str) -> list[str]:
+    """Words of a term that can only match whole words of a text, e.g. `pr` and `1830` in `pr-1830`"""
+    return [
+        match.group()
+        for match in WORD_RE.finditer(term)
+        if (match.start() > 0 or term[0].isalnum())
+        and (match.end() < len(term) or term[-1].isalnum())
+    ]
+
+
+def unique_terms(query_terms: list[str]) -> list[str]:
+    return list(dict.fromkeys(term.casefold() for term in query_terms))
+
+
+def is_word(term: str) -> bool:
+    """Check if `term` is a single word, which matches exactly the words of a text that are equal to it"""
+    return (
+        WORD_RE.fullmatch(term) is not None and term[0].isalnum() and term[-1].isalnum()
+    )
+
+
+def split_words(text: str) -> list[str]:
+    """Casefolded words of a text, which `QueryMatcher.count` counts as its length"""
+    return WORD_RE.findall(text.casefold())
+
+
+def trigrams(word: str) -> set[str]:
+    return {word[index : index + 3] for index in range(len(word) - 2)}
+
+
+def max_edits(term: str) -> int:
+    """Typos a fuzzy match of a term can have. Short terms only match as substrings"""
+    if len(term) < FUZZY_MIN_LENGTH:
+        return 0
+    return 1 if len(term) < FUZZY_LONG_TERM else 2
+
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    """
+    Optimal string alignment distance: the number of insertions, deletions, substitutions, and transpositions of
+    adjacent characters that turn one string into the other, without editing a substring twice
+
+    :return: The distance, or `limit + 1` as soon as it's known to be more than `limit`
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    before_previous: list[int] = []
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first[i - 1] != second[j - 1]),
+            )
+            if (
+                i > 1
+                and j > 1
+                and first[i - 1] == second[j - 2]
+                and first[i - 2] == second[j - 1]
+            ):
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def query_match_weight(frequencies: dict[str, tuple[int, int]]) -> int:
+    """The same count as `count_query_matches`, from the (body, metadata) frequencies of the terms"""
+    return sum(
+        (1 if body else 0) + (METADATA_WEIGHT if metadata else 0)
+        for body, metadata in frequencies.values()
+    )
+
+
+def corpus_stats(
+    docs: int, body_length: float, metadata_length: float, doc_frequencies: Counter[str]
+) -> CorpusStats:
+    """
+    :param body_length: Total length of the bodies of the searched memories, in words
+    :param metadata_length: Total length of their metadata, in words
+    """
+    return CorpusStats(
+        docs=docs,
+        average_lengths=(body_length / docs, metadata_length / docs)
+        if docs
+        else (0.0, 0.0),
+        doc_frequencies=dict(doc_frequencies),
+    )
+
+
+def bm25_score(
+    frequencies: dict[str, tuple[int, int]],
+    lengths: tuple[int, int],
+    stats: CorpusStats,
+) -> float:
+    """
+    Field-weighted BM25 score of a memory
+
+    The occurrences of a term in each field are normalized by the field's length and weighted, then the sum is
+    saturated once, so a term that's in both fields doesn't count twice as much.
+
+    :param frequencies: Occurrences of each query term in the (body, metadata) of the memory, in query order
+    :param lengths: Lengths of the (body, metadata) of the memory, in words
+    """
+    score = 0.0
+    for term, counts in frequencies.items():
+        weighted = 0.0
+        for count, length, average, weight in zip(
+            counts, lengths, stats.average_lengths, FIELD_WEIGHTS
+        ):
+            if count:
+                weighted += weight * count / (1 - BM25_B + BM25_B * length / average)
+        doc_frequency = stats.doc_frequencies.get(term, 0)
+        idf = math.log(1 + (stats.docs - doc_frequency + 0.5) / (doc_frequency + 0.5))
+        score += idf * weighted * (BM25_K1 + 1) / (weighted + BM25_K1)
+    return score
+
+
+def sort_key(doc: MemoryDoc) -> tuple[object, ...]:
+    last_read_ts = doc.last_read.timestamp() if doc.last_read else 0.0
+    return (
+        -doc.tag_match,
+        -doc.score,
+        -doc.fuzzy_score,
+        -doc.usefulness,
+        -last_read_ts,
+        str(doc.path).lower(),
+    )
+
+
+def top_docs(
+    docs: Iterable[MemoryDoc], limit: int, best_tag_match: int | None = None
+) -> Iterator[MemoryDoc]:
+    """
+    Select the first `limit` docs by `sort_key`, or all of them if `limit` is 0, and yield them in order
+
+    Only the best docs seen so far are kept, in a sorted list of at most `limit`, rather than sorting all of them.
+
+    :param best_tag_match: Most tags any doc can match, if docs come in order of decreasing usefulness and without
+                           query scores. Then a doc is yielded as soon as no later doc can sort before it, and the rest
+                           of the docs aren't read once the first `limit` are known
+    """
+    # sorted by key
+    keys: list[tuple[object, ...]] = []
+    kept: list[MemoryDoc] = []
+    released = 0
+    for doc in docs:
+        if best_tag_match is not None:
+            # later docs are at most this useful, so any doc that sorts before the best of them is final
+            bound = (-best_tag_match, 0.0, 0.0, -doc.usefulness)
+            while keys and keys[0] < bound:
+                del keys[0]
+                yield kept.pop(0)
+                released += 1
+            if limit and released == limit:
+                return
+
+        key = sort_key(doc)
+        if limit and released + len(kept) == limit:
+            if key >= keys[-1]:
+                continue
+            keys.pop()
+            kept.pop()
+        position = bisect.bisect(keys, key)
+        keys.insert(position, key)
+        kept.insert(position, doc)
+
+    yield from kept
+
+
+def format_doc(doc: MemoryDoc, show_meta: bool) -> str:
+    if not show_meta:
+        return str(doc.path)
+    tags = ", ".join(doc.tags) if doc.tags else "none"
+    keywords = ", ".join(doc.keywords) if doc.keywords else "none"
+    last_read = doc.last_read_raw or "unknown"
+    pieces = [
+        str(doc.path),
+        f"usefulness={doc.usefulness}",
+        f"last_read={last_read}",
+        f"tags={tags}",
+        f"keywords={keywords}",
+    ]
+    if doc.scope:
+        pieces.append(f"scope={doc.scope}")
+    return " | ".join(pieces)
+
+
+def doc_json(doc: MemoryDoc) -> dict[str, object]:
+    """A result of `--batch`"""
+    return {
+        "path": doc.path.as_posix(),
+        "title": doc.title,
+        "score": doc.score,
+        "fuzzy_score": doc.fuzzy_score,
+        "tag_match": doc.tag_match,
+        "query_match": doc.query_match,
+        "matched_fields": list(doc.matched_fields),
+        "usefulness": doc.usefulness,
+        "last_read": doc.last_read_raw,
+        "tags": doc.tags,
+        "scope": doc.scope,
+        "keywords": doc.keywords,
+    }
+
+
+def split_args(args: argparse.Namespace) -> tuple[list[str], list[str]]:
+    """:return: Wanted tags and query terms"""
+    wanted_tags = [tag.strip() for tag in args.tags.split(",") if tag.strip()]
+    query_terms = [term.strip() for term in args.query.split() if term.strip()]
+    return wanted_tags, query_terms
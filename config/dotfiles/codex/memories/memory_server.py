@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Iterable, Iterator
+
+from memory_index import MemoryIndex, cache_dir, search_index
+
+# Unix socket of the query server (`--serve`), next to the index. The server refreshes its index this often, and exits
+# after this long without requests. Clients wait this long for an answer
+SOCKET_FILE = "server.sock"
+SERVE_POLL_SECONDS = 1.0
+SERVE_IDLE_SECONDS = 3600.0
+CLIENT_TIMEOUT_SECONDS = 30.0
+
+
+def request_server(
+    socket_path: Path, request: dict[str, object]
+) -> Iterator[str] | None:
+    """
+    Send a request to a `--serve` server
+
+    The server answers with JSON lines: a string per output line, then `{"ok": true}`, or `{"ok": false, "error": ...}`.
+
+    :return: Output lines as they arrive, or None if no server is running or it can't answer the request, so that the
+             caller searches in-process
+    :raises RuntimeError: While iterating, if the server fails after some of the output
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CLIENT_TIMEOUT_SECONDS)
+    try:
+        client.connect(str(socket_path))
+        client.sendall((json.dumps(request) + "\n").encode())
+        answer = client.makefile("r", encoding="utf-8")
+        first = json.loads(answer.readline() or "null")
+    except (OSError, ValueError):
+        client.close()
+        return None
+    if not isinstance(first, str) and not (isinstance(first, dict) and first["ok"]):
+        client.close()
+        return None
+
+    def lines() -> Iterator[str]:
+        with client, answer:
+            message = first
+            while isinstance(message, str):
+                yield message
+                message = json.loads(answer.readline() or "null")
+            if not (isinstance(message, dict) and message["ok"]):
+                raise RuntimeError(f"The list_memories server failed: {message}")
+
+    return lines()
+
+
+class MemoryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Answers list_memories and list_kb queries over a Unix socket, from an index that's kept open and up to date
+
+    `watch` refreshes the index every `SERVE_POLL_SECONDS` in the background, so queries don't walk the memory root,
+    and changes show up within that long. Rollout summaries are only walked once a query has included them. Requests
+    are answered one at a time, since they share the index. The socket is only accessible to the user, who can also
+    ask for `list_kb.py` queries, by the path of the script to load, which must be one of `kb_scripts`.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        root: Path,
+        socket_path: Path | None = None,
+        kb_scripts: Iterable[Path] = (),
+        include_rollouts: bool = False,
+    ):
+        self.root = root
+        # the only scripts a request may load, since loading one runs it in the server
+        self.kb_scripts = {
+            str(Path(script).expanduser().resolve()) for script in kb_scripts
+        }
+        self.include_rollouts = include_rollouts
+        # the index is opened first, which creates the directory of the default socket
+        self.index = MemoryIndex(root)
+        self.socket_path = socket_path or cache_dir(root) / SOCKET_FILE
+        self.lock = threading.Lock()
+        self.last_request = time.monotonic()
+        self.stopped = threading.Event()
+        # loaded `list_kb.py` scripts, by path, with their mtime
+        self.kb_modules: dict[str, tuple[int, ModuleType]] = {}
+        umask = os.umask(0o077)
+        try:
+            super().__init__(str(self.socket_path), MemoryRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self) -> None:
+        self.stopped.set()
+        super().server_close()
+        self.socket_path.unlink(missing_ok=True)
+        with self.lock:
+            self.index.close()
+
+    def watch(self) -> None:
+        """Refresh the index until the server stops, and stop it once it's idle"""
+        while not self.stopped.wait(SERVE_POLL_SECONDS):
+            if time.monotonic() - self.last_request > SERVE_IDLE_SECONDS:
+                self.shutdown()
+                return
+            with self.lock:
+                try:
+                    self.index.refresh(self.include_rollouts)
+                except sqlite3.Error as err:
+                    print(f"Could not refresh the index: {err}", file=sys.stderr)
+
+    def answer(self, request: dict[str, object]) -> Iterator[str]:
+        """Output lines of a request, with the lock held"""
+        if request.get("tool") == "kb":
+            module = self.kb_module(str(request["script"]))
+            return iter(
+                module.list_lines(
+                    request["tags"],
+                    request["require_all"],
+                    request["limit"],
+                    request["show_meta"],
+                )
+            )
+        args = argparse.Namespace(**request["args"])
+        if Path(args.root).expanduser().resolve() != self.root:
+            raise ValueError(f"This server searches {self.root}, not {args.root}")
+        if args.include_rollouts and not self.include_rollouts:
+            # rollouts haven't been refreshed so far, and are from now on
+            self.include_rollouts = True
+            self.index.refresh(include_rollouts=True)
+        return search_index(self.index, args)
+
+    def kb_module(self, script: str) -> ModuleType:
+        """
+        Load a `list_kb.py` script, again whenever it changes
+
+        :raises PermissionError: If the script isn't one of `kb_scripts`
+        """
+        script = str(Path(script).resolve())
+        if script not in self.kb_scripts:
+            raise PermissionError(f"This server doesn't answer queries for {script}")
+        mtime_ns = os.stat(script).st_mtime_ns
+        cached = self.kb_modules.get(script)
+        if cached is None or cached[0] != mtime_ns:
+            name = f"list_kb_{len(self.kb_modules)}"
+            spec = importlib.util.spec_from_file_location(name, script)
+            if spec is None or spec.loader is None:
+                raise ImportError(f"Could not load {script}")
+            module = importlib.util.module_from_spec(spec)
+            # dataclasses look up the module of their class
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+            cached = self.kb_modules[script] = (mtime_ns, module)
+        return cached[1]
+
+
+class MemoryRequestHandler(socketserver.StreamRequestHandler):
+    server: MemoryServer
+
+    def handle(self) -> None:
+        self.server.last_request = time.monotonic()
+        with self.server.lock:
+            try:
+                request = json.loads(self.rfile.readline())
+                for line in self.server.answer(request):
+                    self.send(line)
+            except BrokenPipeError:
+                return
+            except (ImportError, OSError, ValueError, sqlite3.Error) as err:
+                # reported to the client, so that it searches in-process, and the server keeps running. Anything
+                # else is a bug, which socketserver reports, and the client sees as a failed server
+                self.send({"ok": False, "error": f"{type(err).__name__}: {err}"})
+                return
+        self.send({"ok": True})
+
+    def send(self, message: object) -> None:
+        self.wfile.write((json.dumps(message) + "\n").encode())
+
+
+def serve(root: Path, kb_scripts: list[str], include_rollouts: bool) -> int:
+    socket_path = cache_dir(root) / SOCKET_FILE
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(socket_path))
+    except OSError:
+        # nothing is listening, the socket of a server that died can be replaced
+        socket_path.unlink(missing_ok=True)
+    else:
+        print(f"A server is already listening on {socket_path}", file=sys.stderr)
+        return 1
+    finally:
+        probe.close()
+
+    server = MemoryServer(
+        root, socket_path, [Path(script) for script in kb_scripts], include_rollouts
+    )
+    try:
+        with server.lock:
+            server.index.refresh(include_rollouts)
+        threading.Thread(target=server.watch, daemon=True).start()
+        print(f"Serving {root} on {socket_path}", file=sys.stderr)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
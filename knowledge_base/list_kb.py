@@ -2,14 +2,26 @@
 from __future__ import annotations
 
 import argparse
-from dataclasses import dataclass
+import hashlib
+import heapq
+import json
+import os
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 KB_DIR = Path(__file__).resolve().parent
 EXCLUDE_NAMES = {"README.md"}
 
+# memory root of the `list_memories.py --serve` server, which also answers KB queries, and how long to wait for it
+MEMORY_DIR = Path.home() / ".codex" / "memories"
+SERVER_TIMEOUT_SECONDS = 30.0
+
 
 @dataclass(frozen=True)
 class Article:
@@ -38,6 +50,21 @@ def parse_frontmatter(text: str) -> dict[str, object]:
     return parse_yaml_lines(lines[1:end_index])
 
 
+def read_frontmatter(path: Path) -> dict[str, object]:
+    """Parse the frontmatter of a file like `parse_frontmatter`, reading only as far as its closing `---`"""
+    lines: list[str] = []
+    with open(path, encoding="utf-8") as file:
+        for raw in file:
+            # the same lines as `str.splitlines`, which also splits at e.g. form feeds
+            for line in raw.splitlines():
+                if not lines and (not line.startswith("---") or line.strip() != "---"):
+                    return {}
+                if lines and line.strip() == "---":
+                    return parse_yaml_lines(lines[1:])
+                lines.append(line)
+    return {}
+
+
 def parse_yaml_lines(lines: list[str]) -> dict[str, object]:
     meta: dict[str, object] = {}
     current_key: Optional[str] = None
@@ -95,17 +122,13 @@ def normalize_tags(tags: object) -> list[str]:
 def load_article(
     path: Path, required_tags: list[str], require_all: bool
 ) -> Optional[Article]:
-    text = path.read_text(encoding="utf-8")
-    meta = parse_frontmatter(text)
+    meta = read_frontmatter(path)
     last_read_raw = meta.get("last_read")
     usefulness = parse_usefulness(meta.get("usefulness"))
     tags = normalize_tags(meta.get("read_win_tags"))
     tag_match = count_tag_matches(tags, required_tags)
-    if required_tags:
-        if require_all and tag_match != len(required_tags):
-            return None
-        if not require_all and tag_match == 0:
-            return None
+    if not is_tag_match(tag_match, required_tags, require_all):
+        return None
     return Article(
         name=path.name,
         path=path,
@@ -117,6 +140,26 @@ def load_article(
     )
 
 
+def iter_articles(kb_dir: Path) -> Iterator[Path]:
+    """Article files in `kb_dir`, in directory order, from a single `os.scandir`"""
+    with os.scandir(kb_dir) as entries:
+        for entry in entries:
+            if (
+                entry.name.endswith(".md")
+                and entry.name not in EXCLUDE_NAMES
+                and entry.is_file()
+            ):
+                yield Path(entry.path)
+
+
+def is_tag_match(tag_match: int, required_tags: list[str], require_all: bool) -> bool:
+    if not required_tags:
+        return True
+    if require_all:
+        return tag_match == len(required_tags)
+    return tag_match > 0
+
+
 def count_tag_matches(tags: list[str], required_tags: list[str]) -> int:
     if not required_tags:
         return 0
@@ -175,25 +218,156 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Show metadata columns alongside filenames.",
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Read queries from stdin, one JSON object per line with tags, require_all, and limit, defaulting to "
+        "the other options. Write one JSON line of results per query.",
+    )
     return parser.parse_args()
 
 
+def load_articles(required_tags: list[str], require_all: bool) -> list[Article]:
+    """Load the matching articles, in parallel, unsorted"""
+    load = partial(load_article, required_tags=required_tags, require_all=require_all)
+    with ThreadPoolExecutor() as executor:
+        return [
+            article for article in executor.map(load, iter_articles(KB_DIR)) if article
+        ]
+
+
+def first_articles(articles: list[Article], limit: int) -> list[Article]:
+    """The first `limit` articles by `sort_key`, or all of them if `limit` is 0, in order"""
+    if limit > 0:
+        # a heap of the first `limit`, rather than sorting all of them
+        return heapq.nsmallest(limit, articles, key=sort_key)
+    return sorted(articles, key=sort_key)
+
+
+def list_lines(
+    required_tags: list[str], require_all: bool, limit: int, show_meta: bool
+) -> list[str]:
+    articles = first_articles(load_articles(required_tags, require_all), limit)
+    show_match = bool(required_tags)
+    return [format_article(article, show_meta, show_match) for article in articles]
+
+
+def article_json(article: Article) -> dict[str, object]:
+    """A result of `--batch`"""
+    return {
+        "name": article.name,
+        "path": str(article.path),
+        "tag_match": article.tag_match,
+        "matched_fields": ["read_win_tags"] if article.tag_match else [],
+        "usefulness": article.usefulness,
+        "last_read": article.last_read_raw,
+        "tags": article.tags,
+    }
+
+
+def run_batch(args: argparse.Namespace, lines: Iterable[str]) -> Iterator[str]:
+    """
+    Answer each line of `--batch` input from a single load of the articles
+
+    A line is a JSON object whose `tags` are a list or a comma-separated string, and missing keys default to the
+    command line options.
+
+    :return: A JSON line per input line: `{"request": ..., "results": [...]}` with the first `limit` results in order,
+             or `{"request": ..., "error": ...}` if the line isn't a valid query
+    """
+    articles: Optional[list[Article]] = None
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as err:
+            yield json.dumps({"request": line.rstrip("\n"), "error": str(err)})
+            continue
+        options = request if isinstance(request, dict) else {}
+        tags = options.get("tags", args.tags)
+        if isinstance(tags, str):
+            tags = tags.split(",")
+        require_all = options.get("require_all", args.require_all)
+        limit = options.get("limit", args.limit)
+        if (
+            not isinstance(request, dict)
+            or not isinstance(tags, list)
+            or not all(isinstance(tag, str) for tag in tags)
+            or not isinstance(require_all, bool)
+            or not isinstance(limit, int)
+        ):
+            error = (
+                "a query must be a JSON object, whose tags are a string or a list of strings, require_all a boolean, "
+                "and limit an integer"
+            )
+            yield json.dumps({"request": request, "error": error})
+            continue
+
+        if articles is None:
+            articles = load_articles([], require_all=False)
+        required_tags = [tag.strip() for tag in tags if tag.strip()]
+        matches = []
+        for article in articles:
+            tag_match = count_tag_matches(article.tags, required_tags)
+            if is_tag_match(tag_match, required_tags, require_all):
+                matches.append(replace(article, tag_match=tag_match))
+        results = [article_json(article) for article in first_articles(matches, limit)]
+        yield json.dumps({"request": request, "results": results})
+
+
+def server_socket(memory_root: Path) -> Path:
+    """Socket of the server of a resolved memory root, where `cache_dir` in `list_memories.py` puts it"""
+    cache_home = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    digest = hashlib.sha256(str(memory_root).encode()).hexdigest()[:12]
+    return cache_home / "list_memories" / f"{memory_root.name}_{digest}" / "server.sock"
+
+
+def request_server(
+    socket_path: Path, request: dict[str, object]
+) -> Optional[list[str]]:
+    """
+    Ask a `list_memories.py --serve` server to run this script's query
+
+    :return: Output lines, or None if no server is running or it can't answer, so that the caller lists in-process
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(SERVER_TIMEOUT_SECONDS)
+            client.connect(str(socket_path))
+            client.sendall((json.dumps(request) + "\n").encode())
+            with client.makefile("r", encoding="utf-8") as answer:
+                messages = [json.loads(line) for line in answer]
+    except (OSError, ValueError):
+        return None
+    # output lines, then `{"ok": true}`
+    if not messages or messages[-1] != {"ok": True}:
+        return None
+    return messages[:-1]
+
+
 def main() -> int:
     args = parse_args()
+    if args.batch:
+        for line in run_batch(args, sys.stdin):
+            print(line, flush=True)
+        return 0
     required_tags = [tag.strip() for tag in args.tags.split(",") if tag.strip()]
-    articles: list[Article] = []
-    for path in sorted(KB_DIR.glob("*.md")):
-        if path.name in EXCLUDE_NAMES:
-            continue
-        article = load_article(path, required_tags, args.require_all)
-        if article:
-            articles.append(article)
-    articles.sort(key=sort_key)
-    if args.limit > 0:
-        articles = articles[: args.limit]
-    show_match = bool(required_tags)
-    for article in articles:
-        print(format_article(article, args.show_meta, show_match))
+    lines = request_server(
+        server_socket(MEMORY_DIR.resolve()),
+        {
+            "tool": "kb",
+            "script": str(Path(__file__).resolve()),
+            "tags": required_tags,
+            "require_all": args.require_all,
+            "limit": args.limit,
+            "show_meta": args.show_meta,
+        },
+    )
+    if lines is None:
+        lines = list_lines(required_tags, args.require_all, args.limit, args.show_meta)
+    for line in lines:
+        print(line)
     return 0
 
 
@@ -0,0 +1,254 @@
+"""
+Provides a content-addressed, deduplicated backup store.
+
+Each file is hashed and its content is stored once under `objects/`, no matter how many runs back it up. Backing up
+an unchanged tree again only costs hashing. Every run records what it backed up in a manifest under `manifests/`,
+which is enough to restore the original paths. Old manifests are pruned by count and age, along with any blobs that
+only they referenced.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from strappy.util.fs import atomic_write_text
+from strappy.util.loggable import Loggable
+
+# name of the backup store directory, under `LOG_DIR`
+BACKUPS_DIR_NAME: str = "backups"
+
+# retention defaults, a manifest is pruned if it is outside the newest `keep_runs` or older than `max_age_days`
+DEFAULT_KEEP_RUNS: int = 20
+DEFAULT_MAX_AGE_DAYS: int = 90
+
+# guards read-modify-write of manifests, installers may back up paths from several threads
+_manifest_lock = threading.Lock()
+
+
+def hash_file(path: Path) -> str:
+    """Return the sha256 hex digest of a file's content"""
+    with path.open("rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+class BackupStore(Loggable):
+    """
+    Content-addressed backup store rooted at `root`
+
+    Tree entries are dicts with a relative `path` ("." for the backed up path itself) and a `type`:
+    - "dir": `mode`
+    - "file": `mode`, `size`, and `blob` (the content digest)
+    - "symlink": `target`
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.objects_dir = root / "objects"
+        self.manifests_dir = root / "manifests"
+
+    def blob_path(self, digest: str) -> Path:
+        """Path of the blob with the given content digest"""
+        return self.objects_dir / digest[:2] / digest
+
+    def _store_blob(self, path: Path) -> tuple[str, int]:
+        """
+        Store a file's content, unless a blob with the same content already exists
+
+        Blobs are read-only, since one may be shared by the manifests of many runs.
+
+        :return: (content digest, number of bytes copied)
+        """
+        digest = hash_file(path)
+        blob = self.blob_path(digest)
+        if blob.exists():
+            return digest, 0
+
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=blob.parent, prefix=".tmp.")
+        os.close(fd)
+        try:
+            shutil.copyfile(path, temp_name)
+            os.chmod(temp_name, 0o444)
+            os.replace(temp_name, blob)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        return digest, blob.stat().st_size
+
+    def snapshot(self, path: Path) -> tuple[list[dict], int]:
+        """
+        Store the content of a file, symlink, or directory tree
+
+        :return: (tree entries with parents before children, number of bytes copied into the store)
+        """
+        entries: list[dict] = []
+        copied = 0
+
+        def visit(current: Path, rel: str) -> None:
+            nonlocal copied
+            current_stat = current.lstat()
+            if stat.S_ISLNK(current_stat.st_mode):
+                entries.append(
+                    {"path": rel, "type": "symlink", "target": os.readlink(current)}
+                )
+            elif stat.S_ISDIR(current_stat.st_mode):
+                entries.append(
+                    {
+                        "path": rel,
+                        "type": "dir",
+                        "mode": stat.S_IMODE(current_stat.st_mode),
+                    }
+                )
+                for child in sorted(current.iterdir()):
+                    visit(child, child.name if rel == "." else f"{rel}/{child.name}")
+            else:
+                digest, blob_copied = self._store_blob(current)
+                copied += blob_copied
+                entries.append(
+                    {
+                        "path": rel,
+                        "type": "file",
+                        "mode": stat.S_IMODE(current_stat.st_mode),
+                        "size": current_stat.st_size,
+                        "blob": digest,
+                    }
+                )
+
+        visit(path, ".")
+        return entries, copied
+
+    def manifest_path(self, run_id: str) -> Path:
+        return self.manifests_dir / f"{run_id}.json"
+
+    def load_manifest(self, run_id: str) -> Optional[dict]:
+        """Load the manifest of a run, or None if the run has no manifest"""
+        try:
+            return json.loads(self.manifest_path(run_id).read_text())
+        except FileNotFoundError:
+            return None
+
+    def run_ids(self) -> list[str]:
+        """Ids of every run with a manifest, oldest first"""
+        if not self.manifests_dir.is_dir():
+            return []
+        return sorted(path.stem for path in self.manifests_dir.glob("*.json"))
+
+    def backup(
+        self, path: Path, run_id: str, record: bool = True
+    ) -> tuple[list[dict], int]:
+        """
+        Back up `path` and record it in the manifest of `run_id`
+
+        If `path` doesn't exist, that is recorded as an empty tree, so that restoring the run removes it again.
+
+        :param record: Write it to the manifest now. Otherwise the caller passes it to `record` later, along with its
+            other backups, so that the manifest is written once rather than once per path
+        :return: (tree entries, number of bytes copied into the store)
+        """
+        entries, copied = self.snapshot(path) if os.path.lexists(path) else ([], 0)
+        if record:
+            self.record(run_id, [(path, entries)])
+
+        self.logger.debug(
+            f"Backed up '{path}' ({len(entries)} entries, {copied} bytes copied)"
+        )
+        return entries, copied
+
+    def record(self, run_id: str, backups: list[tuple[Path, list[dict]]]) -> None:
+        """
+        Add backed up paths to the manifest of `run_id`, in a single write
+
+        :param backups: (path, tree entries) of each backup, as returned by `backup`
+        """
+        if not backups:
+            return
+        with _manifest_lock:
+            manifest = self.load_manifest(run_id) or {
+                "run_id": run_id,
+                "created_at": datetime.now().isoformat(),
+                "entries": [],
+            }
+            manifest["entries"] += [
+                {"path": str(path), "tree": entries} for path, entries in backups
+            ]
+            atomic_write_text(
+                self.manifest_path(run_id), json.dumps(manifest, indent=2)
+            )
+
+    def materialize(self, entries: list[dict], destination: Path) -> None:
+        """
+        Recreate a backed up tree at `destination`
+
+        Files are copied with their original modes, never linked to the shared blobs, so that changing one can't change
+        the store.
+
+        :param entries: Tree entries, as returned by `snapshot`
+        :param destination: Path to recreate the tree at, must not exist yet
+        """
+        dirs: list[tuple[Path, int]] = []
+        for entry in entries:
+            target = (
+                destination if entry["path"] == "." else destination / entry["path"]
+            )
+            if entry["type"] == "dir":
+                target.mkdir()
+                dirs.append((target, entry["mode"]))
+            elif entry["type"] == "symlink":
+                target.symlink_to(entry["target"])
+            else:
+                shutil.copyfile(self.blob_path(entry["blob"]), target)
+                os.chmod(target, entry["mode"])
+
+        # apply directory modes last, in case a directory isn't writable
+        for directory, mode in reversed(dirs):
+            os.chmod(directory, mode)
+
+    def prune(
+        self,
+        keep_runs: int = DEFAULT_KEEP_RUNS,
+        max_age_days: int = DEFAULT_MAX_AGE_DAYS,
+    ) -> int:
+        """
+        Remove old manifests, then any blobs that no remaining manifest references
+
+        :param keep_runs: Keep at most this many of the newest manifests
+        :param max_age_days: Remove manifests older than this many days
+        :return: Number of manifests removed
+        """
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+
+        with _manifest_lock:
+            removed = 0
+            referenced: set[str] = set()
+            for index, run_id in enumerate(reversed(self.run_ids())):
+                manifest = self.load_manifest(run_id) or {}
+                created_at = datetime.fromisoformat(
+                    manifest.get("created_at", datetime.min.isoformat())
+                )
+                if index >= keep_runs or created_at < cutoff:
+                    self.manifest_path(run_id).unlink()
+                    removed += 1
+                    continue
+                for entry in manifest.get("entries", []):
+                    referenced.update(
+                        item["blob"] for item in entry["tree"] if item["type"] == "file"
+                    )
+
+            if self.objects_dir.is_dir():
+                for blob in self.objects_dir.glob("*/*"):
+                    # skip blobs that are still being written
+                    if blob.name.startswith(".tmp."):
+                        continue
+                    if blob.name not in referenced:
+                        blob.unlink()
+
+        if removed:
+            self.logger.info(f"Pruned {removed} backup manifest(s) from '{self.root}'")
+        return removed
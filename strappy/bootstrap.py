@@ -1,78 +1,185 @@
+import argparse
+import hashlib
+import json
 import os
-import shutil
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict
 from datetime import datetime
+from fnmatch import fnmatch
+from functools import partial
 from pathlib import Path
+from typing import Iterator, Optional
 
-from config import DOTFILES_DIR, INSTALL_IGNORE_FILES
-from config.dotfiles import DOTFILES_TO_OVERWRITE, DOTFILES_TO_APPEND
 from dotenv import load_dotenv
+
+from config import DOTFILES_DIR, INSTALL_IGNORE_FILES
+from config.dotfiles import DOTFILES_TO_APPEND, DOTFILES_TO_OVERWRITE, SKILLS_TO_COPY
 from logs import LOG_DIR
 from strappy import HOME
-from strappy.package import install_packages
+from strappy.backup import BACKUPS_DIR_NAME, BackupStore
+from strappy.concurrency import MAX_JOBS_ENV, shared_controller
+from strappy.managed_block import apply_block
+from strappy.mirror import mirror_tree
+from strappy.package import install_packages, load_brew_inventory, load_packages
+from strappy.profiling import (
+    PROFILE_MODES,
+    PROFILES_DIR_NAME,
+    PhaseProfiler,
+    profile_mode,
+)
+from strappy.roots import (
+    RootResult,
+    chown_to_owner,
+    find_roots,
+    format_roots_report,
+    run_root,
+    run_roots,
+)
+from strappy.scheduler import Phase, format_summary, run_phases
+from strappy.shell_bench import (
+    format_bench,
+    is_regression,
+    load_baseline,
+    measure_shell,
+    save_baseline,
+)
+from strappy.shell_init import (
+    compiled_path,
+    find_tool,
+    init_path,
+    write_init,
+)
+from strappy.state import compute_fingerprint, load_fingerprint, save_fingerprint
+from strappy.status import format_status, scan_status
+from strappy.targets import Target
+from strappy.transaction import JOURNALS_DIR_NAME, Transaction
+from strappy.util import events
+from strappy.util.events import EVENTS_FILE_NAME, METRICS_FILE_NAME
 from strappy.util.loggable import Loggable
+from strappy.watch import watch_tree
+from strappy.watchdog import TIMEOUT_ENV
 
 DRY_RUN: bool = os.environ.get("DRY_RUN", "False").lower() == "true"
 
+# fingerprint of the last applied dotfile phase, stored in `LOG_DIR`
+DOTFILES_STATE_FILE: str = "dotfiles_state.json"
 
-def _remove_path(path: Path) -> None:
-    if path.is_symlink() or path.is_file():
-        os.remove(path)
-        return
+# baseline of the `bench-shell` command, stored in `LOG_DIR`
+SHELL_BENCH_FILE: str = "shell_bench.json"
+
+# id of this run, used to group backups in the backup store
+RUN_ID: str = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+# transaction that installers stage their changes in, while `install_all_dotfiles` is running
+_active_transaction: Optional[Transaction] = None
 
-    if path.is_dir():
-        shutil.rmtree(path)
 
+def _backup_store() -> BackupStore:
+    return BackupStore(LOG_DIR / BACKUPS_DIR_NAME)
 
-def _copy_path(source: Path, destination: Path) -> None:
-    if source.is_symlink():
-        destination.symlink_to(source.resolve())
+
+@contextmanager
+def _transaction(journal_dir: Optional[Path] = None) -> Iterator[Transaction]:
+    """
+    Stage changes in the active transaction
+
+    If no transaction is active (e.g. an installer is called on its own), a new one is started and applied on exit.
+
+    :param journal_dir: Where a new transaction keeps its journal, defaults to the one for `HOME`
+    """
+    global _active_transaction
+    if _active_transaction is not None:
+        yield _active_transaction
         return
 
-    if source.is_dir():
-        shutil.copytree(source, destination)
+    transaction = _active_transaction = Transaction(
+        RUN_ID,
+        _backup_store(),
+        journal_dir or LOG_DIR / JOURNALS_DIR_NAME,
+    )
+    try:
+        yield transaction
+    finally:
+        _active_transaction = None
+    transaction.apply()
+
+
+def _link(destination: Path, source: Path) -> None:
+    """
+    Replace `destination` with a symlink to `source`
+
+    Whatever is at `destination` is backed up first, and a `<name>.bak` copy of it is left next to it.
+    """
+    with _transaction() as transaction:
+        transaction.link(destination, source)
+
+
+def _copies(destination: Path, home: Path) -> bool:
+    """Check if `destination` is configured as a copy rather than a symlink, see `SKILLS_TO_COPY`"""
+    relative = destination.relative_to(home).as_posix()
+    return any(fnmatch(relative, pattern) for pattern in SKILLS_TO_COPY)
+
+
+def _mirror(destination: Path, source: Path) -> None:
+    """
+    Make `destination` a copy of the `source` tree
+
+    A destination that is already a directory is synced in place, rewriting only the files that differ, after its
+    current state is backed up. A failed transaction restores it from that backup. Anything else (e.g. a symlink left by an earlier link install) is replaced by a full
+    copy, like `_link`.
+    """
+    if destination.is_dir() and not destination.is_symlink():
+        if not mirror_tree(source, destination, dry_run=True).changed:
+            Loggable.log().info(f"Copy of '{source.name}' is up to date, skipping")
+            return
+        Loggable.log().info(f"Syncing copy of '{source.name}' to '{destination}'")
+        with _transaction() as transaction:
+            transaction.sync(destination, source)
         return
 
-    shutil.copy2(source, destination)
+    Loggable.log().info(f"Copying '{source.name}' to '{destination}'")
+    with _transaction() as transaction:
+        transaction.mirror(destination, source)
 
 
 def merge_dotfiles(current: Path, new_file: Path) -> Path:
     """
     Merge two dotfiles together
 
-    To avoid repeating the same lines in the dotfiles, we will only append lines that do not already exist in `current`.
+    The contents of `new_file` are kept in a single managed block in `current`, see `strappy.managed_block`.
+    Everything outside the block is left untouched. If the block is already up to date, `current` is not rewritten,
+    otherwise it is replaced atomically.
 
     :param current: User's current dotfile in the `HOME` directory. e.g. '~/.zshrc
     :param new_file: New dotfile that needs to be merged into `current`. e.g. 'config/dotfiles/.zshrc'
     :return: Path to the merged dotfile
     """
-    # read all lines in the current dotfile
-    current_lines = current.read_text().splitlines()
-
-    lines_appended: [str] = []
-    # open the current dotfile in append mode
-    with current.open("a") as curr:
-        # for each line in the new dotfile
-        for line in new_file.read_text().splitlines():
-            # if the line already exists in the current dotfile, skip it
-            if line in current_lines:
-                continue
-            # otherwise, append it to the current dotfile
-            lines_appended.append(line)
-
-            # if this is a dry run, don't actually write to the file
-            if DRY_RUN:
-                continue
-            curr.write(f"\n{line}")
-
-    Loggable.log().info(
-        f"Appended {len(lines_appended)} lines to '{current.name}':\n"
-        + "\n".join([f"  {line}" for line in lines_appended])
-        + "\n"
-    )
+    # write through a symlinked dotfile, rather than replacing the link with a regular file
+    target = current.resolve()
+    if target == new_file.resolve():
+        # linked to the source itself, e.g. by `install_dotfiles` on a machine that had no such dotfile
+        Loggable.log().info(f"'{current.name}' is a link to '{new_file}', skipping")
+        return current
+    merged = apply_block(target.read_text(), new_file.read_text())
+
+    if merged is None:
+        Loggable.log().info(f"Managed block in '{current.name}' is up to date")
+        return current
+
+    if DRY_RUN:
+        Loggable.log().info(f"Dry run, not updating managed block in '{current.name}'")
+        return current
+
+    with _transaction() as transaction:
+        transaction.write_text(target, merged)
+    Loggable.log().info(f"Updated managed block in '{current.name}'")
     return current
 
 
-def install_dotfiles():
+def install_dotfiles(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Dotfiles ':=^80}")
 
     if DRY_RUN:
@@ -94,23 +201,14 @@ def install_dotfiles():
             continue
 
         # if file exists at destination, back it up and handle according to the defined rules
-        if (destination := (HOME / file.name)).exists():
-            Loggable.log().info(f"Backing up '{destination}' to '{file.name}.bak'")
-            if (backup := HOME / f"{file.name}.bak").exists():
-                # if the backup already exists, copy a backup to the logs directory with timestamp, then delete it
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                shutil.copy2(backup, LOG_DIR / f"{file.name}_{timestamp}.bak")
-                os.remove(backup)
-
-            # make a copy to back up the dotfile
-            shutil.copy2((HOME / file.name), backup)
-
+        if (destination := (home / file.name)).exists():
             if (file_name := file.name) in DOTFILES_TO_OVERWRITE:
-                # overwrite the file
+                if destination.is_symlink() and destination.resolve() == file.resolve():
+                    Loggable.log().info(f"'{file_name}' already linked, skipping")
+                    continue
+                # overwrite the file, it is backed up first
                 Loggable.log().info(f"Overwriting '{file_name}' at '{destination}'")
-                # delete the file at the destination
-                os.remove(destination)
-                destination.symlink_to(file)
+                _link(destination, file)
             elif file_name in DOTFILES_TO_APPEND:
                 # append to the file
                 Loggable.log().info(f"Appending to '{file_name}' at '{destination}'")
@@ -120,10 +218,11 @@ def install_dotfiles():
             Loggable.log().info(
                 f"Creating symlink for '{file.name}' at '{destination}'"
             )
-            (HOME / file.name).symlink_to(file)
+            _link(destination, file)
 
 
-def install_codex_rules():
+def install_codex_rules(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Codex Rules ':=^80}")
 
     if DRY_RUN:
@@ -135,30 +234,20 @@ def install_codex_rules():
         Loggable.log().warning(f"Codex rules file not found at '{source}', skipping")
         return
 
-    codex_rules_dir = HOME / ".codex" / "rules"
+    codex_rules_dir = home / ".codex" / "rules"
     codex_rules_dir.mkdir(parents=True, exist_ok=True)
 
     destination = codex_rules_dir / "default.rules"
-    if destination.exists() or destination.is_symlink():
-        if destination.is_symlink() and destination.resolve() == source.resolve():
-            Loggable.log().info("Codex rules already linked, skipping")
-            return
-
-        Loggable.log().info(f"Backing up '{destination}' to '{destination.name}.bak'")
-        backup = codex_rules_dir / f"{destination.name}.bak"
-        if backup.exists():
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            shutil.copy2(backup, LOG_DIR / f"{destination.name}_{timestamp}.bak")
-            os.remove(backup)
-
-        shutil.copy2(destination, backup)
-        os.remove(destination)
+    if destination.is_symlink() and destination.resolve() == source.resolve():
+        Loggable.log().info("Codex rules already linked, skipping")
+        return
 
     Loggable.log().info(f"Creating symlink for '{destination}'")
-    destination.symlink_to(source)
+    _link(destination, source)
 
 
-def install_codex_config():
+def install_codex_config(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Codex Config ':=^80}")
 
     if DRY_RUN:
@@ -170,30 +259,20 @@ def install_codex_config():
         Loggable.log().warning(f"Codex config not found at '{source}', skipping")
         return
 
-    codex_dir = HOME / ".codex"
+    codex_dir = home / ".codex"
     codex_dir.mkdir(parents=True, exist_ok=True)
 
     destination = codex_dir / "config.toml"
-    if destination.exists() or destination.is_symlink():
-        if destination.is_symlink() and destination.resolve() == source.resolve():
-            Loggable.log().info("Codex config already linked, skipping")
-            return
-
-        Loggable.log().info(f"Backing up '{destination}' to '{destination.name}.bak'")
-        backup = codex_dir / f"{destination.name}.bak"
-        if backup.exists():
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            shutil.copy2(backup, LOG_DIR / f"{destination.name}_{timestamp}.bak")
-            os.remove(backup)
-
-        shutil.copy2(destination, backup)
-        os.remove(destination)
+    if destination.is_symlink() and destination.resolve() == source.resolve():
+        Loggable.log().info("Codex config already linked, skipping")
+        return
 
     Loggable.log().info(f"Creating symlink for '{destination}'")
-    destination.symlink_to(source)
+    _link(destination, source)
 
 
-def install_codex_agents():
+def install_codex_agents(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Codex Agents Guidance ':=^80}")
 
     if DRY_RUN:
@@ -205,30 +284,20 @@ def install_codex_agents():
         Loggable.log().warning(f"Codex AGENTS.md not found at '{source}', skipping")
         return
 
-    codex_dir = HOME / ".codex"
+    codex_dir = home / ".codex"
     codex_dir.mkdir(parents=True, exist_ok=True)
 
     destination = codex_dir / "AGENTS.md"
-    if destination.exists() or destination.is_symlink():
-        if destination.is_symlink() and destination.resolve() == source.resolve():
-            Loggable.log().info("Codex AGENTS.md already linked, skipping")
-            return
-
-        Loggable.log().info(f"Backing up '{destination}' to '{destination.name}.bak'")
-        backup = codex_dir / f"{destination.name}.bak"
-        if backup.exists() or backup.is_symlink():
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            _copy_path(backup, LOG_DIR / f"{backup.name}_{timestamp}")
-            _remove_path(backup)
-
-        _copy_path(destination, backup)
-        _remove_path(destination)
+    if destination.is_symlink() and destination.resolve() == source.resolve():
+        Loggable.log().info("Codex AGENTS.md already linked, skipping")
+        return
 
     Loggable.log().info(f"Creating symlink for '{destination}'")
-    destination.symlink_to(source)
+    _link(destination, source)
 
 
-def install_grok_agents():
+def install_grok_agents(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Grok Agents Guidance ':=^80}")
 
     if DRY_RUN:
@@ -240,30 +309,20 @@ def install_grok_agents():
         Loggable.log().warning(f"Grok AGENTS.md not found at '{source}', skipping")
         return
 
-    grok_dir = HOME / ".grok"
+    grok_dir = home / ".grok"
     grok_dir.mkdir(parents=True, exist_ok=True)
 
     destination = grok_dir / "AGENTS.md"
-    if destination.exists() or destination.is_symlink():
-        if destination.is_symlink() and destination.resolve() == source.resolve():
-            Loggable.log().info("Grok AGENTS.md already linked, skipping")
-            return
-
-        Loggable.log().info(f"Backing up '{destination}' to '{destination.name}.bak'")
-        backup = grok_dir / f"{destination.name}.bak"
-        if backup.exists() or backup.is_symlink():
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            _copy_path(backup, LOG_DIR / f"{backup.name}_{timestamp}")
-            _remove_path(backup)
-
-        _copy_path(destination, backup)
-        _remove_path(destination)
+    if destination.is_symlink() and destination.resolve() == source.resolve():
+        Loggable.log().info("Grok AGENTS.md already linked, skipping")
+        return
 
     Loggable.log().info(f"Creating symlink for '{destination}'")
-    destination.symlink_to(source)
+    _link(destination, source)
 
 
-def install_codex_memory_helpers():
+def install_codex_memory_helpers(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Codex Memory Helpers ':=^80}")
 
     if DRY_RUN:
@@ -275,30 +334,20 @@ def install_codex_memory_helpers():
         Loggable.log().warning(f"Codex memory helper not found at '{source}', skipping")
         return
 
-    codex_memories_dir = HOME / ".codex" / "memories"
+    codex_memories_dir = home / ".codex" / "memories"
     codex_memories_dir.mkdir(parents=True, exist_ok=True)
 
     destination = codex_memories_dir / "list_memories.py"
-    if destination.exists() or destination.is_symlink():
-        if destination.is_symlink() and destination.resolve() == source.resolve():
-            Loggable.log().info("Codex memory helper already linked, skipping")
-            return
-
-        Loggable.log().info(f"Backing up '{destination}' to '{destination.name}.bak'")
-        backup = codex_memories_dir / f"{destination.name}.bak"
-        if backup.exists() or backup.is_symlink():
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            _copy_path(backup, LOG_DIR / f"{backup.name}_{timestamp}")
-            _remove_path(backup)
-
-        _copy_path(destination, backup)
-        _remove_path(destination)
+    if destination.is_symlink() and destination.resolve() == source.resolve():
+        Loggable.log().info("Codex memory helper already linked, skipping")
+        return
 
     Loggable.log().info(f"Creating symlink for '{destination}'")
-    destination.symlink_to(source)
+    _link(destination, source)
 
 
-def install_codex_skills():
+def install_codex_skills(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Codex Skills ':=^80}")
 
     if DRY_RUN:
@@ -312,7 +361,7 @@ def install_codex_skills():
         )
         return
 
-    codex_skills_dir = HOME / ".codex" / "skills"
+    codex_skills_dir = home / ".codex" / "skills"
     codex_skills_dir.mkdir(parents=True, exist_ok=True)
 
     for source in sorted(source_dir.iterdir()):
@@ -323,30 +372,20 @@ def install_codex_skills():
             continue
 
         destination = codex_skills_dir / source.name
-        if destination.exists() or destination.is_symlink():
-            if destination.is_symlink() and destination.resolve() == source.resolve():
-                Loggable.log().info(
-                    f"Codex skill '{source.name}' already linked, skipping"
-                )
-                continue
-
-            Loggable.log().info(
-                f"Backing up '{destination}' to '{destination.name}.bak'"
-            )
-            backup = codex_skills_dir / f"{destination.name}.bak"
-            if backup.exists() or backup.is_symlink():
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                _copy_path(backup, LOG_DIR / f"{backup.name}_{timestamp}")
-                _remove_path(backup)
+        if _copies(destination, home):
+            _mirror(destination, source)
+            continue
 
-            _copy_path(destination, backup)
-            _remove_path(destination)
+        if destination.is_symlink() and destination.resolve() == source.resolve():
+            Loggable.log().info(f"Codex skill '{source.name}' already linked, skipping")
+            continue
 
         Loggable.log().info(f"Creating symlink for '{destination}'")
-        destination.symlink_to(source)
+        _link(destination, source)
 
 
-def install_claude_settings():
+def install_claude_settings(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Claude Settings ':=^80}")
 
     if DRY_RUN:
@@ -358,30 +397,20 @@ def install_claude_settings():
         Loggable.log().warning(f"Claude settings not found at '{source}', skipping")
         return
 
-    claude_dir = HOME / ".claude"
+    claude_dir = home / ".claude"
     claude_dir.mkdir(parents=True, exist_ok=True)
 
     destination = claude_dir / "settings.json"
-    if destination.exists() or destination.is_symlink():
-        if destination.is_symlink() and destination.resolve() == source.resolve():
-            Loggable.log().info("Claude settings already linked, skipping")
-            return
-
-        Loggable.log().info(f"Backing up '{destination}' to '{destination.name}.bak'")
-        backup = claude_dir / f"{destination.name}.bak"
-        if backup.exists() or backup.is_symlink():
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            _copy_path(backup, LOG_DIR / f"{backup.name}_{timestamp}")
-            _remove_path(backup)
-
-        _copy_path(destination, backup)
-        _remove_path(destination)
+    if destination.is_symlink() and destination.resolve() == source.resolve():
+        Loggable.log().info("Claude settings already linked, skipping")
+        return
 
     Loggable.log().info(f"Creating symlink for '{destination}'")
-    destination.symlink_to(source)
+    _link(destination, source)
 
 
-def install_claude_skills():
+def install_claude_skills(home: Optional[Path] = None):
+    home = home or HOME
     Loggable.log().info(f"\n{' Installing Claude Skills ':=^80}")
 
     if DRY_RUN:
@@ -395,7 +424,7 @@ def install_claude_skills():
         )
         return
 
-    claude_skills_dir = HOME / ".claude" / "skills"
+    claude_skills_dir = home / ".claude" / "skills"
     claude_skills_dir.mkdir(parents=True, exist_ok=True)
 
     for source in sorted(source_dir.iterdir()):
@@ -406,52 +435,700 @@ def install_claude_skills():
             continue
 
         destination = claude_skills_dir / source.name
-        if destination.exists() or destination.is_symlink():
-            if destination.is_symlink() and destination.resolve() == source.resolve():
-                Loggable.log().info(
-                    f"Claude skill '{source.name}' already linked, skipping"
-                )
-                continue
+        if _copies(destination, home):
+            _mirror(destination, source)
+            continue
 
+        if destination.is_symlink() and destination.resolve() == source.resolve():
             Loggable.log().info(
-                f"Backing up '{destination}' to '{destination.name}.bak'"
+                f"Claude skill '{source.name}' already linked, skipping"
             )
-            backup = claude_skills_dir / f"{destination.name}.bak"
-            if backup.exists() or backup.is_symlink():
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                _copy_path(backup, LOG_DIR / f"{backup.name}_{timestamp}")
-                _remove_path(backup)
-
-            _copy_path(destination, backup)
-            _remove_path(destination)
+            continue
 
         Loggable.log().info(f"Creating symlink for '{destination}'")
-        destination.symlink_to(source)
+        _link(destination, source)
+
+
+def install_shell_init(home: Optional[Path] = None) -> bool:
+    """
+    Render the cached shell init file sourced by `.zshrc`, if the tools it is rendered from changed
+
+    :return: True if the file was written
+    """
+    home = home or HOME
+    Loggable.log().info(f"\n{' Generating Shell Init ':=^80}")
+
+    if DRY_RUN:
+        Loggable.log().info("Dry run, skipping shell init generation")
+        return False
+
+    if write_init(home):
+        Loggable.log().info(f"Generated '{init_path(home)}'")
+        return True
+    Loggable.log().info(f"'{init_path(home)}' is up to date, skipping")
+    return False
+
+
+# dotfile and agent config installers, in the order they run
+DOTFILE_INSTALLERS = (
+    install_dotfiles,
+    install_codex_agents,
+    install_grok_agents,
+    install_codex_config,
+    install_codex_memory_helpers,
+    install_codex_skills,
+    install_codex_rules,
+    install_claude_settings,
+    install_claude_skills,
+)
+
+
+def managed_targets(home: Optional[Path] = None) -> list[Target]:
+    """
+    List every destination managed by the dotfile and agent config installers, with its source and mode
+
+    Targets whose source doesn't exist are left out, since the installers skip them too.
+
+    :param home: Root to install into, defaults to `HOME`
+    """
+    home = home or HOME
+    targets: list[Target] = []
+    for file in sorted(DOTFILES_DIR.iterdir()):
+        if not file.is_file() or file.name in INSTALL_IGNORE_FILES:
+            continue
+        if file.name in DOTFILES_TO_APPEND:
+            mode = "append"
+        elif file.name in DOTFILES_TO_OVERWRITE:
+            mode = "link"
+        else:
+            mode = "create"
+        targets.append(Target(home / file.name, file, mode))
+
+    for source, destination in [
+        (DOTFILES_DIR / "codex" / "AGENTS.md", home / ".codex" / "AGENTS.md"),
+        (DOTFILES_DIR / "codex" / "AGENTS.md", home / ".grok" / "AGENTS.md"),
+        (DOTFILES_DIR / "codex" / "config.toml", home / ".codex" / "config.toml"),
+        (
+            DOTFILES_DIR / "codex" / "memories" / "list_memories.py",
+            home / ".codex" / "memories" / "list_memories.py",
+        ),
+        (
+            DOTFILES_DIR / "codex" / "rules" / "default.rules",
+            home / ".codex" / "rules" / "default.rules",
+        ),
+        (DOTFILES_DIR / "claude" / "settings.json", home / ".claude" / "settings.json"),
+    ]:
+        if source.exists():
+            targets.append(Target(destination, source))
+
+    for agent in ("codex", "claude"):
+        if (source_dir := DOTFILES_DIR / agent / "skills").is_dir():
+            for source in sorted(source_dir.iterdir()):
+                if not source.is_dir():
+                    continue
+                destination = home / f".{agent}" / "skills" / source.name
+                mode = "copy" if _copies(destination, home) else "link"
+                targets.append(Target(destination, source, mode))
+    return targets
+
+
+def dotfiles_fingerprint(home: Optional[Path] = None) -> str:
+    """
+    Fingerprint the dotfile phase: source tree, managed destinations, and config constants
+    """
+    home = home or HOME
+    return compute_fingerprint(
+        sources=[DOTFILES_DIR, Path(__file__)],
+        destinations=[target.destination for target in managed_targets(home)],
+        constants={
+            "home": home,
+            "DOTFILES_TO_OVERWRITE": DOTFILES_TO_OVERWRITE,
+            "DOTFILES_TO_APPEND": DOTFILES_TO_APPEND,
+            "INSTALL_IGNORE_FILES": INSTALL_IGNORE_FILES,
+            "SKILLS_TO_COPY": SKILLS_TO_COPY,
+        },
+    )
+
+
+def _root_key(home: Path) -> Optional[str]:
+    """
+    Key that keeps the state and journals of each root apart, None for `HOME` itself
+
+    The key is the root's name plus a short hash of its path, so that e.g. `/home/alice` and `/srv/alice` differ.
+    """
+    if home == HOME:
+        return None
+    digest = hashlib.sha256(str(home).encode()).hexdigest()[:8]
+    return f"{home.name}_{digest}"
+
+
+def _state_path(home: Path) -> Path:
+    if (key := _root_key(home)) is None:
+        return LOG_DIR / DOTFILES_STATE_FILE
+    return LOG_DIR / f"{Path(DOTFILES_STATE_FILE).stem}_{key}.json"
+
+
+def _journal_dir(home: Path) -> Path:
+    if (key := _root_key(home)) is None:
+        return LOG_DIR / JOURNALS_DIR_NAME
+    return LOG_DIR / JOURNALS_DIR_NAME / key
+
+
+def install_all_dotfiles(
+    verify: bool = False, home: Optional[Path] = None, prune: bool = True
+) -> bool:
+    """
+    Run every dotfile and agent config installer, unless the last applied state is unchanged
+
+    :param verify: Ignore the saved fingerprint and check every destination
+    :param home: Root to install into, defaults to `HOME`. Each root has its own saved state
+    :param prune: Prune the backup store afterwards. Turned off when several roots share the store concurrently
+    :return: True if the installers ran, False if the phase was skipped
+    """
+    home = home or HOME
+    state_path = _state_path(home)
+    if not verify and load_fingerprint(state_path) == dotfiles_fingerprint(home):
+        Loggable.log().info(
+            "Dotfiles unchanged since the last run, skipping. To force a full check, pass `--verify`"
+        )
+        return False
+
+    # undo anything a crashed run left half applied, before looking at the root
+    Transaction.recover(_backup_store(), _journal_dir(home))
+
+    # installers stage their changes, which are then applied together, or not at all
+    with _transaction(_journal_dir(home)):
+        for installer in DOTFILE_INSTALLERS:
+            installer(home)
+
+    # a dry run doesn't change anything, so there is no new state to record
+    if not DRY_RUN:
+        save_fingerprint(state_path, dotfiles_fingerprint(home))
+        if prune:
+            _backup_store().prune()
+    return True
+
+
+def _apply_target(target: Target) -> None:
+    """
+    Bring a single managed destination in line with its source, the same way the installers would
+    """
+    destination, source = target.destination, target.source
+    if target.mode == "append" and destination.exists():
+        Loggable.log().info(f"Appending to '{source.name}' at '{destination}'")
+        merge_dotfiles(destination, source)
+        return
+
+    if target.mode == "create" and os.path.lexists(destination):
+        return
+
+    if target.mode == "copy":
+        _mirror(destination, source)
+        return
+
+    if destination.is_symlink() and destination.resolve() == source.resolve():
+        return
+
+    Loggable.log().info(f"Creating symlink for '{destination}'")
+    _link(destination, source)
+
+
+def relink(previous: list[Target], changed: set[Path]) -> list[Target]:
+    """
+    Re-run only the link operations affected by changed source paths
+
+    New targets (e.g. a new or renamed skill) are linked, links to removed targets are removed, and appended
+    dotfiles whose source changed are merged again, as are copies whose source tree changed. Changes inside an
+    already linked source need nothing.
+
+    :param previous: Targets as of the last relink
+    :param changed: Source paths that were added, removed, or changed since then
+    :return: The current targets, to pass to the next relink
+    """
+    current = managed_targets()
+    if DRY_RUN:
+        Loggable.log().info("Dry run, skipping relink")
+        return current
+
+    current_destinations = {target.destination for target in current}
+    with _transaction() as transaction:
+        for target in previous:
+            # only remove links that strappy made to the source that went away, never anything else
+            if (
+                target.destination not in current_destinations
+                and target.destination.is_symlink()
+                and os.readlink(target.destination) == str(target.source)
+            ):
+                Loggable.log().info(f"Removing stale symlink '{target.destination}'")
+                transaction.remove(target.destination)
+
+        for target in current:
+            if (
+                target not in previous
+                or (target.mode == "append" and target.source in changed)
+                or (
+                    target.mode == "copy"
+                    and any(
+                        path == target.source or target.source in path.parents
+                        for path in changed
+                    )
+                )
+            ):
+                _apply_target(target)
+    return current
+
+
+def watch(interval: float = 1.0, debounce: float = 0.3, poll: bool = False) -> None:
+    """
+    Watch `DOTFILES_DIR` and relink whatever changes, until interrupted
+
+    Only the affected link operations run, see `relink`. The package phase never runs.
+    """
+    Loggable.log().info(f"\n{' Watching Dotfiles ':=^80}")
+    targets = managed_targets()
+
+    def on_change(changed: set[Path]) -> None:
+        nonlocal targets
+        Loggable.log().info(f"{len(changed)} path(s) changed under '{DOTFILES_DIR}'")
+        targets = relink(targets, changed)
+
+    try:
+        watch_tree(
+            DOTFILES_DIR, on_change, interval=interval, debounce=debounce, poll=poll
+        )
+    except KeyboardInterrupt:
+        Loggable.log().info("Stopped watching")
+
+
+def rollback(run_id: Optional[str] = None) -> str:
+    """
+    Restore every path that a previous run changed to its state before that run
+
+    Paths are restored from the run's backup manifest, in a single transaction. Paths that the run created are
+    removed. The rollback is itself recorded under the current `RUN_ID`, so it can be rolled back too.
+
+    :param run_id: Run to roll back, defaults to the latest run before this one
+    :return: Id of the run that was rolled back
+    """
+    store = _backup_store()
+    if run_id is None:
+        previous_runs = [other for other in store.run_ids() if other != RUN_ID]
+        if not previous_runs:
+            raise ValueError("No previous runs found in the backup store")
+        run_id = previous_runs[-1]
+
+    if (manifest := store.load_manifest(run_id)) is None:
+        raise ValueError(f"No backup manifest found for run '{run_id}'")
+
+    Loggable.log().info(f"\n{f' Rolling Back Run {run_id} ':=^80}")
+
+    # a path can be backed up more than once in a run, the first backup is its state before the run
+    trees: dict[str, list[dict]] = {}
+    for entry in manifest["entries"]:
+        trees.setdefault(entry["path"], entry["tree"])
+
+    with _transaction() as transaction:
+        for path, tree in trees.items():
+            if tree:
+                transaction.restore(Path(path), tree)
+            else:
+                transaction.remove(Path(path))
+
+    Loggable.log().info(f"Restored {len(trees)} path(s) from run '{run_id}'")
+    return run_id
+
+
+def status(as_json: bool = False) -> int:
+    """
+    Print whether every managed destination and package still matches the strappy config
+
+    This is read-only, it never changes `HOME` or installs anything.
+
+    :param as_json: Print the entries as a JSON list instead of a table
+    :return: Exit code, 0 if everything is ok, otherwise 1
+    """
+    entries = scan_status(
+        targets=managed_targets(),
+        packages=load_packages(),
+        inventory=load_brew_inventory(),
+    )
+    if as_json:
+        print(json.dumps([asdict(entry) for entry in entries], indent=2))
+    else:
+        print(format_status(entries))
+    return 0 if all(entry.state == "ok" for entry in entries) else 1
+
+
+def bench_shell(
+    home: Optional[Path] = None,
+    runs: int = 20,
+    trace_runs: int = 3,
+    threshold: float = 0.2,
+    update_baseline: bool = False,
+) -> int:
+    """
+    Benchmark interactive zsh startup against the applied dotfiles, and compare it to the saved baseline
+
+    The first run for a home saves its baseline, later runs only replace it when asked to.
+
+    :param home: Home directory to start zsh in, defaults to `HOME`. Tests pass a stub home
+    :param threshold: Relative p50 slowdown that counts as a regression, e.g. 0.2 for 20%
+    :param update_baseline: Save this run as the new baseline
+    :return: Exit code, 1 if startup regressed past the threshold or zsh isn't installed, otherwise 0
+    """
+    home = home or HOME
+    if (zsh := find_tool("zsh")) is None:
+        Loggable.log().error("zsh is not installed, nothing to benchmark")
+        return 1
+
+    if (key := _root_key(home)) is None:
+        baseline_path = LOG_DIR / SHELL_BENCH_FILE
+    else:
+        baseline_path = LOG_DIR / f"{Path(SHELL_BENCH_FILE).stem}_{key}.json"
+    baseline = load_baseline(baseline_path)
+
+    bench = measure_shell(zsh, home, runs=runs, trace_runs=trace_runs)
+    Loggable.log().info(format_bench(bench, baseline))
+
+    regressed = baseline is not None and is_regression(bench, baseline, threshold)
+    if regressed:
+        Loggable.log().error(
+            f"Shell startup regressed by more than {threshold:.0%}. If this is expected, pass `--update-baseline`"
+        )
+    if baseline is None or update_baseline:
+        save_baseline(baseline_path, bench)
+        Loggable.log().info(f"Saved baseline to '{baseline_path}'")
+    return 1 if regressed else 0
+
+
+def _provision_root(home: Path, verify: bool, settings: dict) -> RootResult:
+    """
+    Apply the dotfile phase to a single root, in a worker process
+
+    The worker may be a fresh interpreter (macOS spawns rather than forks), so the parent's module settings are
+    passed in and set here, which only affects the worker. Each root gets its own run id in the backup store.
+    """
+    global DOTFILES_DIR, LOG_DIR, DRY_RUN, RUN_ID
+    DOTFILES_DIR = settings["dotfiles_dir"]
+    LOG_DIR = settings["log_dir"]
+    DRY_RUN = settings["dry_run"]
+    RUN_ID = f"{settings['run_id']}_{_root_key(home) or 'home'}"
+
+    def apply() -> bool:
+        changed = install_all_dotfiles(verify=verify, home=home, prune=False)
+        if changed and not DRY_RUN:
+            destinations = [target.destination for target in managed_targets(home)]
+            chown_to_owner(
+                home,
+                destinations
+                + [path.with_name(f"{path.name}.bak") for path in destinations],
+            )
+        # no packages are installed into a root, so its shell init is rendered from the tools already there
+        if install_shell_init(home):
+            chown_to_owner(home, [init_path(home), compiled_path(home)])
+            changed = True
+        return changed
+
+    return run_root(home, apply)
 
 
-def main():
-    # environment and logging setup
+def provision_roots(
+    homes: list[Path], verify: bool = False, max_workers: Optional[int] = None
+) -> list[RootResult]:
+    """
+    Apply the dotfile and agent config phase to several roots concurrently, one worker process per root
+
+    The package phase never runs, since packages are installed once per machine rather than per root. The backup
+    store is shared between roots, and is pruned once every root has finished.
+
+    :param homes: Roots to install into, e.g. home directories
+    :param verify: Ignore the saved fingerprints and check every destination
+    :param max_workers: Size of the process pool
+    :return: Result of each root, in the order given
+    """
+    Loggable.log().info(f"\n{f' Provisioning {len(homes)} Root(s) ':=^80}")
+    settings = {
+        "dotfiles_dir": DOTFILES_DIR,
+        "log_dir": LOG_DIR,
+        "dry_run": DRY_RUN,
+        "run_id": RUN_ID,
+    }
+    results = run_roots(
+        homes,
+        partial(_provision_root, verify=verify, settings=settings),
+        max_workers=max_workers,
+    )
+    if not DRY_RUN:
+        _backup_store().prune()
+    return results
+
+
+def write_run_metrics(wall_seconds: float, succeeded: bool) -> None:
+    """
+    Write the run's metrics to `LOG_DIR` as a Prometheus textfile, e.g. for node_exporter's textfile collector
+    """
+    run_metrics = events.metrics()
+    run_metrics.set(
+        "strappy_run_duration_seconds", "Wall time of the last run", wall_seconds
+    )
+    run_metrics.set(
+        "strappy_run_success", "1 if every phase of the last run succeeded", succeeded
+    )
+    run_metrics.set(
+        "strappy_run_timestamp_seconds", "When the last run finished", time.time()
+    )
+    events.write_metrics(LOG_DIR / METRICS_FILE_NAME)
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Bootstrap dotfiles, agent configs, and packages.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check every dotfile destination, even if nothing changed since the last run.",
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=_positive_int,
+        help="Most child processes to run at once. The limit adapts below this to latency and failures. "
+        f"Also set with `{MAX_JOBS_ENV}`, defaults to twice the CPU count.",
+    )
+    parser.add_argument(
+        "--command-timeout",
+        type=float,
+        metavar="SECONDS",
+        help="Kill any package install command that runs longer than this, and mark its package failed. "
+        f"Packages can set their own `timeout` and `command_timeout`. Also set with `{TIMEOUT_ENV}`.",
+    )
+    parser.add_argument(
+        "--events",
+        action="store_true",
+        help=f"Also write structured events, one JSON object per line, to `logs/{EVENTS_FILE_NAME}`.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="cprofile",
+        choices=PROFILE_MODES,
+        help="Profile each phase, writing stats and collapsed stacks to `logs/profiles`. Defaults to `cprofile`, "
+        "which runs the phases one at a time. `sample` is lower overhead. Also set with `STRAPPY_PROFILE`.",
+    )
+    parser.add_argument(
+        "--homes",
+        nargs="+",
+        type=Path,
+        metavar="HOME",
+        help="Install dotfiles and agent configs into each of these roots instead of `~`. Skips packages.",
+    )
+    parser.add_argument(
+        "--root-prefix",
+        type=Path,
+        metavar="DIR",
+        help="Like `--homes`, with every directory under DIR, e.g. `/Users` or `/home`.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of roots to provision at once, defaults to the CPU count.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    rollback_parser = subparsers.add_parser(
+        "rollback",
+        help="Restore the paths changed by a previous run from the backup store.",
+    )
+    rollback_parser.add_argument(
+        "run_id",
+        nargs="?",
+        help="Run to roll back, see `logs/backups/manifests`. Defaults to the latest run.",
+    )
+
+    status_parser = subparsers.add_parser(
+        "status",
+        help="Report managed dotfiles and packages that are missing, drifted, or foreign.",
+    )
+    status_parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the report as JSON.",
+    )
+
+    bench_parser = subparsers.add_parser(
+        "bench-shell",
+        help="Measure zsh startup time and the cost of each line of the managed block. Exits 1 on a regression.",
+    )
+    bench_parser.add_argument(
+        "--runs",
+        type=_positive_int,
+        default=20,
+        help="Number of timed `zsh -i -c exit` runs.",
+    )
+    bench_parser.add_argument(
+        "--trace-runs",
+        type=int,
+        default=3,
+        help="Number of xtrace runs for the per-line breakdown, 0 to skip it.",
+    )
+    bench_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative p50 slowdown from the baseline that counts as a regression.",
+    )
+    bench_parser.add_argument(
+        "--home",
+        type=Path,
+        help="Home directory to start zsh in, defaults to `~`.",
+    )
+    bench_parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help=f"Save this run as the baseline in `logs/{SHELL_BENCH_FILE}`.",
+    )
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Watch the dotfiles config and relink only what changes. Never installs packages.",
+    )
+    watch_parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Seconds between checks when polling.",
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.3,
+        help="Seconds the config must be unchanged before relinking.",
+    )
+    watch_parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll mtimes instead of using native file events, e.g. on network filesystems.",
+    )
+    args = parser.parse_args(argv)
+    if args.max_jobs is None and (max_jobs := os.environ.get(MAX_JOBS_ENV)):
+        # checked here like `--max-jobs`, rather than failing once the run has started
+        try:
+            args.max_jobs = _positive_int(max_jobs)
+        except (ValueError, argparse.ArgumentTypeError) as err:
+            parser.error(f"{MAX_JOBS_ENV}: {err}")
+    if args.profile is None:
+        # checked here like `--profile`, rather than failing once the run has started
+        try:
+            args.profile = profile_mode(os.environ.get("STRAPPY_PROFILE"))
+        except ValueError as err:
+            parser.error(f"STRAPPY_PROFILE: {err}")
+    return args
+
+
+def build_phases(verify: bool = False) -> list[Phase]:
+    """
+    Declare the bootstrap phases
+
+    The dotfile phase is local filesystem work that doesn't need Homebrew, so it runs alongside the package phase
+    instead of ahead of it. The package phase isn't buffered, since installers may prompt the user. The shell init is
+    rendered from the installed fzf and nvm, so it waits for the package phase.
+    """
+    return [
+        Phase("dotfiles", partial(install_all_dotfiles, verify=verify)),
+        Phase("packages", install_packages, buffer_logs=False),
+        Phase("shell-init", install_shell_init, depends_on=("packages",)),
+    ]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+
+    # environment setup
     load_dotenv()
-    Loggable.setup(log_path=LOG_DIR / "bootstrap_py.log")
+
+    # status is read-only and its output may be parsed, so it runs without log handlers
+    if args.command == "status":
+        return status(as_json=args.json)
+
+    # logging setup
+    Loggable.setup(
+        log_path=LOG_DIR / "bootstrap_py.log",
+        events_path=LOG_DIR / EVENTS_FILE_NAME if args.events else None,
+    )
 
     # reload the `DRY_RUN` after loading the dotenv file
-    global DRY_RUN
+    global DRY_RUN, RUN_ID
     DRY_RUN = os.environ.get("DRY_RUN", "False").lower() == "true"
+    RUN_ID = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if args.max_jobs:
+        shared_controller().set_ceiling(args.max_jobs)
+    if args.command_timeout:
+        os.environ[TIMEOUT_ENV] = str(args.command_timeout)
+
+    if args.command == "rollback":
+        rollback(args.run_id)
+        return 0
+
+    if args.command == "bench-shell":
+        return bench_shell(
+            home=args.home.expanduser() if args.home else None,
+            runs=args.runs,
+            trace_runs=args.trace_runs,
+            threshold=args.threshold,
+            update_baseline=args.update_baseline,
+        )
 
-    # install dotfiles
-    install_dotfiles()
-    install_codex_agents()
-    install_grok_agents()
-    install_codex_config()
-    install_codex_memory_helpers()
-    install_codex_skills()
-    install_codex_rules()
-    install_claude_settings()
-    install_claude_skills()
+    if args.command == "watch":
+        watch(interval=args.interval, debounce=args.debounce, poll=args.poll)
+        return 0
+
+    if args.homes or args.root_prefix:
+        homes = [home.expanduser() for home in args.homes or []]
+        if args.root_prefix:
+            homes += find_roots(args.root_prefix.expanduser())
+        if not homes:
+            Loggable.log().error("No roots to provision")
+            return 1
+
+        start = time.perf_counter()
+        root_results = provision_roots(
+            list(dict.fromkeys(homes)), verify=args.verify, max_workers=args.jobs
+        )
+        Loggable.log().info(
+            format_roots_report(root_results, time.perf_counter() - start)
+        )
+        return 0 if all(result.status != "failed" for result in root_results) else 1
+
+    # install dotfiles and packages, profiling each phase if asked to
+    phases = build_phases(verify=args.verify)
+    profiler = None
+    if args.profile:
+        profiler = PhaseProfiler(args.profile, LOG_DIR / PROFILES_DIR_NAME, RUN_ID)
+        phases = [profiler.wrap(phase) for phase in phases]
+
+    start = time.perf_counter()
+    with profiler or nullcontext():
+        results = run_phases(
+            phases, max_workers=profiler.max_workers if profiler else None
+        )
+    wall_seconds = time.perf_counter() - start
+    if profiler:
+        profiler.profile_imports(cwd=Path(__file__).parents[1])
+    Loggable.log().info(format_summary(results, wall_seconds))
+    Loggable.log().info(shared_controller().format_summary())
 
-    # install packages
-    install_packages()
+    succeeded = all(result.status == "ok" for result in results)
+    write_run_metrics(wall_seconds, succeeded)
+    return 0 if succeeded else 1
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
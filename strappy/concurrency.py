@@ -0,0 +1,199 @@
+"""
+Provides an adaptive limit on the number of child processes that run at once.
+
+The limit starts at the CPU count and follows AIMD (additive increase, multiplicative decrease), like TCP congestion
+control:
+- each time `limit` commands in a row succeed at their usual speed, the limit goes up by one, up to the ceiling
+- a timeout, a high failure rate over the recent commands, or a command that takes much longer than usual for its
+  kind halves the limit
+
+After a decrease, the commands that were already running finish before the next decrease, since they were started
+under the old limit and would report the same congestion again. A single failed command isn't a congestion signal
+on its own, since some commands are expected to fail (e.g. `brew list` for a package that isn't installed).
+"""
+
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from strappy.util.loggable import Loggable
+
+# environment variable with the user's ceiling on concurrent child processes
+MAX_JOBS_ENV: str = "STRAPPY_MAX_JOBS"
+
+
+@dataclass(frozen=True)
+class Decision:
+    # seconds since the controller was created
+    at: float
+    old: int
+    new: int
+    reason: str
+
+
+def command_key(cmd: list[str] | str) -> str:
+    """Group commands by their first two words (e.g. 'brew install'), for their typical latency"""
+    words = cmd.split() if isinstance(cmd, str) else cmd
+    return " ".join(words[:2])
+
+
+class ConcurrencyController(Loggable):
+    """
+    AIMD limit on concurrent child processes, shared by every thread that runs commands
+
+    :param ceiling: Highest limit allowed, defaults to twice the CPU count
+    :param initial: Starting limit, defaults to the CPU count
+    :param decrease_factor: Limit is multiplied by this on congestion
+    :param slow_factor: A command this many times slower than usual for its kind is a congestion signal
+    :param window: Number of recent commands the failure rate is taken over
+    :param failure_rate: Failure rate over the window that is a congestion signal
+    """
+
+    def __init__(
+        self,
+        ceiling: Optional[int] = None,
+        initial: Optional[int] = None,
+        decrease_factor: float = 0.5,
+        slow_factor: float = 3.0,
+        window: int = 10,
+        failure_rate: float = 0.5,
+    ):
+        cores = os.cpu_count() or 1
+        self.ceiling = max(1, ceiling or cores * 2)
+        self.limit = self.initial = max(1, min(initial or cores, self.ceiling))
+        self.decrease_factor = decrease_factor
+        self.slow_factor = slow_factor
+        self.failure_rate = failure_rate
+        self.active = 0
+        self.peak_active = 0
+        self.decisions: list[Decision] = []
+
+        self._condition = threading.Condition()
+        self._started = time.monotonic()
+        # command key -> (moving average of seconds, samples)
+        self._latency: dict[str, tuple[float, int]] = {}
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._successes = 0
+        # completions to wait for before another decrease
+        self._cooldown = 0
+
+    def set_ceiling(self, ceiling: int) -> None:
+        with self._condition:
+            self.ceiling = max(1, ceiling)
+            if self.limit > self.ceiling:
+                self._set_limit(self.ceiling, "user ceiling")
+
+    def _set_limit(self, limit: int, reason: str) -> None:
+        """Change the limit, must hold the condition"""
+        if limit == self.limit:
+            return
+        decision = Decision(
+            at=round(time.monotonic() - self._started, 3),
+            old=self.limit,
+            new=limit,
+            reason=reason,
+        )
+        self.decisions.append(decision)
+        self.limit = limit
+        self._condition.notify_all()
+        self.logger.debug(f"Concurrency {decision.old} -> {decision.new}: {reason}")
+        self.event("concurrency", limit=limit, previous=decision.old, reason=reason)
+
+    def _decrease(self, reason: str) -> None:
+        if self._cooldown > 0:
+            return
+        self._set_limit(max(1, int(self.limit * self.decrease_factor)), reason)
+        self._cooldown = self.active
+        self._successes = 0
+        self._outcomes.clear()
+
+    def _record(self, key: str, seconds: float, ok: bool, timed_out: bool) -> None:
+        """Adjust the limit for a finished command, must hold the condition"""
+        self._cooldown = max(0, self._cooldown - 1)
+        self._outcomes.append(ok)
+
+        average, samples = self._latency.get(key, (seconds, 0))
+        failures = self._outcomes.count(False)
+        if timed_out:
+            self._decrease(f"'{key}' timed out")
+        elif (
+            len(self._outcomes) * 2 >= (self._outcomes.maxlen or 0)
+            and failures / len(self._outcomes) >= self.failure_rate
+        ):
+            self._decrease(f"{failures} of the last {len(self._outcomes)} failed")
+        elif ok and samples >= 3 and seconds > average * self.slow_factor:
+            self._decrease(f"'{key}' took {seconds:.1f}s, usually {average:.1f}s")
+        elif ok:
+            # additive increase, by one for every `limit` successes
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.ceiling:
+                self._set_limit(self.limit + 1, f"{self._successes} succeeded")
+                self._successes = 0
+
+        if ok:
+            self._latency[key] = (average + 0.3 * (seconds - average), samples + 1)
+
+    @contextmanager
+    def slot(self, key: str) -> Iterator[None]:
+        """
+        Hold one of the `limit` slots while running a command, waiting for one to free up if needed
+
+        The outcome is taken from how the block exits: normally is a success, `subprocess.TimeoutExpired` is a
+        timeout, anything else is a failure.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+        start = time.perf_counter()
+        ok, timed_out = False, False
+        try:
+            yield
+            ok = True
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            raise
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._record(key, time.perf_counter() - start, ok, timed_out)
+                self._condition.notify()
+
+    def format_summary(self) -> str:
+        """Format the limit's history, listing every decrease"""
+        increases = sum(1 for decision in self.decisions if decision.new > decision.old)
+        decreases = [
+            decision for decision in self.decisions if decision.new < decision.old
+        ]
+        lines = [
+            (
+                f"Child process concurrency: started at {self.initial}, ended at {self.limit} "
+                f"(ceiling {self.ceiling}, at most {self.peak_active} ran at once), "
+                f"{increases} increase(s), {len(decreases)} decrease(s)"
+            )
+        ]
+        lines += [
+            f"{decision.at:>10.1f}s  {decision.old} -> {decision.new}  ({decision.reason})"
+            for decision in decreases
+        ]
+        return "\n".join(lines)
+
+
+_shared: Optional[ConcurrencyController] = None
+_shared_lock = threading.Lock()
+
+
+def shared_controller() -> ConcurrencyController:
+    """The controller used by `Package.run_cmd`, with its ceiling from `STRAPPY_MAX_JOBS` if set"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            ceiling = os.environ.get(MAX_JOBS_ENV)
+            _shared = ConcurrencyController(ceiling=int(ceiling) if ceiling else None)
+        return _shared
@@ -0,0 +1,121 @@
+"""
+Provides the fenced, hashed block that strappy manages inside appended dotfiles (e.g. `.zshrc`).
+
+All of strappy's content lives between one pair of markers. The opening marker records a digest of the block's
+contents, so an unchanged block is detected by comparing digests, without diffing the file line by line: the recorded
+one with that of the source, and with that of what is between the markers now, which differs after a hand edit.
+
+    # >>> strappy >>> sha256:<digest>
+    ...
+    # <<< strappy <<<
+"""
+
+import hashlib
+from typing import Optional
+
+BLOCK_START: str = "# >>> strappy >>>"
+BLOCK_END: str = "# <<< strappy <<<"
+
+
+def block_digest(content: str) -> str:
+    """Digest of the block contents, as recorded in the opening marker"""
+    return f"sha256:{hashlib.sha256(content.encode()).hexdigest()}"
+
+
+def find_block(lines: list[str]) -> Optional[tuple[int, int, str]]:
+    """
+    Find the managed block in a dotfile
+
+    :param lines: Lines of the dotfile
+    :return: (start index, end index, recorded digest), or None if there is no managed block
+    :raises ValueError: If the opening marker has no matching closing marker
+    """
+    for start, line in enumerate(lines):
+        if not line.startswith(BLOCK_START):
+            continue
+        for end in range(start + 1, len(lines)):
+            if lines[end].strip() == BLOCK_END:
+                return start, end, line[len(BLOCK_START) :].strip()
+        raise ValueError(
+            f"Found '{BLOCK_START}' on line {start + 1} without a closing '{BLOCK_END}'"
+        )
+    return None
+
+
+def render_block(content: str) -> list[str]:
+    """Render the managed block, including markers, as a list of lines"""
+    return [
+        f"{BLOCK_START} {block_digest(content)}",
+        *content.splitlines(),
+        BLOCK_END,
+    ]
+
+
+def read_block(text: str) -> Optional[tuple[str, str]]:
+    """
+    Read the managed block from a dotfile's text
+
+    :return: (recorded digest, block contents), or None if there is no managed block
+    """
+    lines = text.splitlines()
+    if (found := find_block(lines)) is None:
+        return None
+    start, end, recorded = found
+    return recorded, "\n".join(lines[start + 1 : end])
+
+
+def strip_legacy_append(lines: list[str], content: str) -> list[str]:
+    """
+    Remove the lines that an earlier version of strappy appended to a dotfile, before it had a managed block
+
+    That version appended, each after a newline, the lines of `content` that weren't already in the file. The end of
+    the file is only removed if it is exactly those lines for the file before it, after the blank line left by the
+    file's own last newline, so the user's own lines are never touched. Lines appended from an older `content` don't
+    match and are left as they are; they run before the block, which repeats whatever is still current.
+
+    :param lines: Lines of the dotfile, without a managed block
+    :return: The lines from before the appended ones, or `lines` if the end of the file doesn't match
+    """
+    content_lines = content.splitlines()
+    # the appended lines, and the blank line before them
+    for start in range(len(lines) - 2, len(lines) - len(content_lines) - 2, -1):
+        if start < 0:
+            break
+        before = set(lines[:start])
+        appended = [line for line in content_lines if line not in before]
+        # the file ended with a newline, so there's a blank line before the first appended one
+        if appended and lines[start:] == ["", *appended]:
+            return lines[:start]
+    return lines
+
+
+def apply_block(text: str, content: str) -> Optional[str]:
+    """
+    Place `content` in the managed block of a dotfile
+
+    Everything outside the block is left as is, edits inside it are replaced. If there is no block yet, it is appended
+    to the end of the file, in place of the lines an earlier version appended, see `strip_legacy_append`.
+
+    :param text: Current text of the dotfile
+    :param content: Content that belongs in the managed block
+    :return: The updated text, or None if the block is already up to date
+    """
+    lines = text.splitlines()
+    found = find_block(lines)
+
+    if found is None:
+        lines = strip_legacy_append(lines, content)
+        if lines and lines[-1].strip():
+            # keep the block visually separate from the user's own content
+            lines.append("")
+        lines += render_block(content.rstrip("\n"))
+        return "\n".join(lines) + "\n"
+
+    content = content.rstrip("\n")
+    start, end, recorded = found
+    current = "\n".join(lines[start + 1 : end])
+    if recorded == block_digest(content) == block_digest(current):
+        return None
+
+    lines[start : end + 1] = render_block(content)
+    return "\n".join(lines) + "\n"
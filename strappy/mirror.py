@@ -0,0 +1,175 @@
+"""
+Provides an rsync-style mirror of a source tree, for destinations that must be copies rather than symlinks.
+
+Files are compared by size and modification time, or by content hash, and only the ones that differ are rewritten.
+Each rewrite goes through a temporary file and an atomic rename, and keeps the source's permission bits and
+modification time, so the next sync sees the file as unchanged. Entries in the destination that are not in the source
+are deleted. Syncing an unchanged tree only stats it, nothing is written.
+"""
+
+import os
+import shutil
+import stat
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from strappy.backup import hash_file
+from strappy.util.fs import remove_path
+
+
+@dataclass
+class MirrorStats:
+    # destination paths, relative to the destination root
+    copied: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    # permission bits changed, contents were already the same
+    chmodded: list[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.copied or self.deleted or self.chmodded)
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.copied)} copied, {len(self.deleted)} deleted, "
+            f"{len(self.chmodded)} mode changed, {self.unchanged} unchanged"
+        )
+
+
+def _lstat(path: str):
+    try:
+        return os.lstat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _same_contents(
+    source: str, source_stat, destination: str, destination_stat, checksum: bool
+) -> bool:
+    if source_stat.st_size != destination_stat.st_size:
+        return False
+    if checksum:
+        return hash_file(Path(source)) == hash_file(Path(destination))
+    return source_stat.st_mtime_ns == destination_stat.st_mtime_ns
+
+
+def _copy_file(source: str, destination: str) -> None:
+    """Copy a file with its mode and times, replacing `destination` atomically"""
+    head, name = os.path.split(destination)
+    temp = os.path.join(head, f".{name}.strappy-sync")
+    shutil.copy2(source, temp, follow_symlinks=False)
+    try:
+        os.replace(temp, destination)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def _sync(
+    source: str,
+    destination: str,
+    relative: str,
+    stats: MirrorStats,
+    checksum: bool,
+    dry_run: bool,
+    exists: bool = True,
+) -> None:
+    """:param exists: False if the destination's parent is missing, or would be replaced in a dry run"""
+    label = relative or "."
+    source_stat = os.lstat(source)
+    destination_stat = _lstat(destination) if exists else None
+
+    # an entry of the wrong type is replaced, e.g. a file where the source has a directory
+    if destination_stat is not None and stat.S_IFMT(
+        destination_stat.st_mode
+    ) != stat.S_IFMT(source_stat.st_mode):
+        stats.deleted.append(label)
+        if not dry_run:
+            remove_path(Path(destination))
+        destination_stat = None
+
+    if stat.S_ISDIR(source_stat.st_mode):
+        mode = stat.S_IMODE(source_stat.st_mode)
+        if destination_stat is None:
+            stats.copied.append(label)
+            if not dry_run:
+                os.mkdir(destination)
+        elif stat.S_IMODE(destination_stat.st_mode) != mode:
+            stats.chmodded.append(label)
+
+        with os.scandir(source) as entries:
+            source_names = sorted(entry.name for entry in entries)
+        if destination_stat is not None:
+            with os.scandir(destination) as entries:
+                stale = sorted({entry.name for entry in entries} - set(source_names))
+            for name in stale:
+                stats.deleted.append(os.path.join(relative, name))
+                if not dry_run:
+                    remove_path(Path(destination, name))
+
+        for name in source_names:
+            _sync(
+                os.path.join(source, name),
+                os.path.join(destination, name),
+                os.path.join(relative, name),
+                stats,
+                checksum,
+                dry_run,
+                # in a dry run, the entries of a directory that would be created are all copied, whatever is there now
+                exists=destination_stat is not None,
+            )
+
+        # set the mode last, so that a read-only source directory can still be filled in
+        if not dry_run and (
+            destination_stat is None or stat.S_IMODE(destination_stat.st_mode) != mode
+        ):
+            os.chmod(destination, mode)
+        return
+
+    if stat.S_ISLNK(source_stat.st_mode):
+        link_target = os.readlink(source)
+        if destination_stat is not None and os.readlink(destination) == link_target:
+            stats.unchanged += 1
+            return
+        stats.copied.append(label)
+        if not dry_run:
+            if destination_stat is not None:
+                os.remove(destination)
+            os.symlink(link_target, destination)
+        return
+
+    if destination_stat is not None and _same_contents(
+        source, source_stat, destination, destination_stat, checksum
+    ):
+        if stat.S_IMODE(destination_stat.st_mode) == stat.S_IMODE(source_stat.st_mode):
+            stats.unchanged += 1
+            return
+        stats.chmodded.append(label)
+        if not dry_run:
+            os.chmod(destination, stat.S_IMODE(source_stat.st_mode))
+        return
+
+    stats.copied.append(label)
+    if not dry_run:
+        _copy_file(source, destination)
+
+
+def mirror_tree(
+    source: Path, destination: Path, checksum: bool = False, dry_run: bool = False
+) -> MirrorStats:
+    """
+    Make `destination` an exact copy of `source`, rewriting only what differs
+
+    `source` may be a directory or a single file. Symlinks inside the source are copied as symlinks. The parent of
+    `destination` must exist.
+
+    :param source: Tree to copy from
+    :param destination: Tree to update
+    :param checksum: Compare file contents by hash instead of by size and modification time
+    :param dry_run: Only report what would change
+    :return: What was, or would be, changed
+    """
+    stats = MirrorStats()
+    _sync(str(source), str(destination), "", stats, checksum, dry_run)
+    return stats
@@ -5,15 +5,60 @@ Provides base class for package installation configs
 import os
 import re
 import subprocess
+import time
 import tomllib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
 from pydantic.dataclasses import dataclass
 
-from config.brew_packages import BREW_PACKAGES_TOML_PATH, BREW_PACKAGES_PATH
+from config.brew_packages import BREW_PACKAGES_PATH, BREW_PACKAGES_TOML_PATH
 from strappy import HOME
+from strappy.concurrency import command_key, shared_controller
 from strappy.util.loggable import Loggable
+from strappy.watchdog import deadline, default_timeout, run_watched
+
+# common Homebrew prefixes, for Apple Silicon, Intel, and Linux
+BREW_PREFIXES: [Path] = [
+    Path("/opt/homebrew"),
+    Path("/usr/local"),
+    Path("/home/linuxbrew/.linuxbrew"),
+]
+
+
+@dataclass(frozen=True)
+class BrewInventory:
+    """
+    Names of every installed Homebrew formula and cask
+    """
+
+    formulae: frozenset[str]
+    casks: frozenset[str]
+
+
+def load_brew_inventory() -> Optional[BrewInventory]:
+    """
+    Load the Homebrew inventory in bulk
+
+    Rather than running `brew list` for each package, read the `Cellar` and `Caskroom` directories directly, which is
+    one directory listing each.
+
+    :return: The inventory, or None if Homebrew isn't installed
+    """
+    prefixes = BREW_PREFIXES
+    if prefix := os.environ.get("HOMEBREW_PREFIX"):
+        prefixes = [Path(prefix), *prefixes]
+
+    for prefix in prefixes:
+        if not (cellar := prefix / "Cellar").is_dir():
+            continue
+        caskroom = prefix / "Caskroom"
+        return BrewInventory(
+            formulae=frozenset(os.listdir(cellar)),
+            casks=frozenset(os.listdir(caskroom)) if caskroom.is_dir() else frozenset(),
+        )
+    return None
 
 
 @dataclass(kw_only=True)
@@ -26,6 +71,10 @@ class Package(Loggable):
     check_if_installed: bool = (
         True  # check if the package is installed before installing it
     )
+    # seconds the whole install may take, including the post install hook, None for no limit
+    timeout: Optional[float] = None
+    # seconds each command may take, defaults to `STRAPPY_COMMAND_TIMEOUT` if set
+    command_timeout: Optional[float] = None
 
     @property
     def dry_run(self) -> bool:
@@ -52,6 +101,14 @@ class Package(Loggable):
         """
         raise NotImplementedError()
 
+    def is_in_inventory(self, inventory: Optional[BrewInventory]) -> bool:
+        """
+        Check if the package is installed, using the bulk inventory where possible
+
+        Packages that aren't managed by Homebrew fall back to `is_installed`.
+        """
+        return self.is_installed
+
     def install(self):
         """
         Install the package
@@ -66,21 +123,64 @@ class Package(Loggable):
         pass
 
     def run_cmd(
-        self, cmd: list[str] | str, capture_output: bool = False, shell: bool = False
+        self,
+        cmd: list[str] | str,
+        capture_output: bool = False,
+        shell: bool = False,
+        timeout: Optional[float] = None,
     ):
         """
-        Run a shell command using subprocess.run
+        Run a shell command under the watchdog, see `strappy.watchdog.run_watched`
+
+        A "command" event is recorded for every run, with its duration, exit code, and bytes of captured output.
+
+        :param timeout: Seconds the command may take, defaults to the package's `command_timeout`
+        :raises subprocess.TimeoutExpired: If the command ran past its timeout, or the package's, and was killed
         """
         if shell and isinstance(cmd, list):
             cmd = " ".join(cmd)
 
         self.logger.debug(f"Running '{' '.join(cmd)}'")
 
-        # shell should be false as we are passing a list of args
-        # capture output is generally false to allow the user to interact with the installation process if needed
-        result = subprocess.run(
-            cmd, check=True, shell=shell, capture_output=capture_output, text=True
-        )
+        if timeout is None:
+            timeout = (
+                self.command_timeout
+                if self.command_timeout is not None
+                else default_timeout()
+            )
+
+        start = time.perf_counter()
+        exit_code: Optional[int] = None
+        timed_out = False
+        output = ("", "")
+        try:
+            # at most `limit` commands run at once, across every thread, see `strappy.concurrency`
+            with shared_controller().slot(command_key(cmd)):
+                # shell should be false as we are passing a list of args
+                # capture output is generally false to allow the user to interact with the installation process if needed
+                result = run_watched(
+                    cmd,
+                    shell=shell,
+                    capture_output=capture_output,
+                    timeout=timeout,
+                )
+            exit_code, output = result.returncode, (result.stdout, result.stderr)
+        except subprocess.CalledProcessError as err:
+            exit_code, output = err.returncode, (err.stdout, err.stderr)
+            raise
+        except subprocess.TimeoutExpired as err:
+            timed_out, output = True, (err.stdout, err.stderr)
+            raise
+        finally:
+            self.event(
+                "command",
+                package=self.name,
+                command=cmd if isinstance(cmd, str) else " ".join(cmd),
+                duration=round(time.perf_counter() - start, 3),
+                exit_code=exit_code,
+                timed_out=timed_out,
+                output_bytes=sum(len((stream or "").encode()) for stream in output),
+            )
 
         # if we captured the output, log it
         if capture_output:
@@ -148,6 +248,19 @@ class BrewPackage(Package):
             )
             return False
 
+    def is_in_inventory(self, inventory: Optional[BrewInventory]) -> bool:
+        """
+        Check if the package is listed in the bulk inventory
+
+        Unlike `is_installed`, casks installed outside of Homebrew aren't detected, since that takes a `brew info`
+        call per cask.
+        """
+        if inventory is None:
+            return False
+        # tap formulae (e.g. 'user/tap/name') are installed under their short name
+        short_name = self.name.rsplit("/", 1)[-1]
+        return short_name in (inventory.casks if self.use_cask else inventory.formulae)
+
     def get_cask_bundle_name(self) -> Optional[str]:
         """
         Get the bundle name for a cask app, if possible
@@ -346,27 +459,78 @@ def load_packages() -> [BrewPackage]:
     return packages
 
 
+def _already_installed(package: Package) -> bool:
+    """
+    Check if a package is installed and can be skipped, in a worker thread
+
+    A check that fails or times out leaves the package to `install`, which checks again, as does a package that only
+    implements `install`.
+    """
+    if not package.check_if_installed:
+        return False
+    try:
+        with deadline(package.timeout):
+            return package.is_installed
+    except NotImplementedError:
+        return False
+    except (subprocess.SubprocessError, OSError) as e:
+        package.logger.debug(f"Could not check if {package.name} is installed: {e}")
+        return False
+
+
 def install_packages():
     """
     Install all packages
+
+    The checks for installed packages are read-only, so they run concurrently, with their commands held to the shared
+    concurrency limit. Installs run one at a time, since Homebrew locks and installers may prompt the user.
     """
     Loggable.log().info(f"\n{' Installing Brew Packages ':=^80}")
 
     packages: [BrewPackage] = load_packages()
 
+    with ThreadPoolExecutor(max_workers=shared_controller().ceiling) as executor:
+        already_installed = list(executor.map(_already_installed, packages))
+
     installed_packages: [BrewPackage] = []
     skipped_packages: [BrewPackage] = []
     failed_packages: [BrewPackage] = []
-    for package in packages:
+    for package, skip in zip(packages, already_installed):
+        start = time.perf_counter()
+        if skip:
+            package.logger.info(f"{package.name} is already installed, skipping")
+            skipped_packages.append(package)
+            package.event(
+                "package", package=package.name, result="skipped", duration=0.0
+            )
+            continue
         try:
-            installed = package.install()
+            # every command of the install shares the package's time budget
+            with deadline(package.timeout):
+                installed = package.install()
             if installed:
                 installed_packages.append(package)
+                result = "installed"
             else:
                 skipped_packages.append(package)
+                result = "skipped"
+        except subprocess.TimeoutExpired as e:
+            command = e.cmd if isinstance(e.cmd, str) else " ".join(e.cmd)
+            Package.log().error(
+                f"Failed to install {package.name}: '{command}' timed out after {e.timeout:.1f}s"
+            )
+            failed_packages.append(package)
+            result = "failed"
         except Exception as e:
             Package.log().error(f"Failed to install {package.name}: {e}")
             failed_packages.append(package)
+            result = "failed"
+        package.event(
+            "package",
+            package=package.name,
+            result=result,
+            duration=round(time.perf_counter() - start, 3),
+        )
 
     Package.log().info(
         f"\n{' Brew Package Installation Summary ':=^80}\n"
@@ -0,0 +1,289 @@
+"""
+Provides per-phase profiling of a bootstrap run, turned on with `--profile` or `STRAPPY_PROFILE`.
+
+Two modes are supported:
+- "cprofile": each phase runs under its own `cProfile.Profile`, and its stats are saved as a `.pstats` file. Only one
+  profiler can be active at a time, so phases run one after another in this mode.
+- "sample": a background thread samples the stacks of the phase threads every few milliseconds. The overhead is low
+  enough that phases still run concurrently.
+
+In both modes the sampled stacks are saved in collapsed form (`frame;frame;frame count`), ready for flamegraph
+tools, and the functions with the most self time in each phase are logged. Import costs of strappy, pydantic, and
+the package plugins are measured in a child process with `-X importtime`.
+"""
+
+import cProfile
+import io
+import pstats
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import replace
+from pathlib import Path
+from types import FrameType
+from typing import Optional, Self
+
+from strappy.scheduler import Phase
+from strappy.util.loggable import Loggable
+
+PROFILE_MODES: tuple[str, ...] = ("cprofile", "sample")
+
+# name of the profile output directory, under `LOG_DIR`
+PROFILES_DIR_NAME: str = "profiles"
+
+# number of functions listed per phase in the log
+TOP_FUNCTIONS: int = 10
+
+# module name prefixes whose import costs are reported, by group
+IMPORT_GROUPS: dict[str, tuple[str, ...]] = {
+    "strappy": ("strappy",),
+    "pydantic": ("pydantic", "pydantic_core"),
+    "plugins": ("config.brew_packages",),
+}
+
+# imports the same modules a bootstrap run does, including every package plugin
+_IMPORT_SCRIPT = "import strappy.bootstrap\nfrom strappy.package import load_packages\nload_packages()\n"
+
+
+def profile_mode(value: Optional[str]) -> Optional[str]:
+    """
+    Parse a `--profile` or `STRAPPY_PROFILE` value
+
+    :raises ValueError: If the value is not a known mode, or a boolean
+    """
+    if value is None or value.lower() in ("", "0", "false", "off"):
+        return None
+    if value.lower() in ("1", "true", "on"):
+        return "cprofile"
+    if value.lower() not in PROFILE_MODES:
+        raise ValueError(
+            f"Unknown profile mode '{value}', expected one of {PROFILE_MODES}"
+        )
+    return value.lower()
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples the stacks of registered threads on a background thread
+
+    Samples are wall clock, so a thread blocked on a child process is sampled where it waits.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        # thread ident -> phase name
+        self.threads: dict[int, str] = {}
+        # phase name -> collapsed stack -> sample count
+        self.stacks: dict[str, Counter] = {}
+        # wall time covered by the samples, since the sampler wakes up later than `interval` under load
+        self.sampled_seconds = 0.0
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, phase: str) -> None:
+        """Sample the current thread as part of `phase`"""
+        self.threads[threading.get_ident()] = phase
+
+    def unregister(self) -> None:
+        self.threads.pop(threading.get_ident(), None)
+
+    def _sample(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self.sampled_seconds += now - last
+            self.sample_count += 1
+            last = now
+            frames = sys._current_frames()
+            for ident, phase in list(self.threads.items()):
+                if (frame := frames.get(ident)) is None:
+                    continue
+                stack: list[str] = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks.setdefault(phase, Counter())[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._sample, name="profile-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def self_times(self, phase: str) -> list[tuple[str, float]]:
+        """Functions by sampled self time in seconds, most first"""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.get(phase, Counter()).items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        seconds_per_sample = (
+            self.sampled_seconds / self.sample_count if self.sample_count else 0.0
+        )
+        return [
+            (function, count * seconds_per_sample)
+            for function, count in leaves.most_common()
+        ]
+
+
+class PhaseProfiler(Loggable):
+    """
+    Profiles each phase separately, writing the results to `out_dir`
+
+    Use as a context manager around the schedule, and wrap each phase with `wrap`.
+    """
+
+    def __init__(self, mode: str, out_dir: Path, run_id: str):
+        self.mode = mode
+        self.out_dir = out_dir
+        self.run_id = run_id
+        self.sampler = StackSampler()
+        self.profiles: dict[str, cProfile.Profile] = {}
+
+    def __enter__(self) -> Self:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.sampler.stop()
+        for phase in sorted(self.profiles.keys() | self.sampler.stacks.keys()):
+            self._write_phase(phase)
+
+    @property
+    def max_workers(self) -> Optional[int]:
+        """Thread pool size for the schedule, since cProfile can only profile one phase at a time"""
+        return 1 if self.mode == "cprofile" else None
+
+    def output_path(self, name: str, suffix: str) -> Path:
+        return self.out_dir / f"{self.run_id}_{name}{suffix}"
+
+    def wrap(self, phase: Phase) -> Phase:
+        """Return a copy of `phase` that runs under the profiler"""
+
+        def run() -> object:
+            self.sampler.register(phase.name)
+            try:
+                if self.mode != "cprofile":
+                    return phase.run()
+                profile = self.profiles[phase.name] = cProfile.Profile()
+                return profile.runcall(phase.run)
+            finally:
+                self.sampler.unregister()
+
+        return replace(phase, run=run)
+
+    def _write_phase(self, phase: str) -> None:
+        lines = [f"\n{f' Profile: {phase} ({self.mode}) ':=^80}"]
+
+        if (profile := self.profiles.get(phase)) is not None:
+            stats_path = self.output_path(phase, ".pstats")
+            profile.dump_stats(stats_path)
+            report = io.StringIO()
+            pstats.Stats(profile, stream=report).sort_stats("tottime").print_stats(
+                TOP_FUNCTIONS
+            )
+            # drop the header, down to the column titles
+            lines += report.getvalue().split("\n\n", 1)[-1].strip("\n").splitlines()
+            lines.append(f"Stats written to '{stats_path}'")
+        else:
+            lines.append(f"{'self (s)':>10}  function")
+            lines += [
+                f"{seconds:>10.3f}  {function}"
+                for function, seconds in self.sampler.self_times(phase)[:TOP_FUNCTIONS]
+            ]
+
+        if stacks := self.sampler.stacks.get(phase):
+            collapsed_path = self.output_path(phase, ".collapsed")
+            collapsed_path.write_text(
+                "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+            )
+            lines.append(f"Collapsed stacks written to '{collapsed_path}'")
+
+        self.logger.info("\n".join(lines))
+
+    def profile_imports(self, cwd: Path) -> dict[str, float]:
+        """
+        Measure import costs in a child process, so that already imported modules are measured too
+
+        The raw `-X importtime` output is saved next to the phase profiles.
+
+        :param cwd: Directory to run the child process in, the root of the strappy checkout
+        :return: Total import self time in seconds, by group of `IMPORT_GROUPS`
+        """
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _IMPORT_SCRIPT],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        imports_path = self.output_path("imports", ".txt")
+        imports_path.write_text(result.stderr)
+
+        entries = parse_importtime(result.stderr)
+        totals = import_totals(entries)
+        slowest = sorted(
+            (entry for entry in entries if _import_group(entry[0]) is not None),
+            key=lambda entry: entry[2],
+            reverse=True,
+        )
+        lines = [f"\n{' Import Costs ':=^80}"]
+        lines += [
+            f"{group:<12}{seconds * 1000:>10.1f}ms self"
+            for group, seconds in totals.items()
+        ]
+        lines.append(f"{'cumulative':>22}  module")
+        lines += [
+            f"{cumulative / 1000:>20.1f}ms  {name}"
+            for name, _, cumulative in slowest[:TOP_FUNCTIONS]
+        ]
+        lines.append(f"Import times written to '{imports_path}'")
+        self.logger.info("\n".join(lines))
+        return totals
+
+
+def parse_importtime(output: str) -> list[tuple[str, int, int]]:
+    """
+    Parse `-X importtime` output
+
+    :return: (module, self microseconds, cumulative microseconds) of every import, in the order they finished
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        entries.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return entries
+
+
+def _import_group(module: str) -> Optional[str]:
+    for group, prefixes in IMPORT_GROUPS.items():
+        if any(
+            module == prefix or module.startswith(f"{prefix}.") for prefix in prefixes
+        ):
+            return group
+    return None
+
+
+def import_totals(entries: list[tuple[str, int, int]]) -> dict[str, float]:
+    """Sum the import self times of each group of `IMPORT_GROUPS`, in seconds"""
+    totals = {group: 0.0 for group in IMPORT_GROUPS}
+    for module, self_us, _ in entries:
+        if (group := _import_group(module)) is not None:
+            totals[group] += self_us / 1_000_000
+    return totals
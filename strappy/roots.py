@@ -0,0 +1,199 @@
+"""
+Provides a runner that applies the same plan to several roots concurrently, e.g. every home directory on a shared
+machine, or every image root on a build host.
+
+Each root runs in its own worker process, so that per-run module state (e.g. the run id and the active transaction)
+never leaks between roots. A worker's log output is captured and returned with its result, then written as one
+block, so that the output of roots running alongside each other doesn't interleave.
+"""
+
+import logging
+import os
+import stat
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from strappy.scheduler import STEP_ERRORS
+from strappy.util.loggable import Loggable
+
+# directories under a root prefix that are never provisioned
+SKIP_ROOT_NAMES: tuple[str, ...] = ("Shared", "Guest", "lost+found")
+
+
+@dataclass(frozen=True)
+class RootResult:
+    root: str
+    # one of "ok", "unchanged", "failed"
+    status: str
+    seconds: float = 0.0
+    # log output of the worker, already formatted
+    log: tuple[str, ...] = ()
+    error: Optional[str] = None
+
+
+class _CaptureHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.lines.append(self.format(record))
+
+
+def find_roots(prefix: Path) -> list[Path]:
+    """List the directories directly under `prefix`, skipping hidden ones and `SKIP_ROOT_NAMES`"""
+    return sorted(
+        path
+        for path in prefix.iterdir()
+        if path.is_dir()
+        and not path.name.startswith(".")
+        and path.name not in SKIP_ROOT_NAMES
+    )
+
+
+def _lchown(path: Path, owner: tuple[int, int]) -> None:
+    path_stat = path.lstat()
+    # a file with other hard links is shared, e.g. a `.bak` left linked to a backup store blob by an earlier run
+    if stat.S_ISREG(path_stat.st_mode) and path_stat.st_nlink > 1:
+        return
+    if (path_stat.st_uid, path_stat.st_gid) != owner:
+        os.lchown(path, *owner)
+
+
+def chown_to_owner(root: Path, paths: Iterable[Path]) -> None:
+    """
+    Give `paths`, the contents of those that are directories, and their parent directories up to `root`, to the
+    owner of `root`
+
+    Only does anything when running as the superuser, e.g. when provisioning other users' home directories.
+    Symlinks are changed themselves, never their targets.
+    """
+    if not hasattr(os, "geteuid") or os.geteuid() != 0:
+        return
+
+    root_stat = root.stat()
+    owner = (root_stat.st_uid, root_stat.st_gid)
+    seen: set[Path] = set()
+    for path in paths:
+        if path.is_dir() and not path.is_symlink():
+            # a copied directory, e.g. a skill or a directory `.bak`, which os.walk doesn't leave through symlinks
+            for dirpath, dirnames, filenames in os.walk(path):
+                for name in dirnames + filenames:
+                    _lchown(Path(dirpath) / name, owner)
+
+        while path != root and root in path.parents and path not in seen:
+            seen.add(path)
+            try:
+                _lchown(path, owner)
+            except FileNotFoundError:
+                pass
+            path = path.parent
+
+
+def run_root(root: Path, run: Callable[[], bool]) -> RootResult:
+    """
+    Run the plan for a single root, capturing its log output
+
+    This is called in the worker process. Handlers inherited from the parent (when the worker is forked) are
+    swapped out while the plan runs, so that nothing is written directly.
+
+    :param root: Root the plan is applied to
+    :param run: The plan, returns True if it changed anything
+    """
+    capture = _CaptureHandler()
+    capture.setFormatter(logging.Formatter("%(message)s"))
+    root_logger = logging.getLogger()
+    original_handlers, original_level = list(root_logger.handlers), root_logger.level
+    root_logger.handlers = [capture]
+    root_logger.setLevel(logging.INFO)
+
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        if not run():
+            status = "unchanged"
+    except STEP_ERRORS as err:
+        Loggable.log().exception(f"Provisioning '{root}' failed: {err}")
+        status, error = "failed", str(err)
+    finally:
+        root_logger.handlers = original_handlers
+        root_logger.setLevel(original_level)
+
+    return RootResult(
+        root=str(root),
+        status=status,
+        seconds=time.perf_counter() - start,
+        log=tuple(capture.lines),
+        error=error,
+    )
+
+
+def format_root(result: RootResult) -> str:
+    """Format the captured log output and outcome of a single root"""
+    lines = [f"\n{f' {result.root} ':=^80}", *result.log]
+    lines.append(f"{result.root}: {result.status} in {result.seconds:.2f}s")
+    return "\n".join(lines)
+
+
+def run_roots(
+    roots: list[Path],
+    worker: Callable[[Path], RootResult],
+    max_workers: Optional[int] = None,
+) -> list[RootResult]:
+    """
+    Run `worker` for every root on a process pool, logging each root's output as it finishes
+
+    A root whose worker process dies is marked failed, the other roots carry on.
+
+    :param roots: Roots to provision
+    :param worker: Picklable callable that provisions a single root, e.g. a module level function or a `partial`
+    :param max_workers: Size of the process pool, defaults to one process per root, up to the CPU count
+    :return: Result of each root, in the order the roots were given
+    """
+    if not roots:
+        return []
+
+    results: dict[Path, RootResult] = {}
+    with ProcessPoolExecutor(
+        max_workers=max_workers or min(len(roots), os.cpu_count() or 1)
+    ) as pool:
+        futures = {pool.submit(worker, root): root for root in roots}
+        for future in as_completed(futures):
+            root = futures[future]
+            try:
+                result = future.result()
+            except BrokenExecutor as err:
+                result = RootResult(
+                    root=str(root), status="failed", error=f"worker failed: {err}"
+                )
+            results[root] = result
+            Loggable.log().info(format_root(result))
+
+    return [results[root] for root in roots]
+
+
+def format_roots_report(results: list[RootResult], wall_seconds: float) -> str:
+    """Format a merged report of every root's outcome"""
+    lines = [f"\n{' Provisioning Summary ':=^80}"]
+    for result in results:
+        line = f"{result.root:<48}{result.status:<12}{result.seconds:>10.2f}s"
+        if result.error:
+            line += f"  ({result.error})"
+        lines.append(line)
+
+    counts = ", ".join(
+        f"{sum(1 for result in results if result.status == status)} {status}"
+        for status in ("ok", "unchanged", "failed")
+    )
+    lines += [
+        f"{len(results)} root(s): {counts}",
+        (
+            f"Total wall time: {wall_seconds:.2f}s "
+            f"(roots took {sum(result.seconds for result in results):.2f}s)"
+        ),
+        f"{'=' * 80}\n",
+    ]
+    return "\n".join(lines)
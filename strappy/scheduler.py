@@ -0,0 +1,223 @@
+"""
+Provides a scheduler that runs bootstrap phases concurrently, in dependency order.
+
+Each phase runs on a thread pool as soon as the phases it depends on have finished. Log output from buffered phases
+is held back and written as one block when the phase finishes, so that it doesn't interleave with the output of
+phases running alongside it. Unbuffered phases (e.g. package installs, which may prompt the user) log as they go.
+"""
+
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from strappy.util import events
+from strappy.util.loggable import Loggable
+
+# errors a failing step is expected to raise, e.g. a failed command or an unwritable file, anything else is a bug
+STEP_ERRORS: tuple[type[Exception], ...] = (
+    OSError,
+    RuntimeError,
+    ValueError,
+    subprocess.SubprocessError,
+)
+
+
+@dataclass(frozen=True)
+class Phase:
+    name: str
+    run: Callable[[], object]
+    # names of phases that must finish successfully before this phase starts
+    depends_on: tuple[str, ...] = ()
+    # hold back log output until the phase finishes
+    buffer_logs: bool = True
+
+
+@dataclass(frozen=True)
+class PhaseResult:
+    name: str
+    # one of "ok", "failed", "skipped"
+    status: str
+    # seconds from the start of the schedule
+    started: float = 0.0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class _PhaseLogBuffer(logging.Handler):
+    """
+    Root log handler that buffers records from phase threads, and forwards everything else to `handlers`
+    """
+
+    def __init__(self, handlers: list[logging.Handler]):
+        super().__init__()
+        self.handlers = handlers
+        self.buffers: dict[str, list[logging.LogRecord]] = {}
+        self.local = threading.local()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if (phase := getattr(self.local, "phase", None)) is not None:
+            self.buffers.setdefault(phase, []).append(record)
+            return
+        self._forward(record)
+
+    def _forward(self, record: logging.LogRecord) -> None:
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def flush_phase(self, phase: str) -> None:
+        # hold the handler lock, so that the whole block is written without other records in between
+        with self.lock:
+            for record in self.buffers.pop(phase, []):
+                self._forward(record)
+
+
+def _check_phases(phases: list[Phase]) -> None:
+    """
+    :raises ValueError: If phase names repeat, a dependency is unknown, or dependencies form a cycle
+    """
+    names = [phase.name for phase in phases]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Phase names must be unique, got {names}")
+
+    by_name = {phase.name: phase for phase in phases}
+    for phase in phases:
+        if unknown := set(phase.depends_on) - set(by_name):
+            raise ValueError(
+                f"Phase '{phase.name}' depends on unknown {sorted(unknown)}"
+            )
+
+    # depth first search, a phase seen again while it is still on the stack closes a cycle
+    visiting: set[str] = set()
+    done: set[str] = set()
+
+    def visit(name: str) -> None:
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Phase dependencies form a cycle through '{name}'")
+        visiting.add(name)
+        for dependency in by_name[name].depends_on:
+            visit(dependency)
+        visiting.remove(name)
+        done.add(name)
+
+    for name in names:
+        visit(name)
+
+
+def run_phases(
+    phases: list[Phase], max_workers: Optional[int] = None
+) -> list[PhaseResult]:
+    """
+    Run phases concurrently, each as soon as its dependencies have finished successfully
+
+    A phase that raises is marked failed, and the phases that depend on it are skipped. Other phases carry on.
+
+    :param phases: Phases to run
+    :param max_workers: Size of the thread pool, defaults to one thread per phase
+    :return: Result of each phase, in the order the phases were given
+    """
+    _check_phases(phases)
+
+    root_logger = logging.getLogger()
+    original_handlers = list(root_logger.handlers)
+    log_buffer = _PhaseLogBuffer(original_handlers)
+    root_logger.handlers = [log_buffer]
+
+    schedule_start = time.perf_counter()
+
+    def run_phase(phase: Phase) -> PhaseResult:
+        log_buffer.local.phase = phase.name if phase.buffer_logs else None
+        events.set_phase(phase.name)
+        started = time.perf_counter()
+        status, error = "ok", None
+        try:
+            phase.run()
+        except STEP_ERRORS as err:
+            Loggable.log().exception(f"Phase '{phase.name}' failed: {err}")
+            status, error = "failed", str(err)
+        finally:
+            log_buffer.local.phase = None
+            log_buffer.flush_phase(phase.name)
+
+        result = PhaseResult(
+            name=phase.name,
+            status=status,
+            started=started - schedule_start,
+            seconds=time.perf_counter() - started,
+            error=error,
+        )
+        Loggable.event(
+            "phase", status=status, duration=round(result.seconds, 3), error=error
+        )
+        events.set_phase(None)
+        return result
+
+    results: dict[str, PhaseResult] = {}
+    pending = {phase.name: phase for phase in phases}
+    running: dict[Future, Phase] = {}
+    try:
+        with ThreadPoolExecutor(
+            max_workers=max_workers or len(phases) or 1,
+            thread_name_prefix="phase",
+        ) as pool:
+            while pending or running:
+                # start or skip every phase whose dependencies have finished, repeating since a skip can cascade
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for name, phase in list(pending.items()):
+                        finished = [
+                            results[dependency]
+                            for dependency in phase.depends_on
+                            if dependency in results
+                        ]
+                        if failed := [r.name for r in finished if r.status != "ok"]:
+                            results[name] = PhaseResult(
+                                name=name,
+                                status="skipped",
+                                error=f"dependency {failed} did not succeed",
+                            )
+                        elif len(finished) == len(phase.depends_on):
+                            running[pool.submit(run_phase, phase)] = phase
+                        else:
+                            continue
+                        del pending[name]
+                        progressed = True
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future).name] = future.result()
+    finally:
+        root_logger.handlers = original_handlers
+
+    return [results[phase.name] for phase in phases]
+
+
+def format_summary(results: list[PhaseResult], wall_seconds: float) -> str:
+    """Format a timing summary of a schedule's results"""
+    lines = [f"\n{' Bootstrap Phase Summary ':=^80}"]
+    for result in results:
+        line = f"{result.name:<24}{result.status:<10}{result.seconds:>10.2f}s"
+        if result.error:
+            line += f"  ({result.error})"
+        lines.append(line)
+
+    # time saved is the sum of the phase times, less the time it took to run them all
+    phase_seconds = sum(result.seconds for result in results)
+    lines += [
+        (
+            f"Total wall time: {wall_seconds:.2f}s "
+            f"(phases took {phase_seconds:.2f}s, "
+            f"{max(phase_seconds - wall_seconds, 0.0):.2f}s saved by running them concurrently)"
+        ),
+        f"{'=' * 80}\n",
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,229 @@
+"""
+Provides a benchmark of interactive zsh startup, for the `bench-shell` command.
+
+Startup latency is measured by running `zsh -i -c exit` several times against a home directory, and reported as p50
+and p95. The cost of each line of the managed `.zshrc` block is measured separately, from xtrace timestamps: a
+line's cost is the time until the next line of `.zshrc` runs, so it includes whatever the line sources or calls.
+Tracing slows zsh down, so the traced runs aren't part of the latency samples.
+
+The p50 is compared to a saved baseline, and a run is a regression when it is slower by more than a relative
+threshold, and by more than an absolute floor, so that a few milliseconds of noise don't fail a fast shell.
+"""
+
+import json
+import os
+import re
+import statistics
+import subprocess
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+from strappy.managed_block import block_digest, find_block, read_block
+from strappy.util.fs import atomic_write_text
+
+# xtrace prompt with a microsecond timestamp, the script or function name, and the line number
+TRACE_PS4: str = "+strappy:%D{%s.%6.}:%N:%i> "
+_TRACE_LINE = re.compile(r"^\+strappy:(\d+\.\d+):(.*):(\d+)> ")
+
+# a regression must also be at least this much slower, in seconds
+MIN_REGRESSION_SECONDS: float = 0.005
+
+
+@dataclass(frozen=True)
+class LineCost:
+    # line number in `.zshrc`
+    line: int
+    text: str
+    seconds: float
+
+
+@dataclass(frozen=True)
+class ShellBench:
+    samples: tuple[float, ...]
+    p50: float
+    p95: float
+    # lines of the managed block, in file order
+    lines: tuple[LineCost, ...] = ()
+    # digest of the managed block that was measured, None if there is no block
+    block: Optional[str] = None
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Percentile with linear interpolation between the closest ranks"""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * percent / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _shell_env(home: Path, trace: bool = False) -> dict[str, str]:
+    env = {**os.environ, "HOME": str(home), "ZDOTDIR": str(home), "TERM": "dumb"}
+    if trace:
+        env["PS4"] = TRACE_PS4
+    return env
+
+
+def time_startup(zsh: Path, home: Path, runs: int, warmup: int = 1) -> list[float]:
+    """
+    Time `zsh -i -c exit` against `home`
+
+    :param warmup: Runs to discard first, so that the file cache is warm
+    :return: Seconds of each run
+    """
+    samples = []
+    for index in range(warmup + runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [str(zsh), "-i", "-c", "exit"],
+            env=_shell_env(home),
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            check=False,
+        )
+        if index >= warmup:
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def parse_trace(trace: str, zshrc: Path) -> dict[int, float]:
+    """
+    Attribute xtrace time to the lines of `zshrc`
+
+    :param trace: stderr of a zsh run with `PS4` set to `TRACE_PS4` and xtrace on
+    :return: Seconds spent from each line of `zshrc` to the next, by line number. A line that ran more than once
+             (e.g. in a loop) gets the sum
+    """
+    entries = [
+        (float(match.group(1)), match.group(2), int(match.group(3)))
+        for line in trace.splitlines()
+        if (match := _TRACE_LINE.match(line))
+    ]
+    target = zshrc.resolve()
+    is_zshrc: dict[str, bool] = {}
+
+    costs: dict[int, float] = {}
+    current: Optional[tuple[float, int]] = None
+    for timestamp, name, line in entries:
+        if name not in is_zshrc:
+            is_zshrc[name] = Path(name).resolve() == target
+        if not is_zshrc[name]:
+            continue
+        if current is not None:
+            costs[current[1]] = costs.get(current[1], 0.0) + timestamp - current[0]
+        current = (timestamp, line)
+    if current is not None and entries:
+        # the last line runs until the shell is done with startup
+        costs[current[1]] = costs.get(current[1], 0.0) + entries[-1][0] - current[0]
+    return costs
+
+
+def trace_block(zsh: Path, home: Path, runs: int) -> tuple[LineCost, ...]:
+    """
+    Cost of each line of the managed block in `home/.zshrc`, the median of `runs` traced runs
+
+    :return: Costs of the lines that ran, in file order, empty if there is no managed block
+    """
+    zshrc = home / ".zshrc"
+    try:
+        lines = zshrc.read_text().splitlines()
+    except FileNotFoundError:
+        return ()
+    if (found := find_block(lines)) is None:
+        return ()
+    start, end, _ = found
+    # line numbers are 1-based, the markers are left out
+    block = range(start + 2, end + 1)
+
+    traced: dict[int, list[float]] = {}
+    for _ in range(runs):
+        result = subprocess.run(
+            [str(zsh), "-i", "-x", "-c", "exit"],
+            env=_shell_env(home, trace=True),
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        for line, seconds in parse_trace(result.stderr, zshrc).items():
+            if line in block:
+                traced.setdefault(line, []).append(seconds)
+
+    return tuple(
+        LineCost(line, lines[line - 1].strip(), statistics.median(samples))
+        for line, samples in sorted(traced.items())
+    )
+
+
+def measure_shell(
+    zsh: Path, home: Path, runs: int = 20, trace_runs: int = 3
+) -> ShellBench:
+    """Measure startup latency and the cost of each line of the managed block"""
+    samples = time_startup(zsh, home, runs)
+    try:
+        found = read_block((home / ".zshrc").read_text())
+    except FileNotFoundError:
+        found = None
+    return ShellBench(
+        samples=tuple(samples),
+        p50=percentile(samples, 50),
+        p95=percentile(samples, 95),
+        lines=trace_block(zsh, home, trace_runs) if trace_runs else (),
+        block=block_digest(found[1]) if found is not None else None,
+    )
+
+
+def load_baseline(path: Path) -> Optional[ShellBench]:
+    try:
+        data = json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return ShellBench(
+        samples=tuple(data["samples"]),
+        p50=data["p50"],
+        p95=data["p95"],
+        lines=tuple(LineCost(**line) for line in data.get("lines", [])),
+        block=data.get("block"),
+    )
+
+
+def save_baseline(path: Path, bench: ShellBench) -> None:
+    atomic_write_text(path, json.dumps(asdict(bench), indent=2) + "\n")
+
+
+def is_regression(bench: ShellBench, baseline: ShellBench, threshold: float) -> bool:
+    """
+    Check if startup got slower than the baseline by more than `threshold` (e.g. 0.2 for 20%), and by more than
+    `MIN_REGRESSION_SECONDS`
+    """
+    slower = bench.p50 - baseline.p50
+    return slower > baseline.p50 * threshold and slower > MIN_REGRESSION_SECONDS
+
+
+def format_bench(
+    bench: ShellBench, baseline: Optional[ShellBench] = None, top: int = 10
+) -> str:
+    """Format the latencies, the change from the baseline, and the most expensive lines of the managed block"""
+    lines = [
+        f"\n{' Shell Startup ':=^80}",
+        f"zsh -i -c exit, {len(bench.samples)} runs: p50 {bench.p50 * 1000:.1f}ms, p95 {bench.p95 * 1000:.1f}ms",
+    ]
+    if baseline is not None:
+        change = (bench.p50 - baseline.p50) / baseline.p50 if baseline.p50 else 0.0
+        lines.append(
+            f"baseline: p50 {baseline.p50 * 1000:.1f}ms, p95 {baseline.p95 * 1000:.1f}ms ({change:+.1%} p50)"
+            + (", managed block changed since" if baseline.block != bench.block else "")
+        )
+    if bench.lines:
+        lines.append("Managed block, slowest lines (median of traced runs):")
+        lines += [
+            f"{cost.seconds * 1000:>10.1f}ms  line {cost.line:<4} {cost.text}"
+            for cost in sorted(
+                bench.lines, key=lambda cost: cost.seconds, reverse=True
+            )[:top]
+        ]
+    return "\n".join(lines)
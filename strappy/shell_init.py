@@ -0,0 +1,193 @@
+"""
+Provides the cached shell init file, generated at apply time and sourced from the managed `.zshrc` block.
+
+Work that used to run in every new shell is done once, when strappy applies the dotfiles:
+- `fzf --zsh` is run once, and its output is saved in the init file instead of being `eval`ed by every shell
+- press-and-hold is disabled with `defaults write` in the first shell only, rather than `defaults read` in every shell
+- nvm is loaded on the first call to `nvm`, `node`, `npm`, etc., by stub functions, rather than at startup
+
+The init file is compiled with `zcompile`, and zsh loads the compiled `.zwc` file in its place. The first line of the
+init file records a digest of the tools it was rendered from (their resolved paths, sizes, and mtimes, which change on
+upgrade) and of this module. The file is only rendered again when that digest changes.
+"""
+
+import hashlib
+import json
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+from strappy.package import BREW_PREFIXES
+from strappy.util.fs import atomic_write_text
+from strappy.util.loggable import Loggable
+
+# location of the init file, relative to the home directory. Must match `config/dotfiles/.zshrc`
+INIT_FILE: Path = Path(".cache") / "strappy" / "init.zsh"
+
+HEADER_PREFIX: str = "# strappy shell init"
+
+# commands that load nvm on first use
+NVM_COMMANDS: tuple[str, ...] = ("nvm", "node", "npm", "npx", "corepack")
+
+
+def init_path(home: Path) -> Path:
+    return home / INIT_FILE
+
+
+def compiled_path(home: Path) -> Path:
+    path = init_path(home)
+    return path.with_name(f"{path.name}.zwc")
+
+
+def find_tool(name: str) -> Optional[Path]:
+    """Find a command on `PATH`, or in a Homebrew prefix, which may not be on `PATH` yet during bootstrap"""
+    if found := shutil.which(name):
+        return Path(found)
+    for prefix in BREW_PREFIXES:
+        if (candidate := prefix / "bin" / name).is_file():
+            return candidate
+    return None
+
+
+def _stat_key(path: Optional[Path]) -> Optional[str]:
+    """Identify a tool's installed version by its resolved path, size, and mtime, without running it"""
+    if path is None or not path.exists():
+        return None
+    resolved = path.resolve()
+    stat = resolved.stat()
+    return f"{resolved}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def tool_versions(home: Path) -> dict[str, Optional[str]]:
+    """The inputs of the init file, None for tools that aren't installed"""
+    return {
+        "fzf": _stat_key(find_tool("fzf")),
+        "zsh": _stat_key(find_tool("zsh")),
+        "nvm": _stat_key(home / ".nvm" / "nvm.sh"),
+    }
+
+
+def init_digest(home: Path) -> str:
+    """Digest of the init file's inputs, including this module, so that a change to the template renders it again"""
+    digest = hashlib.sha256(Path(__file__).read_bytes())
+    digest.update(json.dumps(tool_versions(home), sort_keys=True).encode())
+    return f"sha256:{digest.hexdigest()}"
+
+
+def recorded_digest(home: Path) -> Optional[str]:
+    """Digest recorded in the first line of the current init file, if any"""
+    try:
+        with open(init_path(home)) as init_file:
+            header = init_file.readline()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not header.startswith(HEADER_PREFIX):
+        return None
+    return header[len(HEADER_PREFIX) :].strip()
+
+
+def _render_fzf() -> list[str]:
+    if (fzf := find_tool("fzf")) is None:
+        return []
+    try:
+        result = subprocess.run(
+            [str(fzf), "--zsh"], capture_output=True, text=True, check=True, timeout=30
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as err:
+        # `--zsh` was added in fzf 0.48
+        Loggable.log().warning(f"Could not render fzf shell integration: {err}")
+        return []
+    return [
+        "",
+        f"# fzf key bindings and completion, pre-rendered from `{fzf} --zsh`",
+        result.stdout.rstrip("\n"),
+    ]
+
+
+def _render_press_and_hold() -> list[str]:
+    return [
+        "",
+        "# Disable press-and-hold for keys, helpful for ideaVim. Runs once, the stamp file skips it afterwards",
+        '_strappy_stamp="$HOME/.cache/strappy/press_and_hold_disabled"',
+        'if [[ ! -e "$_strappy_stamp" ]] && (( $+commands[defaults] )); then',
+        '    defaults write -g ApplePressAndHoldEnabled -bool false && : >| "$_strappy_stamp"',
+        "fi",
+        "unset _strappy_stamp",
+    ]
+
+
+def _render_nvm(home: Path) -> list[str]:
+    if not (home / ".nvm" / "nvm.sh").exists():
+        return []
+    stubs = [
+        f'{command}() {{ _strappy_load_nvm; {command} "$@"; }}'
+        for command in NVM_COMMANDS
+    ]
+    return [
+        "",
+        "# nvm is loaded on first use, loading it at startup takes longer than the rest of the shell init",
+        'export NVM_DIR="$HOME/.nvm"',
+        "_strappy_load_nvm() {",
+        f"    unset -f _strappy_load_nvm {' '.join(NVM_COMMANDS)}",
+        '    [ -s "$NVM_DIR/nvm.sh" ] && . "$NVM_DIR/nvm.sh"',
+        "}",
+        *stubs,
+    ]
+
+
+def render_init(home: Path, digest: str) -> str:
+    """Render the init file for `home`, headed by the digest of its inputs"""
+    lines = [
+        f"{HEADER_PREFIX} {digest}",
+        "# Generated by strappy, do not edit. Rendered again when fzf, zsh, or nvm change",
+        *_render_fzf(),
+        *_render_press_and_hold(),
+        *_render_nvm(home),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def compile_init(home: Path) -> bool:
+    """
+    Compile the init file with `zcompile`, so that zsh loads the `.zwc` file instead of parsing it
+
+    :return: True if it was compiled, False if zsh isn't installed or compiling failed
+    """
+    compiled = compiled_path(home)
+    # a stale `.zwc` is ignored by zsh once the init file is newer, but don't leave it around
+    compiled.unlink(missing_ok=True)
+    if (zsh := find_tool("zsh")) is None:
+        return False
+    try:
+        subprocess.run(
+            [str(zsh), "-f", "-c", 'zcompile "$1"', "zsh", str(init_path(home))],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=30,
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as err:
+        Loggable.log().warning(f"Could not compile '{init_path(home)}': {err}")
+        return False
+    return True
+
+
+def write_init(home: Path, force: bool = False) -> bool:
+    """
+    Render and compile the init file for `home`, unless it is already up to date
+
+    :param force: Render it even if the recorded digest matches
+    :return: True if the init file was written, False if it was up to date
+    """
+    digest = init_digest(home)
+    if (
+        not force
+        and recorded_digest(home) == digest
+        and (compiled_path(home).exists() or find_tool("zsh") is None)
+    ):
+        return False
+
+    atomic_write_text(init_path(home), render_init(home, digest))
+    compile_init(home)
+    return True
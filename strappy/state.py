@@ -0,0 +1,134 @@
+"""
+Provides a fingerprint of the converged dotfile state.
+
+After the dotfile phase applies successfully, a fingerprint of its inputs and outputs is written to a state file. Later
+runs recompute the fingerprint and skip the whole phase when nothing has changed.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional
+
+from strappy.util.fs import atomic_write_text
+
+# bump this when the fingerprint layout changes, so that old state files are ignored
+STATE_VERSION: int = 2
+
+
+def _hash_tree(
+    digest, kind: str, root: Path, skip: frozenset[str] = frozenset()
+) -> None:
+    """
+    Add the entries of a directory tree to the digest, using only `stat` info, without following symlinks
+
+    Directories are walked with `os.scandir` so the stat info cached on each `DirEntry` is reused.
+    """
+    stack: list[str] = [str(root)]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            # sort so that the fingerprint doesn't depend on directory listing order
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name in skip:
+                    continue
+                entry_stat = entry.stat(follow_symlinks=False)
+                digest.update(
+                    f"{kind} {entry.path} {entry_stat.st_ino} {entry_stat.st_mode} {entry_stat.st_mtime_ns} "
+                    f"{entry_stat.st_size}\n".encode()
+                )
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+
+
+def _hash_source(digest, source: Path) -> None:
+    """Add a source file or directory tree to the digest, using only `stat` info (mtime and size)"""
+    try:
+        stat = source.stat()
+        if not source.is_dir():
+            digest.update(f"S {source} {stat.st_mtime_ns} {stat.st_size}\n".encode())
+            return
+        _hash_tree(digest, "S", source, skip=frozenset({"__pycache__"}))
+    except OSError:
+        digest.update(f"S {source} missing\n".encode())
+
+
+def _hash_destination(digest, destination: Path) -> None:
+    """
+    Add a destination path to the digest, without following symlinks
+
+    Symlinks are identified by their target, other files by inode, mtime, and size. A directory, e.g. a copied skill, is
+    walked, so that an edit inside it changes the fingerprint.
+    """
+    try:
+        stat = destination.lstat()
+        if destination.is_symlink():
+            digest.update(f"D {destination} -> {os.readlink(destination)}\n".encode())
+            return
+        digest.update(
+            f"D {destination} {stat.st_ino} {stat.st_mode} {stat.st_mtime_ns} {stat.st_size}\n".encode()
+        )
+        if destination.is_dir():
+            _hash_tree(digest, "D", destination)
+    except OSError:
+        # e.g. missing, or a file where one of its parents should be
+        digest.update(f"D {destination} missing\n".encode())
+
+
+def compute_fingerprint(
+    sources: Iterable[Path],
+    destinations: Iterable[Path],
+    constants: dict[str, object],
+) -> str:
+    """
+    Compute a fingerprint of the dotfile phase
+
+    :param sources: Source files and directories, walked recursively
+    :param destinations: Managed destination paths, checked with `lstat`
+    :param constants: Config values that change what the phase does, e.g. `DOTFILES_TO_APPEND`
+    :return: Hex digest of the fingerprint
+    """
+    digest = hashlib.sha256(f"v{STATE_VERSION}\n".encode())
+    digest.update(json.dumps(constants, sort_keys=True, default=str).encode())
+    for source in sources:
+        _hash_source(digest, source)
+    for destination in destinations:
+        _hash_destination(digest, destination)
+    return digest.hexdigest()
+
+
+def load_fingerprint(state_path: Path) -> Optional[str]:
+    """
+    Load the fingerprint of the last applied state
+
+    :return: The fingerprint, or None if there is no usable state file
+    """
+    try:
+        state = json.loads(state_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+        return None
+    return state.get("fingerprint")
+
+
+def save_fingerprint(state_path: Path, fingerprint: str) -> None:
+    """
+    Save the fingerprint of the applied state
+
+    The state file is written atomically, so a crash can't leave a partial state file behind.
+    """
+    atomic_write_text(
+        state_path,
+        json.dumps(
+            {
+                "version": STATE_VERSION,
+                "fingerprint": fingerprint,
+                "applied_at": datetime.now().isoformat(),
+            },
+            indent=2,
+        ),
+    )
@@ -0,0 +1,140 @@
+"""
+Provides a read-only drift check of every destination and package that strappy manages.
+
+Each entry is in one of these states:
+- "ok": matches the strappy config
+- "missing": doesn't exist, or the package isn't installed
+- "drifted": strappy's item is there but out of date, e.g. a symlink to the wrong place, or a hand-edited managed
+  block
+- "foreign": something that strappy didn't create is in the way, e.g. a copied directory where a symlink belongs
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from strappy.managed_block import block_digest, read_block
+from strappy.mirror import mirror_tree
+from strappy.package import BrewInventory, Package
+from strappy.targets import Target
+
+STATES: tuple[str, ...] = ("ok", "missing", "drifted", "foreign")
+
+
+@dataclass(frozen=True)
+class StatusEntry:
+    # "dotfile" or "package"
+    kind: str
+    name: str
+    state: str
+    detail: str = ""
+
+
+def _is_link_to(path: Path, source: Path) -> bool:
+    """Check if a symlink points at `source`, without resolving it unless the link text differs"""
+    return os.readlink(path) == str(source) or path.resolve() == source.resolve()
+
+
+def check_target(target: Target) -> StatusEntry:
+    """
+    Check a managed destination with a single `lstat`, plus a read of the file for managed blocks, or a stat of
+    every file for copies
+    """
+    destination = target.destination
+
+    def entry(state: str, detail: str = "") -> StatusEntry:
+        return StatusEntry("dotfile", str(destination), state, detail)
+
+    try:
+        destination_stat = destination.lstat()
+    except FileNotFoundError:
+        return entry("missing")
+
+    is_link = destination.is_symlink()
+    if target.mode == "create":
+        return entry("ok")
+
+    if target.mode == "append":
+        if not destination.exists():
+            return entry("drifted", "broken symlink")
+        try:
+            found = read_block(destination.read_text())
+        except ValueError:
+            return entry("drifted", "managed block is not closed")
+        if found is None:
+            return entry("drifted", "no managed block")
+        recorded, content = found
+        if recorded != block_digest(content):
+            return entry("drifted", "managed block edited by hand")
+        if recorded != block_digest(target.source.read_text().rstrip("\n")):
+            return entry("drifted", "managed block out of date")
+        return entry("ok")
+
+    if target.mode == "copy":
+        if is_link:
+            return entry("drifted", "symlink, expected a copy")
+        if not os.path.isdir(destination):
+            return entry("foreign", "file, expected a copy of a directory")
+        stats = mirror_tree(target.source, destination, dry_run=True)
+        if stats.changed:
+            return entry("drifted", f"copy out of date: {stats}")
+        return entry("ok")
+
+    if not is_link:
+        kind = "directory" if os.path.isdir(destination) else "file"
+        return entry(
+            "foreign", f"{kind} (mode {oct(destination_stat.st_mode & 0o777)})"
+        )
+    if not _is_link_to(destination, target.source):
+        return entry("drifted", f"links to '{os.readlink(destination)}'")
+    return entry("ok")
+
+
+def check_package(package: Package, inventory: Optional[BrewInventory]) -> StatusEntry:
+    state = "ok" if package.is_in_inventory(inventory) else "missing"
+    return StatusEntry("package", package.name, state)
+
+
+def scan_status(
+    targets: list[Target],
+    packages: list[Package],
+    inventory: Optional[BrewInventory],
+    max_workers: Optional[int] = None,
+) -> list[StatusEntry]:
+    """
+    Check every target and package
+
+    Checks run on a thread pool, since each one is a filesystem call that may be slow on a network home directory.
+
+    :return: Entries for the targets, then the packages, in the order given
+    """
+    checks = [lambda target=target: check_target(target) for target in targets]
+    checks += [
+        lambda package=package: check_package(package, inventory)
+        for package in packages
+    ]
+    if not checks:
+        return []
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers or min(32, len(checks)),
+        thread_name_prefix="status",
+    ) as pool:
+        return list(pool.map(lambda check: check(), checks))
+
+
+def format_status(entries: list[StatusEntry]) -> str:
+    """Format entries as a table, followed by a count of each state"""
+    lines = [
+        f"{entry.state:<9}{entry.kind:<9}{entry.name}"
+        + (f"  ({entry.detail})" if entry.detail else "")
+        for entry in entries
+    ]
+    counts = ", ".join(
+        f"{sum(1 for entry in entries if entry.state == state)} {state}"
+        for state in STATES
+    )
+    lines.append(f"\n{len(entries)} checked: {counts}")
+    return "\n".join(lines)
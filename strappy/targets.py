@@ -0,0 +1,23 @@
+"""
+Provides the description of a single destination managed by the dotfile and agent config installers.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass(frozen=True)
+class Target:
+    """
+    A managed destination, and the source it comes from
+
+    `mode` is one of:
+    - "link": the destination is a symlink to the source, anything else there is replaced
+    - "append": the source is merged into the destination as a managed block, see `strappy.managed_block`
+    - "create": the destination is linked to the source if it doesn't exist yet, otherwise it is left alone
+    - "copy": the destination is a copy of the source tree, kept in sync file by file, see `strappy.mirror`
+    """
+
+    destination: Path
+    source: Path
+    mode: str = "link"
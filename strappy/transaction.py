@@ -0,0 +1,320 @@
+"""
+Provides transactional apply of filesystem changes, e.g. dotfile symlinks in `HOME`.
+
+Changes are staged first, then applied one at a time:
+
+1. the current destination is backed up to the backup store
+2. the new item is prepared next to the destination, under a temporary name
+3. the destination is renamed aside, and the new item is renamed into its place
+
+A directory that is synced in place (see `Transaction.sync`) is backed up, then rewritten where it differs from its
+source, and is undone by restoring its backup.
+
+Every step is recorded in a journal before it happens. If a step fails, the applied changes are undone in reverse
+order by renaming the old items back. A journal left behind by a crashed run is rolled back the same way by
+`Transaction.recover`.
+"""
+
+import json
+import os
+import threading
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from strappy.backup import BackupStore
+from strappy.mirror import mirror_tree
+from strappy.util.fs import atomic_write_text, remove_path
+from strappy.util.loggable import Loggable
+
+# name of the journal directory, under `LOG_DIR`
+JOURNALS_DIR_NAME: str = "transactions"
+
+
+@dataclass
+class Operation:
+    """
+    A staged change to a single destination path
+
+    `kind` is one of:
+    - "link": replace the destination with a symlink to `source`
+    - "mirror": replace the destination with a copy of the `source` tree, see `strappy.mirror`
+    - "sync": make the destination directory a copy of the `source` tree in place, see `strappy.mirror`
+    - "write": replace the destination with a file containing `text`
+    - "restore": replace the destination with a tree from the backup store
+    - "remove": remove the destination
+    """
+
+    kind: str
+    destination: Path
+    source: Optional[Path] = None
+    text: Optional[str] = None
+    tree: list[dict] = field(default_factory=list)
+    # refresh `<name>.bak` next to the destination once the transaction commits
+    keep_bak: bool = False
+    # one of "pending", "prepared", "moved_aside", "applied"
+    state: str = "pending"
+    existed: bool = False
+    backup: list[dict] = field(default_factory=list)
+
+    @property
+    def temp(self) -> Path:
+        return self.destination.with_name(f".{self.destination.name}.strappy-new")
+
+    @property
+    def aside(self) -> Path:
+        return self.destination.with_name(f".{self.destination.name}.strappy-old")
+
+    def to_journal(self) -> dict:
+        journal = {
+            "kind": self.kind,
+            "destination": str(self.destination),
+            "state": self.state,
+            "existed": self.existed,
+        }
+        if self.kind == "sync":
+            # a sync is undone from its backup, rather than from an item renamed aside
+            journal["backup"] = self.backup
+        return journal
+
+
+class Transaction(Loggable):
+    """
+    Stages filesystem changes, then applies them with atomic renames, rolling back on failure
+
+    Operations may be staged from several threads. Backups go to the manifest of `run_id` in `store` when the
+    transaction commits, so a committed transaction can be undone later with `restore` operations. Until then, the
+    journal has what's needed to roll it back.
+    """
+
+    def __init__(self, run_id: str, store: BackupStore, journal_dir: Path):
+        self.run_id = run_id
+        self.store = store
+        self.journal_path = journal_dir / f"{run_id}_{uuid.uuid4().hex[:8]}.json"
+        self.operations: list[Operation] = []
+        self._lock = threading.Lock()
+
+    def stage(self, operation: Operation) -> None:
+        with self._lock:
+            self.operations.append(operation)
+
+    def link(self, destination: Path, source: Path) -> None:
+        self.stage(
+            Operation(
+                kind="link", destination=destination, source=source, keep_bak=True
+            )
+        )
+
+    def mirror(self, destination: Path, source: Path) -> None:
+        self.stage(
+            Operation(
+                kind="mirror", destination=destination, source=source, keep_bak=True
+            )
+        )
+
+    def sync(self, destination: Path, source: Path) -> None:
+        """Stage an in-place sync of an existing directory, which only rewrites the files that differ from `source`"""
+        self.stage(Operation(kind="sync", destination=destination, source=source))
+
+    def write_text(self, destination: Path, text: str) -> None:
+        self.stage(
+            Operation(kind="write", destination=destination, text=text, keep_bak=True)
+        )
+
+    def restore(self, destination: Path, tree: list[dict]) -> None:
+        self.stage(Operation(kind="restore", destination=destination, tree=tree))
+
+    def remove(self, destination: Path) -> None:
+        self.stage(Operation(kind="remove", destination=destination))
+
+    def _write_journal(self, status: str) -> None:
+        atomic_write_text(
+            self.journal_path,
+            json.dumps(
+                {
+                    "run_id": self.run_id,
+                    "status": status,
+                    "operations": [op.to_journal() for op in self.operations],
+                },
+                indent=2,
+            ),
+        )
+
+    def _prepare(self, operation: Operation) -> None:
+        """Create the new item for an operation at its temporary path"""
+        if os.path.lexists(operation.temp):
+            remove_path(operation.temp)
+
+        if operation.kind == "link":
+            operation.temp.symlink_to(operation.source)
+        elif operation.kind == "mirror":
+            mirror_tree(operation.source, operation.temp)
+        elif operation.kind == "write":
+            operation.temp.write_text(operation.text)
+            if operation.existed:
+                os.chmod(operation.temp, os.stat(operation.destination).st_mode)
+        elif operation.kind == "restore":
+            self.store.materialize(operation.tree, operation.temp)
+
+    def _apply_operation(self, operation: Operation) -> None:
+        destination = operation.destination
+        operation.existed = os.path.lexists(destination)
+        if operation.kind == "remove" and not operation.existed:
+            return
+
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if operation.existed:
+            self.logger.info(f"Backing up '{destination}' to the backup store")
+        operation.backup, _ = self.store.backup(destination, self.run_id, record=False)
+
+        if operation.kind == "sync":
+            operation.state = "applied"
+            self._write_journal("applying")
+            stats = mirror_tree(operation.source, destination)
+            self.logger.info(f"Synced '{destination}': {stats}")
+            return
+
+        self._prepare(operation)
+        operation.state = "prepared"
+
+        if operation.existed:
+            operation.state = "moved_aside"
+            self._write_journal("applying")
+            os.rename(destination, operation.aside)
+
+        operation.state = "applied"
+        self._write_journal("applying")
+        if operation.kind != "remove":
+            os.rename(operation.temp, destination)
+
+    def apply(self) -> None:
+        """
+        Apply every staged operation, in order
+
+        :raises Exception: Whatever made an operation fail, after every applied operation has been rolled back
+        """
+        if not self.operations:
+            return
+
+        self._write_journal("applying")
+        try:
+            for operation in self.operations:
+                self._apply_operation(operation)
+        except BaseException:
+            applied = sum(1 for op in self.operations if op.state != "pending")
+            self.logger.error(
+                f"Failed to apply changes, rolling back {applied} operation(s)"
+            )
+            self.rollback()
+            raise
+
+        # the old items are in the backup store, so the ones renamed aside are no longer needed
+        for operation in self.operations:
+            if os.path.lexists(operation.aside):
+                remove_path(operation.aside)
+
+        backups = [
+            (operation.destination, operation.backup)
+            for operation in self.operations
+            if operation.state != "pending"
+        ]
+        for operation in self.operations:
+            if operation.keep_bak and operation.backup:
+                self._refresh_bak(operation, backups)
+        # recorded before the journal goes, so that a crash in between rolls back rather than losing the backups
+        self.store.record(self.run_id, backups)
+        self.journal_path.unlink(missing_ok=True)
+
+    def _refresh_bak(
+        self, operation: Operation, backups: list[tuple[Path, list[dict]]]
+    ) -> None:
+        """
+        Replace `<name>.bak` with a copy of the destination's backup
+
+        :param backups: Backups to record, to which the replaced `.bak` is added
+        """
+        bak = operation.destination.with_name(f"{operation.destination.name}.bak")
+        try:
+            if os.path.lexists(bak):
+                entries, _ = self.store.backup(bak, self.run_id, record=False)
+                backups.append((bak, entries))
+                remove_path(bak)
+            self.store.materialize(operation.backup, bak)
+        except OSError as err:
+            # the backup itself is safe in the store, so this doesn't fail the transaction
+            self.logger.warning(f"Failed to refresh '{bak}': {err}")
+
+    def rollback(self) -> None:
+        """
+        Undo applied operations, in reverse order
+
+        Each step only looks at what is on disk, so it is safe to repeat after a crash part way through.
+        """
+        for operation in reversed(self.operations):
+            if operation.state == "pending":
+                continue
+
+            if operation.kind == "sync":
+                self._restore_synced(operation)
+            elif os.path.lexists(operation.aside):
+                if os.path.lexists(operation.destination):
+                    remove_path(operation.destination)
+                os.rename(operation.aside, operation.destination)
+            elif (
+                not operation.existed
+                and operation.state == "applied"
+                and os.path.lexists(operation.destination)
+            ):
+                remove_path(operation.destination)
+
+            if os.path.lexists(operation.temp):
+                remove_path(operation.temp)
+            self.logger.info(f"Rolled back '{operation.destination}'")
+            operation.state = "pending"
+
+        self.journal_path.unlink(missing_ok=True)
+
+    def _restore_synced(self, operation: Operation) -> None:
+        """Put back the backup of a directory that was synced in place, swapping it in with renames"""
+        if not os.path.lexists(operation.aside):
+            if os.path.lexists(operation.temp):
+                remove_path(operation.temp)
+            self.store.materialize(operation.backup, operation.temp)
+            if os.path.lexists(operation.destination):
+                os.rename(operation.destination, operation.aside)
+        if os.path.lexists(operation.temp):
+            os.rename(operation.temp, operation.destination)
+        remove_path(operation.aside)
+
+    @classmethod
+    def recover(cls, store: BackupStore, journal_dir: Path) -> int:
+        """
+        Roll back every transaction whose journal was left behind by a crashed run
+
+        :return: Number of transactions rolled back
+        """
+        if not journal_dir.is_dir():
+            return 0
+
+        recovered = 0
+        for journal_path in sorted(journal_dir.glob("*.json")):
+            journal = json.loads(journal_path.read_text())
+            transaction = cls(journal["run_id"], store, journal_dir)
+            transaction.journal_path = journal_path
+            transaction.operations = [
+                Operation(
+                    kind=op["kind"],
+                    destination=Path(op["destination"]),
+                    state=op["state"],
+                    existed=op["existed"],
+                    backup=op.get("backup", []),
+                )
+                for op in journal["operations"]
+            ]
+            cls.log().warning(
+                f"Rolling back incomplete transaction from run '{journal['run_id']}'"
+            )
+            transaction.rollback()
+            recovered += 1
+        return recovered
@@ -0,0 +1,242 @@
+"""
+Provides structured run events, and the metrics derived from them.
+
+Events are flat dicts, e.g. one per child process, package, or phase. Each event updates the run's metrics, and is
+written as a line of JSON when a sink file is open (see `Loggable.setup`). At the end of a run, the metrics are
+written as a Prometheus textfile, for node_exporter's textfile collector.
+"""
+
+import json
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import IO, Optional
+
+from strappy.util.fs import atomic_write_text
+
+# file names, under `LOG_DIR`
+EVENTS_FILE_NAME: str = "bootstrap_events.ndjson"
+# the textfile collector only reads `*.prom` files
+METRICS_FILE_NAME: str = "strappy.prom"
+
+# upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS: tuple[float, ...] = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = [f'{key}="{_escape(value)}"' for key, value in labels + extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class RunMetrics:
+    """
+    Counters, gauges, and histograms for a single run, safe to update from several threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.gauges: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], _Histogram] = {}
+        self.help: dict[str, str] = {}
+
+    def inc(
+        self, name: str, help: str, value: float = 1, labels: Optional[dict] = None
+    ) -> None:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.help[name] = help
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(
+        self, name: str, help: str, value: float, labels: Optional[dict] = None
+    ) -> None:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.help[name] = help
+            self.gauges[key] = value
+
+    def observe(
+        self, name: str, help: str, value: float, labels: Optional[dict] = None
+    ) -> None:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.help[name] = help
+            self.histograms.setdefault(key, _Histogram(DURATION_BUCKETS)).observe(value)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines: list[str] = []
+
+        def header(name: str, kind: str) -> None:
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for kind, samples in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in samples}):
+                    header(name, kind)
+                    for (sample_name, labels), value in sorted(samples.items()):
+                        if sample_name == name:
+                            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                header(name, "histogram")
+                for (sample_name, labels), histogram in sorted(
+                    self.histograms.items(), key=lambda item: item[0]
+                ):
+                    if sample_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(
+                            f"{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {count}"
+                        )
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram.count}"
+                    )
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {histogram.sum:g}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+_metrics = RunMetrics()
+_sink: Optional[IO[str]] = None
+# closes the sink file on `close_sink`
+_sink_files = ExitStack()
+_sink_lock = threading.Lock()
+# phase that events from the current thread belong to, see `set_phase`
+_local = threading.local()
+
+
+def set_phase(phase: Optional[str]) -> None:
+    """Attribute events from the current thread to `phase`"""
+    _local.phase = phase
+
+
+def open_sink(path: Path) -> None:
+    """Start appending events to `path`, one JSON object per line"""
+    global _sink
+    close_sink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _sink_lock:
+        _sink = _sink_files.enter_context(path.open("a", buffering=1))
+
+
+def close_sink() -> None:
+    global _sink
+    with _sink_lock:
+        _sink_files.close()
+        _sink = None
+
+
+def metrics() -> RunMetrics:
+    return _metrics
+
+
+def reset_metrics() -> None:
+    global _metrics
+    _metrics = RunMetrics()
+
+
+def _update_metrics(event: dict) -> None:
+    kind = event["event"]
+    if kind == "command":
+        _metrics.inc("strappy_child_processes_total", "Child processes started")
+        _metrics.observe(
+            "strappy_command_duration_seconds",
+            "Time spent in child processes",
+            event["duration"],
+        )
+        _metrics.inc(
+            "strappy_command_output_bytes_total",
+            "Bytes of captured child process output",
+            event.get("output_bytes", 0),
+        )
+        if event.get("exit_code") != 0:
+            _metrics.inc(
+                "strappy_command_failures_total",
+                "Child processes that failed, or couldn't be started",
+            )
+        if event.get("timed_out"):
+            _metrics.inc(
+                "strappy_command_timeouts_total",
+                "Child processes killed for running past their timeout",
+            )
+    elif kind == "package":
+        _metrics.inc(
+            "strappy_packages_total",
+            "Packages by install result",
+            labels={"result": event["result"]},
+        )
+        _metrics.observe(
+            "strappy_package_duration_seconds",
+            "Time spent installing each package",
+            event["duration"],
+        )
+    elif kind == "phase":
+        _metrics.inc(
+            "strappy_phases_total",
+            "Phases by status",
+            labels={"phase": event["phase"], "status": event["status"]},
+        )
+        _metrics.observe(
+            "strappy_phase_duration_seconds",
+            "Time spent in each phase",
+            event["duration"],
+            labels={"phase": event["phase"]},
+        )
+
+
+def emit(event: str, **fields) -> dict:
+    """
+    Record an event, updating the run's metrics and writing it to the sink if one is open
+
+    Known events, and the fields that their metrics use:
+    - "command": `duration`, `exit_code`, `timed_out`, `output_bytes`
+    - "package": `result` (one of "installed", "skipped", "failed"), `duration`
+    - "phase": `phase`, `status`, `duration`
+
+    :return: The event, with its timestamp and phase filled in
+    """
+    record = {
+        "ts": round(time.time(), 3),
+        "event": event,
+        "phase": getattr(_local, "phase", None),
+        **fields,
+    }
+    _update_metrics(record)
+    with _sink_lock:
+        if _sink is not None:
+            _sink.write(json.dumps(record, default=str) + "\n")
+    return record
+
+
+def write_metrics(path: Path) -> None:
+    """Write the run's metrics atomically, so that a scrape never sees a partial file"""
+    atomic_write_text(path, _metrics.render())
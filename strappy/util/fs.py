@@ -0,0 +1,39 @@
+"""
+Provides filesystem helpers shared by the installers.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """
+    Write text to a file atomically
+
+    The text is written to a temporary file in the same directory, which is then renamed over `path` with
+    `os.replace`. Readers see either the old or the new file, never a partial one. If `path` already exists, its
+    permission bits are kept.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            temp_file.write(text)
+        if path.exists():
+            shutil.copymode(path, temp_name)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def remove_path(path: Path) -> None:
+    """Remove a file, symlink, or directory tree"""
+    if path.is_symlink() or path.is_file():
+        os.remove(path)
+        return
+
+    if path.is_dir():
+        shutil.rmtree(path)
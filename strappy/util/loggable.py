@@ -4,10 +4,70 @@ Provides logging utilities.
 Inherit from `Loggable` to get a `log()` classmethod that returns a logger for the parent class.
 """
 
+import atexit
+import gzip
 import logging
 import logging.handlers
+import os
+import queue
+import shutil
 import sys
+import threading
 from pathlib import Path
+from typing import Optional
+
+from strappy.util import events
+
+# the root handler and listener installed by `Loggable.setup`, kept so that setup can replace them
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _gzip_file(source: str, destination: str) -> None:
+    temp = f"{destination}.tmp"
+    with open(source, "rb") as source_file, gzip.open(temp, "wb") as temp_file:
+        shutil.copyfileobj(source_file, temp_file)
+    os.replace(temp, destination)
+    os.remove(source)
+
+
+class GzipRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotating file handler that gzips rotated files on a background thread
+
+    Rotated files are named `<name>.<n>.gz`. A rotated file is compressed while logging carries on, and the next
+    rollover waits for it, so that the backups are never shifted while one is still being written.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._rotate
+        self._compressor: Optional[threading.Thread] = None
+
+    def _rotate(self, source: str, destination: str) -> None:
+        plain = destination.removesuffix(".gz")
+        os.rename(source, plain)
+        self._compressor = threading.Thread(
+            target=_gzip_file,
+            args=(plain, destination),
+            name="log-compress",
+            daemon=True,
+        )
+        self._compressor.start()
+
+    def wait_for_compression(self) -> None:
+        if self._compressor is not None:
+            self._compressor.join()
+            self._compressor = None
+
+    def doRollover(self) -> None:
+        self.wait_for_compression()
+        super().doRollover()
+
+    def close(self) -> None:
+        self.wait_for_compression()
+        super().close()
 
 
 class Loggable:
@@ -18,31 +78,70 @@ class Loggable:
         log_path: Path,
         console_log_level: int = logging.INFO,
         file_log_level: int = logging.DEBUG,
+        max_bytes: int = 1000000,
+        backup_count: int = 5,
+        events_path: Optional[Path] = None,
     ) -> None:
         """
         Setup logging to file and console.
-        Uses a rotating file handler to limit log file size.
+        Log calls only put the record on a queue. A listener thread writes it to the file and console handlers, so
+        file I/O and rotation never block the calling thread. Rotated log files are gzipped in the background.
+        Calling setup again replaces the handlers from the previous call, rather than adding more.
         Optionally, configure the logging levels for the console and file handlers.
 
         :param log_path: Path to log directory
         :param console_log_level: Log level for console logging
         :param file_log_level: log level for file logging
+        :param max_bytes: Size at which the log file is rotated
+        :param backup_count: Number of rotated log files to keep
+        :param events_path: Also write structured events to this file as JSON lines, see `Loggable.event`
 
         """
+        global _queue_handler, _listener
+        Loggable.shutdown()
+
         root_logger = logging.getLogger()
         root_logger.setLevel(logging.DEBUG)
 
         # setup logging to file
-        file_handler = logging.handlers.RotatingFileHandler(
-            log_path, maxBytes=1000000, backupCount=5
+        file_handler = GzipRotatingFileHandler(
+            log_path, maxBytes=max_bytes, backupCount=backup_count
         )
         file_handler.setLevel(file_log_level)
-        root_logger.addHandler(file_handler)
 
         # setup logging to console
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(console_log_level)
-        root_logger.addHandler(console_handler)
+
+        # both are written from the listener thread
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        root_logger.addHandler(_queue_handler)
+        _listener.start()
+
+        if events_path is not None:
+            events.open_sink(events_path)
+
+    @staticmethod
+    def shutdown() -> None:
+        """
+        Write out every queued record and close the handlers installed by `setup`
+
+        Runs at exit. Safe to call more than once, or without `setup`.
+        """
+        global _queue_handler, _listener
+        if _queue_handler is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _queue_handler = None
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+        events.close_sink()
 
     @property
     def logger(self) -> logging.Logger:
@@ -53,3 +152,11 @@ class Loggable:
     def log(cls) -> logging.Logger:
         """Returns a logger for the parent class."""
         return logging.getLogger(cls.__name__)
+
+    @classmethod
+    def event(cls, event: str, **fields) -> dict:
+        """Records a structured event from the parent class, see `strappy.util.events.emit`."""
+        return events.emit(event, source=cls.__name__, **fields)
+
+
+atexit.register(Loggable.shutdown)
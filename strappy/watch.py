@@ -0,0 +1,241 @@
+"""
+Provides a watcher that reports changes to a source tree, e.g. `DOTFILES_DIR`.
+
+A platform waiter blocks until something under the tree may have changed: inotify on Linux, kqueue on macOS and BSD,
+or a sleep when neither is available (mtime polling). Waiters only wake the watcher up. What actually changed is
+decided by diffing a stat snapshot of the tree. Bursts of changes, such as an editor saving several files, are
+debounced until the tree stops changing.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from strappy.util.loggable import Loggable
+
+# path -> (mtime_ns, size, is_dir)
+Snapshot = dict[str, tuple[int, int, bool]]
+
+
+def snapshot(root: Path) -> Snapshot:
+    """Stat every entry under `root`, skipping `__pycache__`"""
+    entries: Snapshot = {}
+    stack: list[str] = [str(root)]
+    while stack:
+        try:
+            scanner = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with scanner:
+            for entry in scanner:
+                if entry.name == "__pycache__":
+                    continue
+                try:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                is_dir = entry.is_dir(follow_symlinks=False)
+                entries[entry.path] = (
+                    entry_stat.st_mtime_ns,
+                    entry_stat.st_size,
+                    is_dir,
+                )
+                if is_dir:
+                    stack.append(entry.path)
+    return entries
+
+
+def diff(before: Snapshot, after: Snapshot) -> set[Path]:
+    """Paths that were added, removed, or changed between two snapshots"""
+    return {
+        Path(path)
+        for path in before.keys() | after.keys()
+        if before.get(path) != after.get(path)
+    }
+
+
+def _directories(root: Path) -> list[str]:
+    return [str(root)] + [
+        path for path, (_, _, is_dir) in snapshot(root).items() if is_dir
+    ]
+
+
+class PollingWaiter:
+    """Fallback waiter, sleeps for the timeout and always reports a possible change"""
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return True
+
+    def drain(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWaiter:
+    """Linux waiter, using inotify through libc since the standard library has no binding"""
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    # | IN_MOVE_SELF
+    MASK: int = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+    IN_NONBLOCK: int = 0o4000
+    IN_CLOEXEC: int = 0o2000000
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._add_watches()
+
+    def _add_watches(self) -> None:
+        # watching a directory that is already watched just returns its existing watch, so this is safe to repeat
+        # and picks up new subdirectories
+        for directory in _directories(self.root):
+            self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+
+    def wait(self, timeout: float) -> bool:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        self.drain()
+        return True
+
+    def drain(self) -> None:
+        while True:
+            try:
+                if not os.read(self.fd, 64 * 1024):
+                    break
+            except BlockingIOError:
+                break
+        self._add_watches()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class KqueueWaiter:
+    """macOS and BSD waiter, using kqueue vnode events on every directory and file in the tree"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.kqueue = select.kqueue()
+        self.fds: list[int] = []
+        self._add_watches()
+
+    def _add_watches(self) -> None:
+        # kqueue watches file descriptors rather than paths, so reopen everything to pick up new and renamed entries
+        self._close_fds()
+        flags = getattr(os, "O_EVTONLY", os.O_RDONLY)
+        events = []
+        for path in [str(self.root), *snapshot(self.root)]:
+            try:
+                fd = os.open(path, flags)
+            except OSError:
+                continue
+            self.fds.append(fd)
+            events.append(
+                select.kevent(
+                    fd,
+                    filter=select.KQ_FILTER_VNODE,
+                    flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                    fflags=select.KQ_NOTE_WRITE
+                    | select.KQ_NOTE_EXTEND
+                    | select.KQ_NOTE_ATTRIB
+                    | select.KQ_NOTE_DELETE
+                    | select.KQ_NOTE_RENAME,
+                )
+            )
+        self.kqueue.control(events, 0, 0)
+
+    def _close_fds(self) -> None:
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+    def wait(self, timeout: float) -> bool:
+        if not self.kqueue.control(None, 64, timeout):
+            return False
+        self._add_watches()
+        return True
+
+    def drain(self) -> None:
+        if self.kqueue.control(None, 64, 0):
+            self._add_watches()
+
+    def close(self) -> None:
+        self._close_fds()
+        self.kqueue.close()
+
+
+def make_waiter(root: Path, poll: bool = False):
+    """
+    Pick the best waiter for this platform
+
+    :param poll: Always use mtime polling, e.g. for network filesystems where native events aren't delivered
+    """
+    if not poll:
+        try:
+            if sys.platform.startswith("linux"):
+                return InotifyWaiter(root)
+            if hasattr(select, "kqueue"):
+                return KqueueWaiter(root)
+        except OSError as err:
+            Loggable.log().warning(
+                f"Native file watching is unavailable ({err}), polling instead"
+            )
+    return PollingWaiter()
+
+
+def watch_tree(
+    root: Path,
+    on_change: Callable[[set[Path]], None],
+    interval: float = 1.0,
+    debounce: float = 0.3,
+    poll: bool = False,
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """
+    Call `on_change` with the changed paths every time the tree under `root` changes, until `stop` is set
+
+    :param root: Tree to watch
+    :param on_change: Called with the paths that were added, removed, or changed
+    :param interval: Longest time to block before checking `stop`, and the poll interval when polling
+    :param debounce: A change is only reported once the tree has been unchanged for this long
+    :param poll: Use mtime polling instead of native file events
+    :param stop: Event that ends the watch, runs until interrupted if not given
+    """
+    stop = stop or threading.Event()
+    waiter = make_waiter(root, poll=poll)
+    Loggable.log().info(f"Watching '{root}' with {type(waiter).__name__}")
+
+    current = snapshot(root)
+    try:
+        while not stop.is_set():
+            if not waiter.wait(interval):
+                continue
+            if (latest := snapshot(root)) == current:
+                continue
+
+            # debounce, wait until the tree stops changing
+            while not stop.is_set():
+                time.sleep(debounce)
+                waiter.drain()
+                if (settled := snapshot(root)) == latest:
+                    break
+                latest = settled
+
+            changed = diff(current, latest)
+            current = latest
+            on_change(changed)
+    finally:
+        waiter.close()
@@ -0,0 +1,337 @@
+"""
+Provides timeouts and a hang watchdog for child processes.
+
+Commands run through `run_watched`, which streams their output (to the console, or into a buffer when captured) and
+registers them with a shared watchdog thread. The watchdog logs a heartbeat for long-running commands, with the
+elapsed time and last line of output, and kills a command once its deadline passes.
+
+A timed out command is killed with its whole process group, e.g. `curl | bash` and everything it started. So is
+whatever a command leaves running in the background with its output still open, once the command has exited. Commands
+that may prompt on the terminal (not captured, while stdin is a terminal) stay in strappy's process group, since a
+background process group can't read from the terminal. Only the command itself is signalled in that case.
+
+Deadlines come from the command's own timeout, and from an enclosing `deadline` block (e.g. a per-package budget),
+whichever is sooner.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import IO, Iterator, Optional
+
+from strappy.util.loggable import Loggable
+
+# environment variable with the default timeout of every command, in seconds
+TIMEOUT_ENV: str = "STRAPPY_COMMAND_TIMEOUT"
+
+# seconds between heartbeats for a long-running command
+HEARTBEAT_SECONDS: float = 30.0
+# seconds between SIGTERM and SIGKILL for a timed out command
+KILL_GRACE_SECONDS: float = 5.0
+# longest last output line shown in a heartbeat
+LAST_LINE_LENGTH: int = 200
+# seconds to wait for the rest of a command's output once it has exited, before killing the processes it left
+# holding the pipe
+DRAIN_SECONDS: float = 1.0
+
+
+@dataclass
+class WatchedProcess:
+    process: subprocess.Popen
+    label: str
+    started: float
+    # monotonic time after which the process is killed, None for no timeout
+    deadline: Optional[float]
+    # the process leads its own process group
+    own_group: bool
+    last_line: str = ""
+    timed_out: bool = False
+    killed_at: Optional[float] = None
+    last_heartbeat: float = field(default_factory=time.monotonic)
+
+    def signal(self, signum: int) -> None:
+        try:
+            if self.own_group:
+                os.killpg(self.process.pid, signum)
+            else:
+                self.process.send_signal(signum)
+        except ProcessLookupError:
+            pass
+
+
+class Watchdog(Loggable):
+    """
+    Background thread that heartbeats and times out watched processes
+
+    :param heartbeat: Seconds between heartbeats for each process, the first one after this long
+    :param grace: Seconds between SIGTERM and SIGKILL
+    :param tick: Seconds between checks
+    """
+
+    def __init__(
+        self,
+        heartbeat: float = HEARTBEAT_SECONDS,
+        grace: float = KILL_GRACE_SECONDS,
+        tick: float = 0.2,
+    ):
+        self.heartbeat = heartbeat
+        self.grace = grace
+        self.tick = tick
+        self.processes: list[WatchedProcess] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, watched: WatchedProcess) -> None:
+        with self._lock:
+            self.processes.append(watched)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="watchdog", daemon=True
+                )
+                self._thread.start()
+
+    def unwatch(self, watched: WatchedProcess) -> None:
+        with self._lock:
+            if watched in self.processes:
+                self.processes.remove(watched)
+
+    def check(self, watched: WatchedProcess, now: float) -> None:
+        """Heartbeat or kill a single process, if it is due"""
+        if watched.process.poll() is not None:
+            return
+
+        if watched.killed_at is not None:
+            if now - watched.killed_at >= self.grace:
+                self.logger.warning(
+                    f"'{watched.label}' ignored SIGTERM, sending SIGKILL"
+                )
+                watched.signal(signal.SIGKILL)
+                watched.killed_at = now
+            return
+
+        elapsed = now - watched.started
+        if watched.deadline is not None and now >= watched.deadline:
+            self.logger.error(
+                f"'{watched.label}' timed out after {elapsed:.0f}s, killing it"
+                + (f". Last output: {watched.last_line!r}" if watched.last_line else "")
+            )
+            watched.timed_out = True
+            watched.killed_at = now
+            watched.signal(signal.SIGTERM)
+            return
+
+        if now - watched.last_heartbeat >= self.heartbeat:
+            watched.last_heartbeat = now
+            remaining = (
+                f", {watched.deadline - now:.0f}s until timeout"
+                if watched.deadline is not None
+                else ""
+            )
+            self.logger.info(
+                f"Still running '{watched.label}' after {elapsed:.0f}s{remaining}. "
+                f"Last output: {watched.last_line or '(none)'!r}"
+            )
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self.processes:
+                    self._thread = None
+                    return
+                processes = list(self.processes)
+            now = time.monotonic()
+            for watched in processes:
+                self.check(watched, now)
+            time.sleep(self.tick)
+
+
+_watchdog = Watchdog()
+_local = threading.local()
+
+
+def watchdog() -> Watchdog:
+    return _watchdog
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Give every command run by the current thread inside the block a shared time budget
+
+    Nested blocks keep the sooner deadline. A budget of None leaves the current deadline as it is.
+    """
+    previous = getattr(_local, "deadline", None)
+    if seconds is not None:
+        ends = time.monotonic() + seconds
+        _local.deadline = ends if previous is None else min(previous, ends)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def default_timeout() -> Optional[float]:
+    value = os.environ.get(TIMEOUT_ENV)
+    return float(value) if value else None
+
+
+def effective_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Seconds a command may run for, the sooner of `timeout` and the current thread's deadline"""
+    if (ends := getattr(_local, "deadline", None)) is None:
+        return timeout
+    remaining = max(0.0, ends - time.monotonic())
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def _last_line(tail: bytes) -> str:
+    lines = [
+        line.strip()
+        for line in tail.decode(errors="replace").replace("\r", "\n").split("\n")
+    ]
+    lines = [line for line in lines if line]
+    return lines[-1][:LAST_LINE_LENGTH] if lines else ""
+
+
+def _pump(
+    pipe: IO[bytes],
+    watched: WatchedProcess,
+    chunks: Optional[list[bytes]],
+    echo: bool,
+) -> None:
+    """Read a pipe until it closes, keeping the output or echoing it, and tracking the last line"""
+    tail = b""
+    while chunk := os.read(pipe.fileno(), 64 * 1024):
+        if chunks is not None:
+            chunks.append(chunk)
+        if echo:
+            if (buffer := getattr(sys.stdout, "buffer", None)) is not None:
+                buffer.write(chunk)
+                buffer.flush()
+            else:
+                sys.stdout.write(chunk.decode(errors="replace"))
+                sys.stdout.flush()
+        tail = (tail + chunk)[-4096:]
+        watched.last_line = _last_line(tail) or watched.last_line
+    pipe.close()
+
+
+def _drain(pumps: list[threading.Thread], watched: WatchedProcess) -> None:
+    """
+    Wait for the pumps to read the rest of the output of a command that has exited
+
+    Background processes the command started keep the pipe open after it exits. They get `DRAIN_SECONDS`, no longer
+    than the command's deadline, then they're killed with the command's process group. A command in strappy's
+    process group can't be killed that way, the rest of its output is left to the pumps, which are daemon threads.
+    """
+
+    def join(seconds: float) -> bool:
+        ends = time.monotonic() + seconds
+        for pump in pumps:
+            pump.join(max(0.0, ends - time.monotonic()))
+        return not any(pump.is_alive() for pump in pumps)
+
+    limit = DRAIN_SECONDS
+    if watched.deadline is not None:
+        limit = min(limit, max(0.0, watched.deadline - time.monotonic()))
+    if join(limit):
+        return
+    if watched.own_group:
+        Loggable.log().warning(
+            f"'{watched.label}' exited, killing the processes it left holding its output"
+        )
+        watched.signal(signal.SIGKILL)
+        if join(DRAIN_SECONDS):
+            return
+    Loggable.log().warning(
+        f"'{watched.label}' exited, not waiting for the rest of its output"
+    )
+
+
+def run_watched(
+    cmd: list[str] | str,
+    shell: bool = False,
+    capture_output: bool = False,
+    timeout: Optional[float] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Run a command under the watchdog, like `subprocess.run(cmd, check=True, text=True)`
+
+    Output that isn't captured is echoed to stdout as it arrives, stdin is left attached so the command can prompt.
+
+    :param timeout: Seconds the command may run for, also limited by the current `deadline`
+    :raises subprocess.TimeoutExpired: If the command was killed for running too long
+    :raises subprocess.CalledProcessError: If the command exited non-zero
+    """
+    timeout = effective_timeout(timeout)
+    own_group = capture_output or not sys.stdin.isatty()
+    label = cmd if isinstance(cmd, str) else " ".join(cmd)
+
+    process = subprocess.Popen(
+        cmd,
+        shell=shell,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE if capture_output else subprocess.STDOUT,
+        process_group=0 if own_group else None,
+    )
+    started = time.monotonic()
+    watched = WatchedProcess(
+        process=process,
+        label=label,
+        started=started,
+        deadline=started + timeout if timeout is not None else None,
+        own_group=own_group,
+    )
+
+    stdout_chunks: Optional[list[bytes]] = [] if capture_output else None
+    stderr_chunks: Optional[list[bytes]] = [] if capture_output else None
+    pumps = [
+        threading.Thread(
+            target=_pump,
+            args=(process.stdout, watched, stdout_chunks, not capture_output),
+            daemon=True,
+        )
+    ]
+    if capture_output:
+        pumps.append(
+            threading.Thread(
+                target=_pump,
+                args=(process.stderr, watched, stderr_chunks, False),
+                daemon=True,
+            )
+        )
+
+    _watchdog.watch(watched)
+    try:
+        for pump in pumps:
+            pump.start()
+        process.wait()
+        _drain(pumps, watched)
+    finally:
+        _watchdog.unwatch(watched)
+        if process.poll() is None:
+            # interrupted while waiting, don't leave the command running
+            watched.signal(signal.SIGKILL)
+            process.wait()
+
+    stdout = (
+        b"".join(stdout_chunks).decode(errors="replace")
+        if stdout_chunks is not None
+        else None
+    )
+    stderr = (
+        b"".join(stderr_chunks).decode(errors="replace")
+        if stderr_chunks is not None
+        else None
+    )
+    if watched.timed_out:
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, cmd, output=stdout, stderr=stderr
+        )
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
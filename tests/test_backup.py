@@ -0,0 +1,53 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from strappy.backup import BackupStore
+
+
+def _write_file(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def test_backup_stores_each_blob_once(tmp_path):
+    tree = tmp_path / "skill"
+    _write_file(tree / "SKILL.md", "# Skill\n")
+    _write_file(tree / "agents" / "openai.yaml", "interface:\n")
+    _write_file(tree / "copy.md", "# Skill\n")
+    (tree / "link").symlink_to("SKILL.md")
+
+    store = BackupStore(tmp_path / "backups")
+    entries, copied = store.backup(tree, "run1")
+    assert copied == len("# Skill\n") + len("interface:\n")
+    assert len(list(store.objects_dir.glob("*/*"))) == 2
+
+    # backing up the unchanged tree again only costs hashing
+    _, copied = store.backup(tree, "run2")
+    assert copied == 0
+    assert store.run_ids() == ["run1", "run2"]
+
+    restored = tmp_path / "restored"
+    store.materialize(entries, restored)
+    assert (restored / "agents" / "openai.yaml").read_text() == "interface:\n"
+    assert os.readlink(restored / "link") == "SKILL.md"
+    assert (restored / "SKILL.md").stat().st_mode == (tree / "SKILL.md").stat().st_mode
+
+
+def test_prune_removes_old_manifests_and_unreferenced_blobs(tmp_path):
+    source = tmp_path / "file.txt"
+    store = BackupStore(tmp_path / "backups")
+
+    for run_id, content in [("run1", "old"), ("run2", "new"), ("run3", "new")]:
+        source.write_text(content)
+        store.backup(source, run_id)
+
+    assert store.prune(keep_runs=2) == 1
+    assert store.run_ids() == ["run2", "run3"]
+    assert len(list(store.objects_dir.glob("*/*"))) == 1
+
+    manifest = store.load_manifest("run2")
+    manifest["created_at"] = (datetime.now() - timedelta(days=365)).isoformat()
+    store.manifest_path("run2").write_text(json.dumps(manifest))
+    assert store.prune(max_age_days=30) == 1
+    assert store.run_ids() == ["run3"]
@@ -1,3 +1,7 @@
+import json
+
+import pytest
+
 import strappy.bootstrap as bootstrap
 
 
@@ -271,3 +275,373 @@ def test_install_claude_skills_backs_up_existing_directory(tmp_path, monkeypatch
     assert (backup / "SKILL.md").read_text() == "# Old UI\n"
     assert destination.is_symlink()
     assert destination.resolve() == source.resolve()
+
+
+def test_install_all_dotfiles_skips_unchanged_state(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    _write_file(dotfiles_dir / "codex" / "skills" / "deslop" / "SKILL.md", "# Deslop\n")
+
+    home = tmp_path / "home"
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+
+    assert bootstrap.install_all_dotfiles()
+    assert (log_dir / bootstrap.DOTFILES_STATE_FILE).is_file()
+    assert not bootstrap.install_all_dotfiles()
+    assert bootstrap.install_all_dotfiles(verify=True)
+
+    # a new skill changes the source tree, so the phase runs again
+    _write_file(dotfiles_dir / "codex" / "skills" / "review" / "SKILL.md", "# Review\n")
+    assert bootstrap.install_all_dotfiles()
+    assert (home / ".codex" / "skills" / "review").is_symlink()
+
+    # removing a managed link changes the destinations, so the phase runs again
+    (home / ".codex" / "skills" / "review").unlink()
+    assert bootstrap.install_all_dotfiles()
+    assert (home / ".codex" / "skills" / "review").is_symlink()
+
+
+def test_install_dotfiles_keeps_bak_of_already_linked_dotfile(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    source = dotfiles_dir / ".gitconfig"
+    _write_file(source, "[user]\n")
+
+    home = tmp_path / "home"
+    _write_file(home / ".gitconfig", "[original]\n")
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+
+    bootstrap.install_dotfiles()
+    bootstrap.install_dotfiles()
+
+    assert (home / ".gitconfig").resolve() == source.resolve()
+    assert (home / ".gitconfig.bak").read_text() == "[original]\n"
+
+
+def test_merge_dotfiles_keeps_content_in_managed_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+
+    current = tmp_path / ".zshrc"
+    current.write_text("export PATH=/usr/bin\nfi\n")
+    new_file = tmp_path / "new_zshrc"
+    new_file.write_text("if true; then\n  echo hi\nfi\n\nfi\n")
+
+    bootstrap.merge_dotfiles(current, new_file)
+
+    lines = current.read_text().splitlines()
+    assert lines[:2] == ["export PATH=/usr/bin", "fi"]
+    assert lines[3].startswith("# >>> strappy >>> sha256:")
+    # repeated and blank lines are kept, rather than deduped against the user's file
+    assert lines[4:-1] == ["if true; then", "  echo hi", "fi", "", "fi"]
+    assert lines[-1] == "# <<< strappy <<<"
+
+    # an unchanged block leaves the file alone
+    inode = current.stat().st_ino
+    bootstrap.merge_dotfiles(current, new_file)
+    assert current.stat().st_ino == inode
+    assert current.read_text().splitlines() == lines
+
+    # a changed block is replaced in place, not appended
+    new_file.write_text("alias ll='ls -l'\n")
+    current.write_text(current.read_text() + "export EDITOR=vim\n")
+    bootstrap.merge_dotfiles(current, new_file)
+    lines = current.read_text().splitlines()
+    assert lines[4:] == ["alias ll='ls -l'", "# <<< strappy <<<", "export EDITOR=vim"]
+
+
+def test_merge_dotfiles_skips_link_to_source(tmp_path, monkeypatch):
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+
+    new_file = tmp_path / "dotfiles" / ".zshrc"
+    _write_file(new_file, "alias ll='ls -l'\n")
+    current = tmp_path / "home" / ".zshrc"
+    current.parent.mkdir()
+    current.symlink_to(new_file)
+
+    for _ in range(3):
+        bootstrap.merge_dotfiles(current, new_file)
+
+    assert new_file.read_text() == "alias ll='ls -l'\n"
+    assert list(new_file.parent.iterdir()) == [new_file]
+
+
+def test_merge_dotfiles_dry_run_does_not_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(bootstrap, "DRY_RUN", True)
+
+    current = tmp_path / ".zshrc"
+    current.write_text("export PATH=/usr/bin\n")
+    new_file = tmp_path / "new_zshrc"
+    new_file.write_text("alias ll='ls -l'\n")
+
+    bootstrap.merge_dotfiles(current, new_file)
+
+    assert current.read_text() == "export PATH=/usr/bin\n"
+
+
+def test_install_codex_skills_backup_is_deduplicated(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    source = dotfiles_dir / "codex" / "skills" / "deslop"
+    _write_file(source / "SKILL.md", "# Deslop\n")
+
+    home = tmp_path / "home"
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+
+    destination = home / ".codex" / "skills" / "deslop"
+    for run_id in ("run1", "run2"):
+        monkeypatch.setattr(bootstrap, "RUN_ID", run_id)
+        if destination.is_symlink():
+            destination.unlink()
+        _write_file(destination / "SKILL.md", "# Old\n")
+        bootstrap.install_codex_skills()
+
+    store = bootstrap._backup_store()
+    assert store.run_ids() == ["run1", "run2"]
+    # identical copies of the old skill share one blob, no timestamped copies pile up in `LOG_DIR`
+    assert len(list(store.objects_dir.glob("*/*"))) == 1
+    assert not list(log_dir.glob("*.bak"))
+    assert (
+        home / ".codex" / "skills" / "deslop.bak" / "SKILL.md"
+    ).read_text() == "# Old\n"
+
+
+def test_install_all_dotfiles_rolls_back_on_failure(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    _write_file(dotfiles_dir / "codex" / "skills" / "deslop" / "SKILL.md", "# New\n")
+    _write_file(dotfiles_dir / "claude" / "settings.json", '{"theme": "dark"}\n')
+
+    home = tmp_path / "home"
+    existing = home / ".codex" / "skills" / "deslop"
+    _write_file(existing / "SKILL.md", "# Old\n")
+    # a file where the `.claude` directory should be makes the claude installer fail
+    _write_file(home / ".claude", "not a directory\n")
+
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+
+    with pytest.raises(OSError):
+        bootstrap.install_all_dotfiles()
+
+    # nothing was applied, since the failure happened while staging
+    assert not existing.is_symlink()
+    assert (existing / "SKILL.md").read_text() == "# Old\n"
+    assert not (log_dir / bootstrap.DOTFILES_STATE_FILE).exists()
+
+
+def test_rollback_restores_previous_run(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    _write_file(dotfiles_dir / "codex" / "skills" / "deslop" / "SKILL.md", "# New\n")
+    _write_file(dotfiles_dir / "codex" / "skills" / "review" / "SKILL.md", "# Review\n")
+
+    home = tmp_path / "home"
+    existing = home / ".codex" / "skills" / "deslop"
+    _write_file(existing / "SKILL.md", "# Old\n")
+
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+    monkeypatch.setattr(bootstrap, "RUN_ID", "run1")
+
+    bootstrap.install_all_dotfiles()
+    assert existing.is_symlink()
+    assert (home / ".codex" / "skills" / "review").is_symlink()
+
+    monkeypatch.setattr(bootstrap, "RUN_ID", "run2")
+    assert bootstrap.rollback() == "run1"
+
+    assert not existing.is_symlink()
+    assert (existing / "SKILL.md").read_text() == "# Old\n"
+    assert not (home / ".codex" / "skills" / "review").exists()
+
+    with pytest.raises(ValueError):
+        bootstrap.rollback("does-not-exist")
+
+
+def test_status_reports_drift_as_json(tmp_path, monkeypatch, capsys):
+    dotfiles_dir = tmp_path / "dotfiles"
+    _write_file(dotfiles_dir / "codex" / "skills" / "deslop" / "SKILL.md", "# Deslop\n")
+    _write_file(
+        dotfiles_dir / "claude" / "skills" / "review" / "SKILL.md", "# Review\n"
+    )
+
+    home = tmp_path / "home"
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+    monkeypatch.setattr(bootstrap, "load_packages", list)
+
+    bootstrap.install_codex_skills()
+    assert bootstrap.status(as_json=True) == 1
+
+    entries = {
+        entry["name"]: entry["state"] for entry in json.loads(capsys.readouterr().out)
+    }
+    assert entries == {
+        str(home / ".codex" / "skills" / "deslop"): "ok",
+        str(home / ".claude" / "skills" / "review"): "missing",
+    }
+
+
+def test_relink_only_applies_changed_targets(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    skills_dir = dotfiles_dir / "codex" / "skills"
+    _write_file(skills_dir / "deslop" / "SKILL.md", "# Deslop\n")
+    _write_file(dotfiles_dir / ".zshrc", "alias ll='ls -l'\n")
+
+    home = tmp_path / "home"
+    _write_file(home / ".zshrc", "export A=1\n")
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+
+    bootstrap.install_all_dotfiles()
+    targets = bootstrap.managed_targets()
+
+    # rename a skill and change the appended dotfile
+    (skills_dir / "deslop").rename(skills_dir / "deslop-v2")
+    (dotfiles_dir / ".zshrc").write_text("alias la='ls -a'\n")
+    changed = {skills_dir / "deslop", skills_dir / "deslop-v2", dotfiles_dir / ".zshrc"}
+
+    bootstrap.relink(targets, changed)
+
+    skills = home / ".codex" / "skills"
+    assert not (skills / "deslop").exists()
+    assert not (skills / "deslop").is_symlink()
+    assert (skills / "deslop-v2").resolve() == (skills_dir / "deslop-v2").resolve()
+    assert "alias la='ls -a'" in (home / ".zshrc").read_text()
+    assert "alias ll='ls -l'" not in (home / ".zshrc").read_text()
+
+
+def test_provision_roots_applies_each_root_separately(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    source = dotfiles_dir / "codex" / "AGENTS.md"
+    _write_file(source, "# Guidelines\n")
+
+    homes = [tmp_path / "homes" / "alice", tmp_path / "homes" / "bob"]
+    for home in homes:
+        home.mkdir(parents=True)
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", tmp_path / "home")
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+    monkeypatch.setattr(bootstrap, "RUN_ID", "20260101_000000")
+
+    results = bootstrap.provision_roots(homes, max_workers=2)
+
+    assert [result.status for result in results] == ["ok", "ok"]
+    for home in homes:
+        destination = home / ".codex" / "AGENTS.md"
+        assert destination.is_symlink()
+        assert destination.resolve() == source.resolve()
+        assert (home / ".cache" / "strappy" / "init.zsh").is_file()
+    assert len(list(log_dir.glob("dotfiles_state_*.json"))) == 2
+    assert not (tmp_path / "home").exists()
+
+    results = bootstrap.provision_roots(homes, max_workers=2)
+    assert [result.status for result in results] == ["unchanged", "unchanged"]
+
+
+def test_parse_args_rejects_unknown_profile_env(monkeypatch, capsys):
+    monkeypatch.setenv("STRAPPY_PROFILE", "perf")
+    with pytest.raises(SystemExit) as exc_info:
+        bootstrap.parse_args([])
+    assert exc_info.value.code == 2
+    assert "STRAPPY_PROFILE" in capsys.readouterr().err
+
+    monkeypatch.setenv("STRAPPY_PROFILE", "1")
+    assert bootstrap.parse_args([]).profile == "cprofile"
+    assert bootstrap.parse_args(["--profile", "sample"]).profile == "sample"
+
+
+def test_parse_args_rejects_invalid_max_jobs_env(monkeypatch, capsys):
+    for value in ("four", "0"):
+        monkeypatch.setenv("STRAPPY_MAX_JOBS", value)
+        with pytest.raises(SystemExit) as exc_info:
+            bootstrap.parse_args([])
+        assert exc_info.value.code == 2
+        assert "STRAPPY_MAX_JOBS" in capsys.readouterr().err
+
+    monkeypatch.setenv("STRAPPY_MAX_JOBS", "4")
+    assert bootstrap.parse_args([]).max_jobs == 4
+    assert bootstrap.parse_args(["--max-jobs", "2"]).max_jobs == 2
+
+
+def test_parse_args_rejects_bench_shell_without_runs(capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        bootstrap.parse_args(["bench-shell", "--runs", "0"])
+    assert exc_info.value.code == 2
+    assert "--runs" in capsys.readouterr().err
+    assert bootstrap.parse_args(["bench-shell", "--runs", "1"]).runs == 1
+
+
+def test_shell_init_phase_waits_for_packages():
+    phases = {phase.name: phase for phase in bootstrap.build_phases()}
+
+    assert "packages" in phases["shell-init"].depends_on
+    assert bootstrap.install_shell_init not in bootstrap.DOTFILE_INSTALLERS
+
+
+def test_install_codex_skills_copies_configured_skill(tmp_path, monkeypatch):
+    dotfiles_dir = tmp_path / "dotfiles"
+    source = dotfiles_dir / "codex" / "skills" / "deslop"
+    _write_file(source / "SKILL.md", "# Deslop\n")
+
+    home = tmp_path / "home"
+    destination = home / ".codex" / "skills" / "deslop"
+    destination.parent.mkdir(parents=True)
+    destination.symlink_to(source)
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+
+    monkeypatch.setattr(bootstrap, "DOTFILES_DIR", dotfiles_dir)
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "DRY_RUN", False)
+    monkeypatch.setattr(bootstrap, "SKILLS_TO_COPY", [".codex/skills/*"])
+
+    bootstrap.install_codex_skills()
+
+    assert not destination.is_symlink()
+    assert (destination / "SKILL.md").read_text() == "# Deslop\n"
+    assert [target.mode for target in bootstrap.managed_targets()] == ["copy"]
+
+    _write_file(source / "SKILL.md", "# Deslop, updated\n")
+    bootstrap.install_codex_skills()
+
+    assert not destination.is_symlink()
+    assert (destination / "SKILL.md").read_text() == "# Deslop, updated\n"
@@ -0,0 +1,92 @@
+import contextlib
+import subprocess
+import threading
+import time
+
+from strappy.concurrency import ConcurrencyController, command_key
+
+
+def _run(controller, key="brew install", seconds=0.0, error=None):
+    with contextlib.suppress(Exception), controller.slot(key):
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+
+
+def test_command_key_uses_first_two_words():
+    assert command_key(["brew", "install", "--cask", "iterm2"]) == "brew install"
+    assert command_key("curl -o- https://example.com | bash") == "curl -o-"
+
+
+def test_limit_increases_additively_up_to_ceiling():
+    controller = ConcurrencyController(initial=2, ceiling=3)
+    for _ in range(10):
+        _run(controller)
+
+    assert controller.limit == 3
+    assert [(d.old, d.new) for d in controller.decisions] == [(2, 3)]
+
+
+def test_timeout_halves_limit_once_per_window():
+    controller = ConcurrencyController(initial=8, ceiling=8)
+    timeout = subprocess.TimeoutExpired("brew", 1)
+
+    _run(controller, error=timeout)
+    assert controller.limit == 4
+    assert controller.decisions[-1].reason == "'brew install' timed out"
+
+    _run(controller, error=timeout)
+    assert controller.limit == 2
+
+
+def test_single_failure_is_not_congestion_but_failure_rate_is():
+    controller = ConcurrencyController(initial=4, ceiling=4, window=4)
+    failure = subprocess.CalledProcessError(1, "brew")
+
+    _run(controller, "brew list", error=failure)
+    assert controller.limit == 4
+
+    _run(controller, "brew list", error=failure)
+    assert controller.limit == 2
+    assert controller.decisions[-1].reason == "2 of the last 2 failed"
+
+
+def test_slow_command_decreases_limit():
+    controller = ConcurrencyController(initial=4, ceiling=4)
+    for _ in range(3):
+        _run(controller, seconds=0.01)
+    _run(controller, seconds=0.2)
+
+    assert controller.limit == 2
+    assert "usually" in controller.decisions[-1].reason
+
+
+def test_slot_blocks_at_limit():
+    controller = ConcurrencyController(initial=1, ceiling=1)
+    release = threading.Event()
+    entered = []
+
+    def hold():
+        with controller.slot("sleep"):
+            entered.append(time.perf_counter())
+            release.wait()
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    assert len(entered) == 1
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(entered) == 2
+    assert controller.peak_active == 1
+
+
+def test_set_ceiling_lowers_limit():
+    controller = ConcurrencyController(initial=8, ceiling=16)
+    controller.set_ceiling(3)
+
+    assert controller.limit == 3
+    assert "ceiling 3" in controller.format_summary()
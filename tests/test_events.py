@@ -0,0 +1,64 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from strappy.package import Package
+from strappy.util import events
+from strappy.util.loggable import Loggable
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    events.reset_metrics()
+    yield
+    events.close_sink()
+    events.reset_metrics()
+
+
+def test_emit_writes_json_lines(tmp_path):
+    sink = tmp_path / "events.ndjson"
+    events.open_sink(sink)
+    events.set_phase("packages")
+
+    Loggable.event("package", package="wget", result="installed", duration=1.5)
+    events.set_phase(None)
+    events.close_sink()
+
+    (line,) = sink.read_text().splitlines()
+    event = json.loads(line)
+    assert event["event"] == "package"
+    assert event["phase"] == "packages"
+    assert event["package"] == "wget"
+    assert event["source"] == "Loggable"
+
+
+def test_run_cmd_records_command_events():
+    package = Package(name="test_package")
+    package.run_cmd([sys.executable, "-c", "print('hello')"], capture_output=True)
+    with pytest.raises(subprocess.CalledProcessError):
+        package.run_cmd([sys.executable, "-c", "raise SystemExit(3)"])
+
+    counters = events.metrics().counters
+    assert counters[("strappy_child_processes_total", ())] == 2
+    assert counters[("strappy_command_failures_total", ())] == 1
+    assert counters[("strappy_command_output_bytes_total", ())] == len("hello\n")
+
+
+def test_write_metrics_renders_counters_and_histograms(tmp_path):
+    events.emit("package", result="installed", duration=2.0)
+    events.emit("package", result="skipped", duration=0.05)
+    events.emit("phase", phase="dotfiles", status="ok", duration=0.3)
+
+    path = tmp_path / "strappy.prom"
+    events.write_metrics(path)
+    text = path.read_text()
+
+    assert "# TYPE strappy_packages_total counter" in text
+    assert 'strappy_packages_total{result="installed"} 1' in text
+    assert "# TYPE strappy_phase_duration_seconds histogram" in text
+    assert 'strappy_phase_duration_seconds_bucket{phase="dotfiles",le="0.1"} 0' in text
+    assert 'strappy_phase_duration_seconds_bucket{phase="dotfiles",le="0.5"} 1' in text
+    assert 'strappy_phase_duration_seconds_bucket{phase="dotfiles",le="+Inf"} 1' in text
+    assert "strappy_package_duration_seconds_count 2" in text
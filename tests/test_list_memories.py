@@ -1,7 +1,12 @@
+import argparse
 import importlib.util
+import json
 import sys
+import tempfile
+import threading
 from pathlib import Path
 
+import pytest
 
 SCRIPT_PATH = (
     Path(__file__).parents[1]
@@ -15,33 +20,491 @@ SPEC = importlib.util.spec_from_file_location("strappy_list_memories", SCRIPT_PA
 assert SPEC and SPEC.loader
 list_memories = importlib.util.module_from_spec(SPEC)
 sys.modules[SPEC.name] = list_memories
+# the script imports the modules next to it, which python finds through the script's directory when it's run
+sys.path.insert(0, str(SCRIPT_PATH.parent))
 SPEC.loader.exec_module(list_memories)
 
+import memory_index
+import memory_search
+import memory_server
+
+
+@pytest.fixture(autouse=True)
+def _cache_home(tmp_path, monkeypatch):
+    # indexes are kept in the user's cache directory
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
 
 def test_default_root_survives_symlinked_install():
     assert list_memories.MEMORY_DIR == Path.home() / ".codex" / "memories"
 
 
 def test_tags_match_only_exact_memory_tags():
-    assert list_memories.count_tag_matches(["workflow", "CI"], ["ci"]) == 1
-    assert list_memories.count_tag_matches(["workflow", "handoff"], ["ci"]) == 0
+    assert memory_search.count_tag_matches(["workflow", "CI"], ["ci"]) == 1
+    assert memory_search.count_tag_matches(["workflow", "handoff"], ["ci"]) == 0
 
 
 def test_query_matches_any_whole_term_and_weights_metadata():
-    assert list_memories.query_term_matches("PR preview PR-1830", "PR")
-    assert not list_memories.query_term_matches("preview", "PR")
+    assert memory_search.query_term_matches("PR preview PR-1830", "PR")
+    assert not memory_search.query_term_matches("preview", "PR")
     assert (
-        list_memories.count_query_matches(
+        memory_search.count_query_matches(
             "exact head moving PR",
             ["1830", "exact", "head"],
         )
         == 2
     )
     assert (
-        list_memories.count_query_matches(
+        memory_search.count_query_matches(
             "body head",
             ["head"],
             metadata="exact head",
         )
         == 5
     )
+
+
+def _write_memory(root, rel_path, text):
+    path = root / rel_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def _memory_root(tmp_path):
+    root = tmp_path / "memories"
+    _write_memory(
+        root,
+        "notes/ci.md",
+        "usefulness: 3\nmemory_tags: ci, workflow\nkeywords: PR-1830\n\n# CI head\n\nexact head moving\n",
+    )
+    _write_memory(
+        root,
+        "notes/review.md",
+        "usefulness: 5\nlast_read: 2026-06-06T00:00:00Z\nmemory_tags: review\n\n# Review\n\nhead of PR-1830 body\n",
+    )
+    _write_memory(
+        root,
+        "rollout_summaries/run.md",
+        "memory_tags: ci\n\n# Rollout\n\nhead\n",
+    )
+    _write_memory(root, ".git/ignored.md", "# Ignored\n\nhead\n")
+    return root
+
+
+def test_index_search_matches_scan(tmp_path):
+    root = _memory_root(tmp_path)
+    index = memory_index.MemoryIndex(root)
+    index.refresh(include_rollouts=True)
+
+    for wanted_tags, query_terms, require_all, include_rollouts in [
+        ([], [], False, False),
+        ([], [], False, True),
+        (["CI"], [], False, True),
+        (["ci", "workflow"], [], True, True),
+        ([], ["head"], False, False),
+        ([], ["PR-1830", "moving"], False, True),
+        (["review"], ["head", "missing"], False, True),
+    ]:
+        found = index.search(wanted_tags, query_terms, require_all, include_rollouts)
+        scanned = memory_search.scan_docs(
+            root, wanted_tags, query_terms, require_all, include_rollouts
+        )
+        key = memory_search.sort_key
+        assert sorted(found, key=key) == sorted(scanned, key=key)
+    index.close()
+
+
+def test_index_refresh_parses_only_changed_files(tmp_path):
+    root = _memory_root(tmp_path)
+    index = memory_index.MemoryIndex(root)
+    assert index.refresh(include_rollouts=True) == 3
+    assert index.refresh(include_rollouts=True) == 0
+
+    _write_memory(root, "notes/ci.md", "memory_tags: ci\n\n# CI\n\nchanged text\n")
+    (root / "notes" / "review.md").unlink()
+    assert index.refresh(include_rollouts=False) == 1
+
+    paths = [str(doc.path) for doc in index.search([], ["changed"], False, False)]
+    assert paths == ["notes/ci.md"]
+    assert index.search([], ["head"], False, False) == []
+    # rollouts are kept while they're excluded, and found again once included
+    assert index.refresh(include_rollouts=True) == 0
+    assert [str(doc.path) for doc in index.search([], ["head"], False, True)] == [
+        "rollout_summaries/run.md"
+    ]
+    index.close()
+
+
+def test_index_is_kept_out_of_the_root_and_compacts_stale_terms(tmp_path):
+    root = _memory_root(tmp_path).resolve()
+    files = sorted(root.rglob("*"))
+    index = memory_index.MemoryIndex(root)
+    index.refresh(include_rollouts=True)
+    assert index.search([], ["head"], False, True)
+    assert sorted(root.rglob("*")) == files
+    assert (memory_index.cache_dir(root) / memory_index.INDEX_FILE).is_file()
+
+    # the changed file's old row stays until there are more stale rows than docs
+    for text in ("first", "second", "third", "fourth"):
+        _write_memory(root, "notes/ci.md", f"memory_tags: ci\n\n# CI\n\n{text} text\n")
+        index.refresh(include_rollouts=True)
+        found = index.search([], [text, "PR-1830"], False, True)
+        assert sorted(str(doc.path) for doc in found) == [
+            "notes/ci.md",
+            "notes/review.md",
+        ]
+        stale = index.db.execute("SELECT count(*) FROM stale_terms").fetchone()[0]
+        rows = index.db.execute("SELECT count(*) FROM terms").fetchone()[0]
+        assert rows == 3 + stale
+    assert stale < 3
+    assert index.search([], ["first"], False, True) == []
+    index.close()
+
+
+def test_index_is_rebuilt_on_version_change(tmp_path, monkeypatch):
+    root = _memory_root(tmp_path)
+    memory_index.MemoryIndex(root).refresh(include_rollouts=True)
+
+    monkeypatch.setattr(memory_index, "INDEX_VERSION", memory_index.INDEX_VERSION + 1)
+    index = memory_index.MemoryIndex(root)
+    assert index.refresh(include_rollouts=True) == 3
+    index.close()
+
+
+def test_bm25_ranks_by_frequency_field_and_rarity(tmp_path):
+    root = tmp_path / "memories"
+    filler = "other words " * 20
+    _write_memory(root, "once.md", f"# Once\n\ncache {filler}\n")
+    _write_memory(root, "often.md", f"# Often\n\ncache cache cache {filler}\n")
+    _write_memory(root, "titled.md", f"# Cache\n\n{filler}\n")
+    _write_memory(root, "rare.md", f"# Rare\n\nzstd {filler}\n")
+    _write_memory(root, "unrelated.md", f"# Unrelated\n\n{filler}\n")
+
+    index = memory_index.MemoryIndex(root)
+    index.refresh(include_rollouts=False)
+    for search in (
+        lambda terms: index.search([], terms, False, False),
+        lambda terms: memory_search.scan_docs(root, [], terms, False, False),
+    ):
+        ranked = [
+            str(doc.path)
+            for doc in sorted(search(["cache"]), key=memory_search.sort_key)
+        ]
+        assert ranked == ["titled.md", "often.md", "once.md"]
+
+        # a term in fewer memories is worth more
+        scores = {str(doc.path): doc.score for doc in search(["cache", "zstd"])}
+        assert scores["rare.md"] > scores["once.md"]
+    index.close()
+
+
+def test_query_matcher_counts_every_term_in_one_pass():
+    matcher = memory_search.QueryMatcher(["pr", "pr-1830", "1830", "v1.2", "_id"])
+
+    counts, length = matcher.count("PR-1830 and pr 1830x, 1830 in v1.2 of user_id")
+
+    assert counts == [2, 1, 2, 1, 1]
+    assert length == 11
+    # a phrase is only searched for when its whole words are in the text
+    assert matcher.count("pr1830")[0] == [0, 0, 0, 0, 0]
+
+
+def test_walk_markdown_prunes_excluded_dirs(tmp_path, monkeypatch):
+    root = _memory_root(tmp_path)
+    _write_memory(root, "notes/deep/nested.md", "# Nested\n")
+    (root / "notes" / "skip.txt").write_text("not markdown")
+
+    scanned = []
+    scandir = memory_search.os.scandir
+
+    def record_scandir(path):
+        scanned.append(Path(path).relative_to(root).as_posix())
+        return scandir(path)
+
+    monkeypatch.setattr(memory_search.os, "scandir", record_scandir)
+
+    found = dict(memory_search.walk_markdown(root, include_rollouts=False))
+
+    assert sorted(found) == ["notes/ci.md", "notes/deep/nested.md", "notes/review.md"]
+    assert found["notes/ci.md"].st_size == (root / "notes" / "ci.md").stat().st_size
+    # excluded directories aren't even listed
+    assert sorted(scanned) == [".", "notes", "notes/deep"]
+
+    found = dict(memory_search.walk_markdown(root, include_rollouts=True))
+    assert "rollout_summaries/run.md" in found
+    assert ".git/ignored.md" not in found
+
+
+def test_read_header_stops_after_frontmatter_and_title(tmp_path):
+    path = _write_memory(
+        tmp_path,
+        "note.md",
+        "---\nmemory_tags: ci\n---\n\n# Title\n\n" + "body\n" * 1000,
+    )
+
+    header, title = memory_search.read_header(path)
+
+    assert header == ["---", "memory_tags: ci", "---"]
+    assert title == "Title"
+    record = memory_search.read_record(path, tmp_path)
+    assert (record.title, record.tags) == ("Title", ["ci"])
+
+    # without a heading, the title is the file name
+    path.write_text("usefulness: 2\n\nno heading\n")
+    assert memory_search.read_record(path, tmp_path).title == "note.md"
+
+
+def test_iter_body_reads_large_files_in_line_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_search, "BODY_CHUNK", 16)
+    text = "".join(f"line {index} PR-1830\r\n" for index in range(20))
+    path = tmp_path / "large.md"
+    path.write_bytes(text.encode())
+
+    chunks = list(memory_search.iter_body(path))
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert "".join(chunks) == path.read_text()
+    matcher = memory_search.QueryMatcher(["pr-1830", "line"])
+    assert matcher.count_chunks(chunks) == ([20, 20], 80)
+
+
+def test_index_reads_bodies_only_for_queries(tmp_path):
+    root = _memory_root(tmp_path)
+    index = memory_index.MemoryIndex(root)
+    index.refresh(include_rollouts=True)
+
+    index.search(["ci"], [], False, True)
+    assert index.index_bodies(include_rollouts=False) == 2
+
+    assert [str(doc.path) for doc in index.search([], ["moving"], False, True)] == [
+        "notes/ci.md"
+    ]
+    # the rollout body was read by the query that included it
+    assert index.index_bodies(include_rollouts=True) == 0
+    index.close()
+
+
+def test_edit_distance_counts_transpositions_and_stops_past_the_limit():
+    assert memory_search.edit_distance("memory", "memory", 1) == 0
+    assert memory_search.edit_distance("memory", "memroy", 1) == 1
+    assert memory_search.edit_distance("memory", "memry", 1) == 1
+    assert memory_search.edit_distance("enrolment", "enrollment", 2) == 1
+    assert memory_search.edit_distance("memory", "mammary", 1) == 2
+    assert memory_search.edit_distance("memory", "me", 2) == 3
+
+
+def test_fuzzy_search_matches_substrings_and_typos_after_exact_words(tmp_path):
+    root = tmp_path / "memories"
+    _write_memory(
+        root,
+        "exact.md",
+        "keywords: siteEnroll\n\n# Exact\n\nsiteEnroll\n",
+    )
+    _write_memory(
+        root,
+        "id.md",
+        "keywords: siteEnrollmentId\n\n# Id\n\nsiteEnrollmentId siteEnrollmentId\n",
+    )
+    _write_memory(root, "typo.md", "# Typo\n\nsiteEnrol\n")
+    _write_memory(root, "other.md", "# Other\n\nunrelated\n")
+
+    index = memory_index.MemoryIndex(root)
+    index.refresh(include_rollouts=False)
+    assert [
+        str(doc.path) for doc in index.search([], ["siteEnroll"], False, False)
+    ] == ["exact.md"]
+    # the trigram index is only built for the first fuzzy query
+    assert index.index_words() > 0
+    assert index.index_words() == 0
+    assert index.fuzzy_words("siteenroll") == ["siteenrollmentid", "siteenrol"]
+
+    found = sorted(
+        index.search([], ["siteEnroll"], False, False, fuzzy=True),
+        key=memory_search.sort_key,
+    )
+    assert [str(doc.path) for doc in found] == ["exact.md", "id.md", "typo.md"]
+    assert found[0].score > 0 and found[0].fuzzy_score == 0
+    assert found[1].score == 0 and found[1].fuzzy_score > found[2].fuzzy_score
+    assert found[1].matched_fields == ("body", "metadata")
+
+    # a typo of a whole word
+    typos = index.search([], ["siteEnrolmentId"], False, False, fuzzy=True)
+    assert [str(doc.path) for doc in typos] == ["id.md"]
+
+    # files indexed later add their words
+    _write_memory(root, "new.md", "# New\n\nsiteEnrolled\n")
+    index.refresh(include_rollouts=False)
+    found = index.search([], ["siteEnroll"], False, False, fuzzy=True)
+    assert "new.md" in {str(doc.path) for doc in found}
+    index.close()
+
+
+def _doc(path, usefulness, tag_match=0):
+    return memory_search.MemoryDoc(
+        path=Path(path),
+        title=path,
+        usefulness=usefulness,
+        last_read_raw=None,
+        last_read=None,
+        tags=[],
+        scope="",
+        keywords=[],
+        tag_match=tag_match,
+        query_match=0,
+    )
+
+
+def test_top_docs_keeps_the_first_by_sort_key():
+    docs = [
+        _doc(f"m{index}.md", usefulness)
+        for index, usefulness in enumerate([3, 9, 1, 9, 5, 7])
+    ]
+
+    top = list(memory_search.top_docs(docs, limit=3))
+
+    assert top == sorted(docs, key=memory_search.sort_key)[:3]
+    assert list(memory_search.top_docs(docs, limit=0)) == sorted(
+        docs, key=memory_search.sort_key
+    )
+
+
+def test_top_docs_streams_and_stops_early_when_ordered_by_usefulness():
+    consumed = []
+
+    def by_usefulness():
+        for index, (usefulness, tag_match) in enumerate(
+            [(9, 1), (8, 0), (8, 1), (5, 1), (3, 1), (1, 1)]
+        ):
+            consumed.append(index)
+            yield _doc(f"m{index}.md", usefulness, tag_match)
+
+    top = memory_search.top_docs(by_usefulness(), limit=2, best_tag_match=1)
+
+    # the most useful doc that matches the tag is final once a less useful doc comes
+    assert str(next(top).path) == "m0.md"
+    assert consumed == [0, 1]
+    assert str(next(top).path) == "m2.md"
+    assert next(top, None) is None
+    # the rest were never read
+    assert consumed == [0, 1, 2, 3]
+
+
+def test_batch_answers_every_line_from_one_index_refresh_or_scan(tmp_path):
+    root = _memory_root(tmp_path)
+    args = argparse.Namespace(
+        tags="",
+        query="",
+        require_all=False,
+        include_rollouts=False,
+        limit=0,
+        fuzzy=False,
+        no_index=False,
+    )
+    lines = [
+        '{"tags": "ci", "query": "head"}\n',
+        "\n",
+        '{"query": "PR-1830 moving", "include_rollouts": true, "limit": 1}\n',
+        "not json\n",
+        '{"tags": 1}\n',
+    ]
+
+    answers = [json.loads(line) for line in list_memories.run_batch(root, args, lines)]
+
+    first, second, not_json, bad_tags = answers
+    assert first["request"] == {"tags": "ci", "query": "head"}
+    assert [result["path"] for result in first["results"]] == ["notes/ci.md"]
+    assert first["results"][0]["matched_fields"] == ["tags", "body", "metadata"]
+    assert first["results"][0]["score"] > 0
+    assert [result["path"] for result in second["results"]] == ["notes/ci.md"]
+    assert not_json["request"] == "not json" and "error" in not_json
+    assert bad_tags["request"] == {"tags": 1} and "error" in bad_tags
+
+    args.no_index = True
+    assert [
+        json.loads(line) for line in list_memories.run_batch(root, args, lines)
+    ] == answers
+
+
+def test_server_answers_memory_and_kb_queries(tmp_path):
+    root = _memory_root(tmp_path).resolve()
+    kb_script = Path(__file__).parents[1] / "knowledge_base" / "list_kb.py"
+    # socket paths are limited to about 100 bytes, shorter than some temp dirs
+    socket_dir = Path(tempfile.mkdtemp())
+    socket_path = socket_dir / "s.sock"
+    server = memory_server.MemoryServer(root, socket_path, kb_scripts=[kb_script])
+    server.index.refresh(include_rollouts=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        args = argparse.Namespace(
+            root=str(root),
+            tags="ci",
+            query="head",
+            require_all=False,
+            include_rollouts=True,
+            limit=2,
+            show_meta=True,
+            fuzzy=False,
+            no_index=False,
+            serve=False,
+        )
+        assert not server.include_rollouts
+        served = memory_server.request_server(
+            socket_path, {"tool": "memories", "args": vars(args)}
+        )
+        # the first query including rollouts has them refreshed from then on
+        assert server.include_rollouts
+        index = memory_index.MemoryIndex(root)
+        assert list(served) == list(memory_index.search_index(index, args))
+        index.close()
+
+        kb = importlib.util.spec_from_file_location("strappy_list_kb", kb_script)
+        list_kb = importlib.util.module_from_spec(kb)
+        sys.modules[kb.name] = list_kb
+        kb.loader.exec_module(list_kb)
+        # list_kb finds the socket a server of the root would listen on
+        assert (
+            list_kb.server_socket(root)
+            == memory_index.cache_dir(root) / memory_server.SOCKET_FILE
+        )
+        request = {
+            "tool": "kb",
+            "script": str(kb_script),
+            "tags": [],
+            "require_all": False,
+            "limit": 0,
+            "show_meta": False,
+        }
+        assert list_kb.request_server(socket_path, request) == list_kb.list_lines(
+            [], False, 0, False
+        )
+
+        # scripts the server wasn't started with aren't loaded
+        marker = tmp_path / "ran"
+        other_script = tmp_path / "list_kb.py"
+        other_script.write_text(f"open({str(marker)!r}, 'w').close()\n")
+        assert (
+            list_kb.request_server(
+                socket_path, {**request, "script": str(other_script)}
+            )
+            is None
+        )
+        assert not marker.exists()
+
+        # another root is searched in-process
+        other = {**vars(args), "root": str(tmp_path)}
+        assert (
+            memory_server.request_server(
+                socket_path, {"tool": "memories", "args": other}
+            )
+            is None
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert not socket_path.exists()
+    assert memory_server.request_server(socket_path, {"tool": "memories"}) is None
+    socket_dir.rmdir()
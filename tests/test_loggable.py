@@ -1,10 +1,15 @@
+import gzip
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, RotatingFileHandler
 
+import pytest
+
+import strappy.util.loggable as loggable
 from strappy.util.loggable import Loggable
 
 
-def test_loggable_setup_adds_handlers(tmp_path):
+@pytest.fixture
+def root_logger():
     root_logger = logging.getLogger()
     prev_handlers = list(root_logger.handlers)
     prev_level = root_logger.level
@@ -13,19 +18,60 @@ def test_loggable_setup_adds_handlers(tmp_path):
         root_logger.removeHandler(handler)
 
     try:
-        Loggable.setup(log_path=tmp_path / "bootstrap.log")
-
-        assert any(
-            isinstance(handler, RotatingFileHandler)
-            for handler in root_logger.handlers
-        )
-        assert any(
-            isinstance(handler, logging.StreamHandler)
-            for handler in root_logger.handlers
-        )
+        yield root_logger
     finally:
+        Loggable.shutdown()
         for handler in list(root_logger.handlers):
             root_logger.removeHandler(handler)
         for handler in prev_handlers:
             root_logger.addHandler(handler)
         root_logger.setLevel(prev_level)
+
+
+def test_loggable_setup_adds_handlers(tmp_path, root_logger):
+    Loggable.setup(log_path=tmp_path / "bootstrap.log")
+
+    queue_handlers = [
+        handler for handler in root_logger.handlers if isinstance(handler, QueueHandler)
+    ]
+    assert queue_handlers == [loggable._queue_handler]
+    assert any(
+        isinstance(handler, RotatingFileHandler)
+        for handler in loggable._listener.handlers
+    )
+    assert any(
+        isinstance(handler, logging.StreamHandler)
+        for handler in loggable._listener.handlers
+    )
+
+
+def test_loggable_setup_is_idempotent(tmp_path, root_logger):
+    log_path = tmp_path / "bootstrap.log"
+    Loggable.setup(log_path=log_path)
+    Loggable.setup(log_path=log_path)
+    assert (
+        sum(isinstance(handler, QueueHandler) for handler in root_logger.handlers) == 1
+    )
+
+    Loggable.log().info("written once")
+    Loggable.shutdown()
+
+    assert not any(
+        isinstance(handler, QueueHandler) for handler in root_logger.handlers
+    )
+    assert log_path.read_text().count("written once") == 1
+
+
+def test_loggable_setup_compresses_rotated_logs(tmp_path, root_logger):
+    log_path = tmp_path / "bootstrap.log"
+    Loggable.setup(log_path=log_path, max_bytes=1000, backup_count=2)
+
+    for index in range(100):
+        Loggable.log().info(f"line {index:03} " + "x" * 40)
+    Loggable.shutdown()
+
+    rotated = sorted(path.name for path in tmp_path.iterdir())
+    assert rotated == ["bootstrap.log", "bootstrap.log.1.gz", "bootstrap.log.2.gz"]
+    with gzip.open(tmp_path / "bootstrap.log.1.gz", "rt") as rotated_file:
+        assert "line" in rotated_file.read()
+    assert "line 099" in log_path.read_text()
@@ -0,0 +1,34 @@
+import pytest
+
+from strappy.managed_block import BLOCK_START, apply_block, read_block
+
+
+def test_apply_block_is_idempotent():
+    text = apply_block("export A=1\n", "alias a=b\n")
+    assert apply_block(text, "alias a=b\n") is None
+    assert read_block(text)[1] == "alias a=b"
+
+
+def test_apply_block_replaces_edits_inside_the_block():
+    text = apply_block("export A=1\n", "x\ny\n")
+    edited = text.replace("\ny\n", "\ny\nalias edited=1\n")
+
+    assert apply_block(edited, "x\ny\n") == text
+
+
+def test_apply_block_rejects_unclosed_block():
+    with pytest.raises(ValueError):
+        apply_block(f"{BLOCK_START} sha256:abc\nalias a=b\n", "alias a=b\n")
+
+
+def test_apply_block_replaces_lines_appended_before_the_block():
+    content = "alias a=b\nexport A=1\nalias c=d\n"
+    # the earlier merge appended, each after a newline, the lines that weren't in the file yet
+    text = "export A=1\nexport EDITOR=vim\n" + "\nalias a=b\nalias c=d"
+
+    lines = apply_block(text, content).splitlines()
+
+    assert lines[:3] == ["export A=1", "export EDITOR=vim", ""]
+    assert read_block("\n".join(lines))[1] == "alias a=b\nexport A=1\nalias c=d"
+    # the user's own lines are kept, even when the content repeats them
+    assert apply_block("fi\n", "fi\n").splitlines()[0] == "fi"
@@ -0,0 +1,111 @@
+import os
+
+from strappy.mirror import mirror_tree
+
+
+def _write_file(path, content, mode=0o644):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    os.chmod(path, mode)
+
+
+def _tree_stats(root):
+    return {
+        path: (path.lstat().st_ino, path.lstat().st_mtime_ns)
+        for path in sorted(root.rglob("*"))
+    }
+
+
+def test_mirror_tree_copies_tree_with_modes(tmp_path):
+    source = tmp_path / "skill"
+    _write_file(source / "SKILL.md", "# Skill\n")
+    _write_file(source / "scripts" / "run.sh", "#!/bin/sh\n", mode=0o755)
+    (source / "latest").symlink_to("SKILL.md")
+
+    destination = tmp_path / "copy"
+    stats = mirror_tree(source, destination)
+
+    assert (destination / "SKILL.md").read_text() == "# Skill\n"
+    assert os.stat(destination / "scripts" / "run.sh").st_mode & 0o777 == 0o755
+    assert os.readlink(destination / "latest") == "SKILL.md"
+    assert sorted(stats.copied) == [
+        ".",
+        "SKILL.md",
+        "latest",
+        "scripts",
+        "scripts/run.sh",
+    ]
+
+
+def test_mirror_tree_leaves_unchanged_tree_untouched(tmp_path):
+    source = tmp_path / "skills"
+    for index in range(500):
+        _write_file(source / f"skill{index % 10}" / f"file{index}.md", f"{index}\n")
+
+    destination = tmp_path / "copy"
+    mirror_tree(source, destination)
+    before = _tree_stats(destination)
+
+    stats = mirror_tree(source, destination)
+
+    assert not stats.changed
+    assert stats.unchanged == 500
+    assert _tree_stats(destination) == before
+
+
+def test_mirror_tree_rewrites_changed_and_deletes_stale(tmp_path):
+    source = tmp_path / "skill"
+    _write_file(source / "SKILL.md", "# Skill\n")
+    _write_file(source / "keep.md", "keep\n")
+
+    destination = tmp_path / "copy"
+    mirror_tree(source, destination)
+    kept = (destination / "keep.md").stat().st_ino
+    _write_file(destination / "stale" / "old.md", "old\n")
+    _write_file(source / "SKILL.md", "# Skill, updated\n")
+    os.chmod(source / "keep.md", 0o600)
+
+    stats = mirror_tree(source, destination)
+
+    assert stats.copied == ["SKILL.md"]
+    assert stats.deleted == ["stale"]
+    assert stats.chmodded == ["keep.md"]
+    assert (destination / "SKILL.md").read_text() == "# Skill, updated\n"
+    assert (destination / "keep.md").stat().st_ino == kept
+    assert os.stat(destination / "keep.md").st_mode & 0o777 == 0o600
+    assert not (destination / "stale").exists()
+
+
+def test_mirror_tree_checksum_catches_same_size_and_mtime(tmp_path):
+    source = tmp_path / "skill"
+    _write_file(source / "SKILL.md", "aaaa\n")
+    destination = tmp_path / "copy"
+    mirror_tree(source, destination)
+
+    _write_file(destination / "SKILL.md", "bbbb\n")
+    source_stat = (source / "SKILL.md").stat()
+    os.utime(
+        destination / "SKILL.md", ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns)
+    )
+
+    assert not mirror_tree(source, destination, dry_run=True).changed
+    assert mirror_tree(source, destination, checksum=True, dry_run=True).copied == [
+        "SKILL.md"
+    ]
+    assert (destination / "SKILL.md").read_text() == "bbbb\n"
+
+
+def test_mirror_tree_dry_run_replaces_file_with_directory(tmp_path):
+    source = tmp_path / "skill"
+    _write_file(source / "sub" / "f", "new\n")
+    destination = tmp_path / "copy"
+    _write_file(destination / "sub", "a file\n")
+
+    stats = mirror_tree(source, destination, dry_run=True)
+
+    assert stats.deleted == ["sub"]
+    assert stats.copied == ["sub", "sub/f"]
+    assert (destination / "sub").read_text() == "a file\n"
+
+    assert mirror_tree(source, destination).copied == ["sub", "sub/f"]
+    assert (destination / "sub" / "f").read_text() == "new\n"
@@ -1,14 +1,18 @@
+import threading
+import time
 import tomllib
 
 from pydantic.dataclasses import dataclass
 
 from config.brew_packages import BREW_PACKAGES_TOML_PATH
 from config.brew_packages.nvm_package import NvmPackage
+from strappy import package as package_module
 from strappy.package import (
-    Package,
     BrewPackage,
+    Package,
     from_brew_packages_toml,
     is_instance_or_subclass_of_package,
+    load_brew_inventory,
 )
 
 
@@ -106,3 +110,51 @@ def test_check_cask_app_is_installed():
 
     package = BrewPackage(name="does-not-exist", use_cask=False)
     assert not package.is_installed
+
+
+def test_load_brew_inventory_reads_cellar_and_caskroom(tmp_path, monkeypatch):
+    """
+    Test `load_brew_inventory` with a fake Homebrew prefix
+    """
+    (tmp_path / "Cellar" / "git").mkdir(parents=True)
+    (tmp_path / "Caskroom" / "iterm2").mkdir(parents=True)
+    monkeypatch.setenv("HOMEBREW_PREFIX", str(tmp_path))
+
+    inventory = load_brew_inventory()
+    assert inventory.formulae == {"git"}
+    assert inventory.casks == {"iterm2"}
+
+    assert BrewPackage(name="homebrew/core/git").is_in_inventory(inventory)
+    assert not BrewPackage(name="git", use_cask=True).is_in_inventory(inventory)
+
+
+def test_install_packages_checks_concurrently_and_installs_missing(monkeypatch):
+    """
+    Test that `install_packages` checks packages at the same time, and only installs the missing ones
+    """
+    installs = []
+    checking = []
+    overlapped = threading.Event()
+
+    @dataclass(kw_only=True)
+    class FakePackage(Package):
+        @property
+        def is_installed(self) -> bool:
+            checking.append(self.name)
+            if len(checking) > 1:
+                overlapped.set()
+            overlapped.wait(timeout=2)
+            time.sleep(0.05)
+            return self.name.startswith("have")
+
+        def install(self) -> bool:
+            installs.append(self.name)
+            return True
+
+    packages = [FakePackage(name=name) for name in ("have-a", "need-b", "have-c")]
+    monkeypatch.setattr(package_module, "load_packages", lambda: packages)
+
+    package_module.install_packages()
+
+    assert overlapped.is_set()
+    assert installs == ["need-b"]
@@ -0,0 +1,68 @@
+import pstats
+import time
+
+import pytest
+
+from strappy.profiling import (
+    PhaseProfiler,
+    import_totals,
+    parse_importtime,
+    profile_mode,
+)
+from strappy.scheduler import Phase, run_phases
+
+
+def _busy_phase():
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def test_profile_mode_parses_env_values():
+    assert profile_mode(None) is None
+    assert profile_mode("0") is None
+    assert profile_mode("1") == "cprofile"
+    assert profile_mode("sample") == "sample"
+    with pytest.raises(ValueError):
+        profile_mode("perf")
+
+
+@pytest.mark.parametrize("mode", ["cprofile", "sample"])
+def test_phase_profiler_writes_stats_and_stacks(tmp_path, mode):
+    profiler = PhaseProfiler(mode, tmp_path, "20260101_000000")
+    phases = [profiler.wrap(Phase("busy", _busy_phase))]
+
+    with profiler:
+        results = run_phases(phases, max_workers=profiler.max_workers)
+
+    assert [result.status for result in results] == ["ok"]
+    collapsed = (tmp_path / "20260101_000000_busy.collapsed").read_text()
+    assert "_busy_phase (test_profiling.py:" in collapsed
+
+    stats_path = tmp_path / "20260101_000000_busy.pstats"
+    assert stats_path.exists() == (mode == "cprofile")
+    if mode == "cprofile":
+        functions = {name for _, _, name in pstats.Stats(str(stats_path)).stats}
+        assert "_busy_phase" in functions
+
+
+def test_parse_importtime_groups_self_time():
+    output = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       200 |        200 |     pydantic_core._pydantic_core",
+            "import time:       300 |        500 |   pydantic",
+            "import time:       100 |        100 |   strappy.util",
+            "import time:        50 |        650 | strappy",
+            "import time:        40 |         40 | config.brew_packages.nvm_package",
+            "import time:        10 |         10 | json",
+            "WARNING: unrelated log output",
+        ]
+    )
+    entries = parse_importtime(output)
+
+    assert entries[0] == ("pydantic_core._pydantic_core", 200, 200)
+    assert len(entries) == 6
+    assert import_totals(entries) == pytest.approx(
+        {"strappy": 0.00015, "pydantic": 0.0005, "plugins": 0.00004}
+    )
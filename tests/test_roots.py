@@ -0,0 +1,86 @@
+import logging
+import os
+
+import pytest
+
+from strappy.roots import (
+    RootResult,
+    chown_to_owner,
+    find_roots,
+    format_roots_report,
+    run_root,
+    run_roots,
+)
+
+
+def _touch_marker(root):
+    (root / "marker").write_text("done\n")
+    return RootResult(root=str(root), status="ok")
+
+
+def test_find_roots_skips_hidden_and_shared(tmp_path):
+    for name in ("alice", "bob", "Shared", ".hidden"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "file").write_text("")
+
+    assert find_roots(tmp_path) == [tmp_path / "alice", tmp_path / "bob"]
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "geteuid") or os.geteuid() != 0, reason="needs the superuser"
+)
+def test_chown_to_owner_covers_directory_contents_but_not_shared_files(tmp_path):
+    root = tmp_path / "alice"
+    skill = root / ".codex" / "skills" / "deslop"
+    (skill / "references").mkdir(parents=True)
+    (skill / "references" / "notes.md").write_text("")
+    blob = tmp_path / "blob"
+    blob.write_text("")
+    os.link(blob, root / ".zshrc.bak")
+    os.chown(root, 1234, 1234)
+
+    chown_to_owner(root, [skill, root / ".zshrc.bak"])
+
+    for path in (root / ".codex", skill, skill / "references" / "notes.md"):
+        assert path.stat().st_uid == 1234
+    assert blob.stat().st_uid == 0
+
+
+def test_run_root_captures_logs_and_failures(tmp_path):
+    def plan():
+        logging.getLogger("test").info("linking")
+        return False
+
+    result = run_root(tmp_path, plan)
+    assert result.status == "unchanged"
+    assert result.log == ("linking",)
+
+    def failing_plan():
+        raise OSError("read-only filesystem")
+
+    result = run_root(tmp_path, failing_plan)
+    assert result.status == "failed"
+    assert result.error == "read-only filesystem"
+
+
+def test_run_roots_keeps_root_order(tmp_path):
+    roots = [tmp_path / name for name in ("c", "a", "b")]
+    for root in roots:
+        root.mkdir()
+
+    results = run_roots(roots, _touch_marker, max_workers=2)
+
+    assert [result.root for result in results] == [str(root) for root in roots]
+    assert all((root / "marker").exists() for root in roots)
+
+
+def test_format_roots_report_counts_statuses():
+    report = format_roots_report(
+        [
+            RootResult(root="/home/alice", status="ok", seconds=1.0),
+            RootResult(root="/home/bob", status="failed", error="boom"),
+        ],
+        wall_seconds=1.5,
+    )
+    assert "2 root(s): 1 ok, 0 unchanged, 1 failed" in report
+    assert "(boom)" in report
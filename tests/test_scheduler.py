@@ -0,0 +1,99 @@
+import logging
+import threading
+
+import pytest
+
+from strappy.scheduler import Phase, format_summary, run_phases
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_run_phases_respects_dependencies_and_runs_independent_phases_together():
+    order = []
+    both_started = threading.Barrier(2, timeout=5)
+
+    def phase(name, wait=False):
+        def run():
+            if wait:
+                # only returns if the other independent phase is running at the same time
+                both_started.wait()
+            order.append(name)
+
+        return run
+
+    results = run_phases(
+        [
+            Phase("dotfiles", phase("dotfiles", wait=True)),
+            Phase("packages", phase("packages", wait=True)),
+            Phase("shell", phase("shell"), depends_on=("dotfiles", "packages")),
+        ]
+    )
+
+    assert [result.status for result in results] == ["ok", "ok", "ok"]
+    assert order[-1] == "shell"
+
+
+def test_run_phases_skips_dependents_of_failed_phase():
+    def fail():
+        raise RuntimeError("boom")
+
+    results = run_phases(
+        [
+            Phase("a", fail),
+            Phase("b", lambda: None, depends_on=("a",)),
+            Phase("c", lambda: None, depends_on=("b",)),
+            Phase("d", lambda: None),
+        ]
+    )
+
+    assert [result.status for result in results] == [
+        "failed",
+        "skipped",
+        "skipped",
+        "ok",
+    ]
+    assert results[0].error == "boom"
+    assert "failed" in format_summary(results, wall_seconds=1.0)
+
+
+def test_run_phases_buffers_phase_logs_into_one_block():
+    root_logger = logging.getLogger()
+    handler = _ListHandler()
+    root_logger.addHandler(handler)
+    logger = logging.getLogger("test_scheduler")
+    released = threading.Event()
+
+    def buffered():
+        logger.warning("buffered 1")
+        released.wait(timeout=5)
+        logger.warning("buffered 2")
+
+    def live():
+        logger.warning("live")
+        released.set()
+
+    try:
+        run_phases(
+            [Phase("buffered", buffered), Phase("live", live, buffer_logs=False)]
+        )
+    finally:
+        root_logger.removeHandler(handler)
+
+    assert handler.messages == ["live", "buffered 1", "buffered 2"]
+
+
+def test_run_phases_rejects_dependency_cycles():
+    with pytest.raises(ValueError):
+        run_phases(
+            [
+                Phase("a", lambda: None, depends_on=("b",)),
+                Phase("b", lambda: None, depends_on=("a",)),
+            ]
+        )
@@ -0,0 +1,130 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import strappy.bootstrap as bootstrap
+from strappy.managed_block import render_block
+from strappy.shell_bench import (
+    ShellBench,
+    format_bench,
+    is_regression,
+    load_baseline,
+    measure_shell,
+    parse_trace,
+    percentile,
+    save_baseline,
+)
+
+
+def _write_zshrc(home):
+    home.mkdir(parents=True, exist_ok=True)
+    zshrc = home / ".zshrc"
+    zshrc.write_text(
+        "\n".join(["export A=1", *render_block("alias ll='ls -l'\nsource ~/init.zsh")])
+        + "\n"
+    )
+    return zshrc
+
+
+def _fake_zsh(path, script):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f"#!/bin/sh\n{script}\n")
+    path.chmod(0o755)
+    return path
+
+
+def test_percentile():
+    assert percentile([0.3], 95) == 0.3
+    assert percentile([0.1, 0.2, 0.3, 0.4, 0.5], 50) == 0.3
+    assert percentile([0.1, 0.2], 50) == pytest.approx(0.15)
+    assert percentile(list(range(101)), 95) == 95
+
+
+def test_parse_trace_attributes_time_to_zshrc_lines(tmp_path):
+    zshrc = _write_zshrc(tmp_path / "home")
+    trace = "\n".join(
+        [
+            "+strappy:100.000000:/etc/zshrc:1> setopt foo",
+            f"+strappy:100.010000:{zshrc}:1> export A=1",
+            f"+strappy:100.011000:{zshrc}:4> source ~/init.zsh",
+            # time spent in the sourced file belongs to the line that sourced it
+            "+strappy:100.012000:/home/init.zsh:1> bindkey x",
+            "not a trace line",
+            f"+strappy:100.050000:{zshrc}:3> alias ll='ls -l'",
+            "+strappy:100.052000:zsh:1> exit",
+        ]
+    )
+
+    costs = parse_trace(trace, zshrc)
+
+    assert costs == {
+        1: pytest.approx(0.001),
+        4: pytest.approx(0.039),
+        3: pytest.approx(0.002),
+    }
+
+
+def test_is_regression():
+    baseline = ShellBench(samples=(0.1,), p50=0.1, p95=0.1)
+    assert is_regression(ShellBench(samples=(0.2,), p50=0.2, p95=0.2), baseline, 0.2)
+    assert not is_regression(
+        ShellBench(samples=(0.11,), p50=0.11, p95=0.11), baseline, 0.2
+    )
+    # slower by more than the threshold, but within the noise floor
+    fast = ShellBench(samples=(0.002,), p50=0.002, p95=0.002)
+    assert not is_regression(
+        ShellBench(samples=(0.004,), p50=0.004, p95=0.004), fast, 0.2
+    )
+
+
+def test_baseline_round_trip(tmp_path):
+    zsh = _fake_zsh(tmp_path / "bin" / "zsh", "exit 0")
+    home = tmp_path / "home"
+    _write_zshrc(home)
+
+    bench = measure_shell(zsh, home, runs=3, trace_runs=1)
+    path = tmp_path / "logs" / "shell_bench.json"
+    save_baseline(path, bench)
+
+    assert load_baseline(path) == bench
+    assert len(bench.samples) == 3
+    assert bench.block is not None
+    assert "p50" in format_bench(bench, bench)
+
+
+def test_bench_shell_fails_on_regression(tmp_path, monkeypatch):
+    home = tmp_path / "home"
+    _write_zshrc(home)
+    log_dir = tmp_path / "logs"
+    zsh = _fake_zsh(tmp_path / "bin" / "zsh", "exit 0")
+
+    monkeypatch.setattr(bootstrap, "HOME", home)
+    monkeypatch.setattr(bootstrap, "LOG_DIR", log_dir)
+    monkeypatch.setattr(bootstrap, "find_tool", lambda name: zsh)
+
+    # the first run saves the baseline
+    assert bootstrap.bench_shell(runs=3, trace_runs=0) == 0
+    baseline = load_baseline(log_dir / bootstrap.SHELL_BENCH_FILE)
+    assert baseline is not None
+
+    _fake_zsh(zsh, "sleep 0.1")
+    assert bootstrap.bench_shell(runs=3, trace_runs=0) == 1
+    # a regression doesn't replace the baseline
+    assert load_baseline(log_dir / bootstrap.SHELL_BENCH_FILE) == baseline
+
+    assert bootstrap.bench_shell(runs=3, trace_runs=0, update_baseline=True) == 1
+    assert load_baseline(log_dir / bootstrap.SHELL_BENCH_FILE).p50 > baseline.p50
+
+
+@pytest.mark.skipif(shutil.which("zsh") is None, reason="zsh is not installed")
+def test_measure_shell_traces_managed_block(tmp_path):
+    home = tmp_path / "home"
+    zshrc = _write_zshrc(home)
+    zshrc.write_text(zshrc.read_text().replace("source ~/init.zsh", "sleep 0.05"))
+
+    bench = measure_shell(Path(shutil.which("zsh")), home, runs=3, trace_runs=1)
+
+    costs = {cost.text: cost.seconds for cost in bench.lines}
+    assert costs["sleep 0.05"] >= 0.05
+    assert "export A=1" not in costs
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from strappy import shell_init
+from strappy.shell_init import (
+    compiled_path,
+    init_path,
+    recorded_digest,
+    tool_versions,
+    write_init,
+)
+
+
+def _write_tool(path, script):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f"#!/bin/sh\n{script}\n")
+    path.chmod(0o755)
+
+
+@pytest.fixture
+def tools(tmp_path, monkeypatch):
+    """A `PATH` with only a fake fzf, and no Homebrew prefixes to fall back to"""
+    bin_dir = tmp_path / "bin"
+    _write_tool(bin_dir / "fzf", "echo 'bindkey fzf-widget'")
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.setattr(shell_init, "BREW_PREFIXES", [])
+    return bin_dir
+
+
+def test_write_init_renders_fzf_and_press_and_hold(tmp_path, tools):
+    home = tmp_path / "home"
+
+    assert write_init(home)
+
+    text = init_path(home).read_text()
+    assert text.startswith(shell_init.HEADER_PREFIX)
+    assert "bindkey fzf-widget" in text
+    assert "defaults write -g ApplePressAndHoldEnabled -bool false" in text
+    # nvm isn't installed, so there are no stubs
+    assert "_strappy_load_nvm" not in text
+
+
+def test_write_init_adds_lazy_nvm_stubs(tmp_path, tools):
+    home = tmp_path / "home"
+    (home / ".nvm").mkdir(parents=True)
+    (home / ".nvm" / "nvm.sh").write_text("nvm() { :; }\n")
+
+    write_init(home)
+
+    text = init_path(home).read_text()
+    for command in shell_init.NVM_COMMANDS:
+        assert f'{command}() {{ _strappy_load_nvm; {command} "$@"; }}' in text
+
+
+def test_write_init_only_renders_when_tools_change(tmp_path, tools):
+    home = tmp_path / "home"
+    assert write_init(home)
+    digest = recorded_digest(home)
+
+    assert not write_init(home)
+
+    # an upgrade changes the binary
+    _write_tool(tools / "fzf", "echo 'bindkey fzf-widget-v2'")
+    assert recorded_digest(home) == digest
+    assert write_init(home)
+    assert recorded_digest(home) != digest
+    assert "fzf-widget-v2" in init_path(home).read_text()
+
+
+def test_write_init_compiles_with_zsh(tmp_path, tools):
+    # stands in for `zsh -f -c 'zcompile "$1"' zsh <init file>`
+    _write_tool(tools / "zsh", ': > "$5.zwc"')
+    home = tmp_path / "home"
+
+    assert write_init(home)
+    assert compiled_path(home).exists()
+    assert tool_versions(home)["zsh"] is not None
+
+    # a missing `.zwc` is compiled again, even though the init file is up to date
+    os.remove(compiled_path(home))
+    assert write_init(home)
+    assert compiled_path(home).exists()
+
+
+def test_write_init_without_fzf(tmp_path, tools):
+    os.remove(tools / "fzf")
+    home = tmp_path / "home"
+
+    write_init(home)
+
+    assert "fzf" not in init_path(home).read_text().split("\n", 2)[2]
@@ -0,0 +1,51 @@
+from strappy.state import compute_fingerprint, load_fingerprint, save_fingerprint
+
+
+def test_fingerprint_tracks_sources_destinations_and_constants(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "a.txt").write_text("a")
+    destination = tmp_path / "dest"
+
+    def fingerprint(constants=None):
+        return compute_fingerprint([source], [destination], constants or {"x": [1]})
+
+    baseline = fingerprint()
+    assert fingerprint() == baseline
+    assert fingerprint({"x": [2]}) != baseline
+
+    destination.symlink_to(source)
+    linked = fingerprint()
+    assert linked != baseline
+
+    (source / "b.txt").write_text("b")
+    assert fingerprint() != linked
+
+
+def test_fingerprint_tracks_edits_inside_copied_destinations(tmp_path):
+    copy = tmp_path / "skill"
+    (copy / "references").mkdir(parents=True)
+    notes = copy / "references" / "notes.md"
+    notes.write_text("a")
+    blocked = tmp_path / "file" / "below"
+    (tmp_path / "file").write_text("")
+
+    def fingerprint():
+        return compute_fingerprint([], [copy, blocked], {})
+
+    baseline = fingerprint()
+    assert fingerprint() == baseline
+
+    notes.write_text("ab")
+    assert fingerprint() != baseline
+
+
+def test_fingerprint_state_round_trip(tmp_path):
+    state_path = tmp_path / "state.json"
+    assert load_fingerprint(state_path) is None
+
+    save_fingerprint(state_path, "abc123")
+    assert load_fingerprint(state_path) == "abc123"
+
+    state_path.write_text("not json")
+    assert load_fingerprint(state_path) is None
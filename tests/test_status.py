@@ -0,0 +1,84 @@
+from strappy.managed_block import apply_block
+from strappy.mirror import mirror_tree
+from strappy.package import BrewInventory, BrewPackage
+from strappy.status import check_target, scan_status
+from strappy.targets import Target
+
+
+def test_check_target_reports_each_state(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    home = tmp_path / "home"
+    home.mkdir()
+
+    (home / "linked").symlink_to(source)
+    (home / "wrong").symlink_to(tmp_path)
+    (home / "copied").mkdir()
+
+    def state(name, mode="link"):
+        return check_target(Target(home / name, source, mode)).state
+
+    assert state("linked") == "ok"
+    assert state("missing") == "missing"
+    assert state("wrong") == "drifted"
+    assert state("copied") == "foreign"
+    assert state("copied", mode="create") == "ok"
+
+
+def test_check_target_checks_managed_block(tmp_path):
+    source = tmp_path / "zshrc"
+    source.write_text("alias ll='ls -l'\n")
+    destination = tmp_path / ".zshrc"
+    target = Target(destination, source, "append")
+
+    destination.write_text("export A=1\n")
+    assert check_target(target).detail == "no managed block"
+
+    destination.write_text(apply_block("export A=1\n", source.read_text()))
+    assert check_target(target).state == "ok"
+
+    destination.write_text(destination.read_text().replace("ll=", "la="))
+    assert check_target(target).detail == "managed block edited by hand"
+
+    destination.write_text(apply_block("export A=1\n", "alias old=1\n"))
+    assert check_target(target).detail == "managed block out of date"
+
+
+def test_scan_status_uses_inventory_for_packages(tmp_path):
+    inventory = BrewInventory(formulae=frozenset({"git"}), casks=frozenset({"iterm2"}))
+    entries = scan_status(
+        targets=[Target(tmp_path / "missing", tmp_path)],
+        packages=[
+            BrewPackage(name="git"),
+            BrewPackage(name="iterm2", use_cask=True),
+            BrewPackage(name="wget"),
+        ],
+        inventory=inventory,
+    )
+
+    assert [(entry.kind, entry.state) for entry in entries] == [
+        ("dotfile", "missing"),
+        ("package", "ok"),
+        ("package", "ok"),
+        ("package", "missing"),
+    ]
+
+
+def test_check_target_checks_copies(tmp_path):
+    source = tmp_path / "skill"
+    source.mkdir()
+    (source / "SKILL.md").write_text("# Skill\n")
+    destination = tmp_path / "copy"
+    target = Target(destination, source, "copy")
+
+    assert check_target(target).state == "missing"
+
+    destination.symlink_to(source)
+    assert check_target(target).detail == "symlink, expected a copy"
+
+    destination.unlink()
+    mirror_tree(source, destination)
+    assert check_target(target).state == "ok"
+
+    (source / "SKILL.md").write_text("# Skill, updated\n")
+    assert check_target(target).state == "drifted"
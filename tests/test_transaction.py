@@ -0,0 +1,151 @@
+import json
+
+import pytest
+
+from strappy.backup import BackupStore
+from strappy.transaction import Transaction
+
+
+def _transaction(tmp_path):
+    return Transaction(
+        "run1", BackupStore(tmp_path / "backups"), tmp_path / "transactions"
+    )
+
+
+def test_failed_apply_rolls_back_applied_operations(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("new\n")
+    home = tmp_path / "home"
+    home.mkdir()
+    first = home / "first.txt"
+    first.write_text("old\n")
+    # a file in place of the parent directory makes the second operation fail
+    (home / "blocked").write_text("")
+
+    transaction = _transaction(tmp_path)
+    transaction.link(first, source)
+    transaction.link(home / "blocked" / "second.txt", source)
+
+    with pytest.raises(OSError):
+        transaction.apply()
+
+    assert not first.is_symlink()
+    assert first.read_text() == "old\n"
+    assert sorted(path.name for path in home.iterdir()) == ["blocked", "first.txt"]
+    assert not list((tmp_path / "transactions").glob("*.json"))
+
+
+def test_apply_replaces_destination_and_keeps_bak(tmp_path):
+    home = tmp_path / "home"
+    home.mkdir()
+    destination = home / ".zshrc"
+    destination.write_text("old\n")
+
+    transaction = _transaction(tmp_path)
+    transaction.write_text(destination, "new\n")
+    transaction.apply()
+
+    assert destination.read_text() == "new\n"
+    assert (home / ".zshrc.bak").read_text() == "old\n"
+    assert sorted(path.name for path in home.iterdir()) == [".zshrc", ".zshrc.bak"]
+
+
+def test_apply_copies_bak_and_records_backups_in_one_write(tmp_path, monkeypatch):
+    home = tmp_path / "home"
+    home.mkdir()
+    destination = home / ".zshrc"
+    destination.write_text("old\n")
+    (home / ".zshrc.bak").write_text("older\n")
+
+    store = BackupStore(tmp_path / "backups")
+    records = []
+    record = store.record
+    monkeypatch.setattr(
+        store, "record", lambda *args: records.append(args) or record(*args)
+    )
+    transaction = Transaction("run1", store, tmp_path / "transactions")
+    transaction.write_text(destination, "new\n")
+    transaction.write_text(home / "new.txt", "new\n")
+    transaction.apply()
+
+    bak = home / ".zshrc.bak"
+    assert bak.read_text() == "old\n"
+    # not a hard link to the store's blob, which changing the .bak would change too
+    assert bak.stat().st_nlink == 1
+    assert len(records) == 1
+    assert [entry["path"] for entry in store.load_manifest("run1")["entries"]] == [
+        str(destination),
+        str(home / "new.txt"),
+        str(bak),
+    ]
+
+
+def test_recover_rolls_back_crashed_transaction(tmp_path):
+    home = tmp_path / "home"
+    home.mkdir()
+    destination = home / "config.toml"
+    aside = home / ".config.toml.strappy-old"
+    aside.write_text("old\n")
+    destination.symlink_to(tmp_path / "new.toml")
+
+    journal_dir = tmp_path / "transactions"
+    journal_dir.mkdir()
+    (journal_dir / "run1_crashed.json").write_text(
+        json.dumps(
+            {
+                "run_id": "run1",
+                "status": "applying",
+                "operations": [
+                    {
+                        "kind": "link",
+                        "destination": str(destination),
+                        "state": "applied",
+                        "existed": True,
+                    }
+                ],
+            }
+        )
+    )
+
+    assert Transaction.recover(BackupStore(tmp_path / "backups"), journal_dir) == 1
+    assert not destination.is_symlink()
+    assert destination.read_text() == "old\n"
+    assert not aside.exists()
+    assert not list(journal_dir.glob("*.json"))
+
+
+def test_failed_apply_restores_directory_synced_in_place(tmp_path):
+    source = tmp_path / "skill"
+    source.mkdir()
+    (source / "SKILL.md").write_text("new\n")
+    home = tmp_path / "home"
+    destination = home / "skill"
+    destination.mkdir(parents=True)
+    (destination / "SKILL.md").write_text("old\n")
+    (destination / "extra.md").write_text("extra\n")
+    (home / "blocked").write_text("")
+
+    transaction = _transaction(tmp_path)
+    transaction.sync(destination, source)
+    transaction.link(home / "blocked" / "second.txt", source)
+
+    with pytest.raises(OSError):
+        transaction.apply()
+
+    assert (destination / "SKILL.md").read_text() == "old\n"
+    assert (destination / "extra.md").read_text() == "extra\n"
+    assert sorted(path.name for path in home.iterdir()) == ["blocked", "skill"]
+
+    # the journal of a crashed sync has what's needed to restore it
+    transaction = _transaction(tmp_path)
+    transaction.sync(destination, source)
+    transaction.apply()
+    assert sorted(path.name for path in destination.iterdir()) == ["SKILL.md"]
+    transaction._write_journal("applying")
+    assert (
+        Transaction.recover(
+            BackupStore(tmp_path / "backups"), tmp_path / "transactions"
+        )
+        == 1
+    )
+    assert (destination / "extra.md").read_text() == "extra\n"
@@ -0,0 +1,65 @@
+import sys
+import threading
+
+import pytest
+
+from strappy.watch import diff, snapshot, watch_tree
+
+
+def test_snapshot_diff_reports_added_removed_and_changed_paths(tmp_path):
+    (tmp_path / "keep.md").write_text("keep")
+    (tmp_path / "edit.md").write_text("a")
+    (tmp_path / "gone.md").write_text("gone")
+    (tmp_path / "__pycache__").mkdir()
+    before = snapshot(tmp_path)
+
+    (tmp_path / "edit.md").write_text("ab")
+    (tmp_path / "gone.md").unlink()
+    (tmp_path / "skill").mkdir()
+    (tmp_path / "skill" / "SKILL.md").write_text("new")
+
+    assert diff(before, snapshot(tmp_path)) == {
+        tmp_path / "edit.md",
+        tmp_path / "gone.md",
+        tmp_path / "skill",
+        tmp_path / "skill" / "SKILL.md",
+    }
+
+
+@pytest.mark.parametrize(
+    "poll",
+    [
+        True,
+        pytest.param(
+            False,
+            marks=pytest.mark.skipif(
+                not sys.platform.startswith("linux"), reason="inotify is Linux only"
+            ),
+        ),
+    ],
+)
+def test_watch_tree_reports_debounced_changes(tmp_path, poll):
+    changes = []
+    stop = threading.Event()
+
+    def on_change(changed):
+        changes.append(changed)
+        stop.set()
+
+    watcher = threading.Thread(
+        target=watch_tree,
+        args=(tmp_path, on_change),
+        kwargs={"interval": 0.05, "debounce": 0.1, "poll": poll, "stop": stop},
+    )
+    watcher.start()
+    try:
+        # give the watcher time to take its first snapshot
+        threading.Event().wait(0.2)
+        (tmp_path / "one.md").write_text("1")
+        (tmp_path / "two.md").write_text("2")
+        watcher.join(timeout=5)
+    finally:
+        stop.set()
+        watcher.join(timeout=5)
+
+    assert changes == [{tmp_path / "one.md", tmp_path / "two.md"}]
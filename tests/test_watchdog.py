@@ -0,0 +1,140 @@
+import logging
+import subprocess
+import time
+
+import pytest
+
+from strappy import package as package_module
+from strappy import watchdog
+from strappy.package import Package, install_packages
+from strappy.watchdog import deadline, effective_timeout, run_watched
+
+
+@pytest.fixture
+def fast_watchdog(monkeypatch):
+    monkeypatch.setattr(watchdog.watchdog(), "heartbeat", 0.2)
+    monkeypatch.setattr(watchdog.watchdog(), "grace", 0.3)
+    monkeypatch.setattr(watchdog.watchdog(), "tick", 0.05)
+    return watchdog.watchdog()
+
+
+def test_run_watched_captures_output():
+    result = run_watched("echo out; echo err >&2", shell=True, capture_output=True)
+    assert result.returncode == 0
+    assert result.stdout == "out\n"
+    assert result.stderr == "err\n"
+
+
+def test_run_watched_raises_on_failure():
+    with pytest.raises(subprocess.CalledProcessError) as err:
+        run_watched("echo partial; exit 3", shell=True, capture_output=True)
+    assert err.value.returncode == 3
+    assert err.value.stdout == "partial\n"
+
+
+def test_run_watched_kills_background_processes_holding_output(monkeypatch):
+    monkeypatch.setattr(watchdog, "DRAIN_SECONDS", 0.2)
+
+    for capture_output in (True, False):
+        started = time.monotonic()
+        result = run_watched(
+            "sleep 8 & echo hi",
+            shell=True,
+            capture_output=capture_output,
+            timeout=5,
+        )
+        assert time.monotonic() - started < 3
+        assert result.returncode == 0
+        if capture_output:
+            assert result.stdout == "hi\n"
+
+
+def test_timeout_kills_process_group(fast_watchdog, tmp_path):
+    marker = tmp_path / "marker"
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        # the background child would create the marker if it survived its parent
+        run_watched(
+            f"(sleep 1 && touch {marker}) & echo started; wait",
+            shell=True,
+            capture_output=True,
+            timeout=0.3,
+        )
+    assert time.monotonic() - start < 1
+    time.sleep(1.2)
+    assert not marker.exists()
+
+
+def test_timeout_sends_sigkill_after_grace(fast_watchdog):
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_watched(
+            "trap '' TERM; while true; do sleep 0.05; done",
+            shell=True,
+            capture_output=True,
+            timeout=0.2,
+        )
+    assert time.monotonic() - start < 3
+
+
+def test_heartbeat_logs_last_line(fast_watchdog, caplog):
+    with caplog.at_level(logging.INFO, logger="Watchdog"):
+        run_watched(
+            "echo first; echo downloading; sleep 0.6",
+            shell=True,
+            capture_output=True,
+        )
+    heartbeats = [
+        record.message for record in caplog.records if "Still running" in record.message
+    ]
+    assert heartbeats
+    assert "'downloading'" in heartbeats[-1]
+
+
+def test_deadline_limits_timeout():
+    assert effective_timeout(5) == 5
+    with deadline(1):
+        assert effective_timeout(None) <= 1
+        assert effective_timeout(0.5) == 0.5
+        with deadline(10):
+            # nested blocks keep the sooner deadline
+            assert effective_timeout(None) <= 1
+        with deadline(None):
+            assert effective_timeout(None) <= 1
+    assert effective_timeout(None) is None
+
+
+def test_run_cmd_uses_command_timeout(fast_watchdog):
+    package = Package(name="slow", command_timeout=0.2)
+    with pytest.raises(subprocess.TimeoutExpired):
+        package.run_cmd(["sleep", "5"], capture_output=True)
+    # an explicit timeout wins over the package's
+    package.run_cmd(["sleep", "0.3"], capture_output=True, timeout=2)
+
+
+def test_install_packages_marks_timed_out_package_failed(
+    fast_watchdog, monkeypatch, caplog
+):
+    class SlowPackage(Package):
+        def install(self) -> bool:
+            # each command is within its own timeout, the package's total is not
+            self.run_cmd(["sleep", "0.3"], capture_output=True)
+            self.run_cmd(["sleep", "0.3"], capture_output=True)
+            return True
+
+    class FastPackage(Package):
+        def install(self) -> bool:
+            self.run_cmd(["true"], capture_output=True)
+            return True
+
+    monkeypatch.setattr(
+        package_module,
+        "load_packages",
+        lambda: [SlowPackage(name="slow", timeout=0.4), FastPackage(name="fast")],
+    )
+    with caplog.at_level(logging.INFO):
+        install_packages()
+
+    assert "Failed to install slow: 'sleep 0.3' timed out" in caplog.text
+    assert "Total packages installed: 1" in caplog.text
+    assert "Total packages failed: 1" in caplog.text